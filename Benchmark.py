@@ -0,0 +1,303 @@
+# Slide benchmark on sparse disk images, runs on Core.py alone so PyQt6 isn't needed.
+# Every case builds a sparse image with an MBR that read_mbr() can parse, fills the partition with
+# pseudo random data, runs one slide in a child process (so peak RSS and CPU time belong to that
+# slide alone) and then checks that the moved partition hashes the same as the original.
+#
+#   python Benchmark.py --sizes 256 1024 --displacements -64 1 512 --chunks 4 64 --engines pipelined kernel
+#
+# Sizes, displacements and chunks are in MiB, a negative displacement slides to the left.
+#
+#   python Benchmark.py --mbr 100000
+#
+# is a micro-benchmark of MBR parsing and entry patching instead: the struct parser in Core.py against the
+# hex string code it replaced, in memory, plus a check that only the 16 bytes of the moved entry change.
+#
+#   python Benchmark.py --plan-check
+#
+# plans and runs a move of a primary and a logical partition together on a small image and checks the data
+# and the partition tables afterwards (plan_moves() once choked on the mix of partitions and EBRs).
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+SECTOR = 512
+ALIGN = 1024 * 1024  # partitions start on a 1 MiB boundary like most partitioning tools do
+
+def make_image(path, part_start, part_bytes, disk_bytes, seed):
+    # Sparse image: MBR, one partition of random data, holes everywhere else. Returns the partition hash
+    with open(path, 'wb') as f:
+        f.truncate(disk_bytes)
+        mbr = bytearray(512)
+        entry = struct.pack('<B3sB3sII', 0x00, b'\xfe\xff\xff', 0x83, b'\xfe\xff\xff',
+                            part_start // SECTOR, part_bytes // SECTOR)
+        mbr[446:462] = entry
+        mbr[510:512] = b'\x55\xaa'
+        f.write(mbr)
+
+        h = hashlib.sha256()
+        rng = random.Random(seed)
+        f.seek(part_start)
+        left = part_bytes
+        while left:
+            block = rng.randbytes(min(left, 8 * 1024 * 1024))
+            f.write(block)
+            h.update(block)
+            left -= len(block)
+        f.flush()
+        os.fsync(f.fileno())
+        if hasattr(os, 'posix_fadvise'):  # start every case with a cold page cache for the image
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    return h.hexdigest()
+
+def hash_range(path, start, size):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        f.seek(start)
+        left = size
+        while left:
+            block = f.read(min(left, 8 * 1024 * 1024))
+            if not block:
+                break
+            h.update(block)
+            left -= len(block)
+    return h.hexdigest()
+
+def legacy_parse(rawB):
+    # How read_mbr() used to parse: hex string of the sector, sliced by character offsets
+    import Core
+    rawH = rawB.hex()
+    table = rawH[892:1020]
+    parts = []
+    for i in range(0, 128, 32):
+        raw = table[i:i + 32]
+        if raw != "0" * 32:
+            parts.append([raw[2:4], raw[4:6], raw[6:8], raw[8:10], raw[10:12], raw[12:14], raw[14:16],
+                          Core.le(raw[16:24]), Core.le(raw[24:32])])
+    return rawH, table, parts
+
+def legacy_patch(rawH, table, slot, new_first):
+    # How update_mbr() used to patch: str.replace of the entry's hex text over the whole sector
+    import Core
+    ptable = table[slot * 32:slot * 32 + 32]
+    ptable_new = ptable.replace(ptable[16:24], (Core.el(new_first)).ljust(8, "0"))
+    return bytes.fromhex(rawH.replace(ptable, ptable_new))
+
+def mbr_bench(rounds):
+    import Core
+    sector = bytearray(random.Random(0).randbytes(512))  # boot code is just noise here
+    entries = [(0x80, 2048, 204800, 0x07), (0x00, 206848, 4194304, 0x83), (0x00, 4401152, 1048576, 0x0c)]
+    for slot, (status, first, sectors, type_byte) in enumerate(entries):
+        sector[446 + slot * 16:462 + slot * 16] = struct.pack('<B3sB3sII', status, Core.lba_to_chs(first), type_byte,
+                                                              Core.lba_to_chs(first + sectors - 1), first, sectors)
+    sector[446 + 48:462 + 48] = bytes(16)
+    sector[510:512] = b'\x55\xaa'
+    new_first = 4096
+
+    timings = {}
+    for name, parse, patch in (
+            ("hex", lambda: legacy_parse(bytes(sector)),
+             lambda: legacy_patch(*legacy_parse(bytes(sector))[:2], 1, new_first)),
+            ("struct", lambda: Core.parse_mbr(sector),
+             lambda: Core.patch_mbr_entry(bytearray(sector), Core.parse_mbr(sector)[1], new_first))):
+        for step, func in (("parse", parse), ("patch", patch)):
+            start = time.perf_counter()
+            for _ in range(rounds):
+                func()
+            timings[f"{name}_{step}_us"] = (time.perf_counter() - start) / rounds * 1e6
+
+    # Exactness: copy entry 1 into the boot code, like a boot loader that keeps its own copy of the table
+    sector[100:116] = sector[462:478]
+    patched = bytearray(sector)
+    Core.patch_mbr_entry(patched, Core.parse_mbr(sector)[1], new_first)
+    changed = [i for i in range(512) if patched[i] != sector[i]]
+    legacy = legacy_patch(*legacy_parse(bytes(sector))[:2], 1, new_first)
+    legacy_changed = [i for i in range(512) if legacy[i] != sector[i]]
+    result = dict(timings, rounds=rounds,
+                  struct_only_entry_changed=all(462 <= i < 478 for i in changed),
+                  hex_only_entry_changed=all(462 <= i < 478 for i in legacy_changed))
+    print(f"parse: hex {timings['hex_parse_us']:.2f} us, struct {timings['struct_parse_us']:.2f} us "
+          f"({timings['hex_parse_us'] / timings['struct_parse_us']:.1f}x)")
+    print(f"parse + patch: hex {timings['hex_patch_us']:.2f} us, struct {timings['struct_patch_us']:.2f} us "
+          f"({timings['hex_patch_us'] / timings['struct_patch_us']:.1f}x)")
+    print(f"only the moved entry changed: hex {result['hex_only_entry_changed']}, struct {result['struct_only_entry_changed']}")
+    return result
+
+def mbr_entry(status, first, sectors, type_byte, base=0):
+    import Core
+    return struct.pack('<B3sB3sII', status, Core.lba_to_chs(base + first), type_byte,
+                       Core.lba_to_chs(base + first + sectors - 1), first, sectors)
+
+def plan_check():
+    # Primary partition at 2048 moving right, logical partition in an extended one moving left towards its EBR,
+    # as one plan. True when both hold their data at the new place and the MBR and EBR say so
+    import Core
+    workdir = tempfile.mkdtemp(prefix="slideplan_")
+    image = os.path.join(workdir, "plan.img")
+    Core.JOURNAL_DIR = workdir
+    ext_first, ext_sectors, gap, logical_sectors = 8192, 8192, 64, 2048
+    try:
+        with open(image, 'wb') as f:
+            f.truncate((ext_first + ext_sectors + 2048) * SECTOR)
+            mbr = bytearray(512)
+            mbr[446:462] = mbr_entry(0x80, 2048, 4096, 0x83)
+            mbr[462:478] = mbr_entry(0x00, ext_first, ext_sectors, 0x0f)
+            mbr[510:512] = b'\x55\xaa'
+            f.write(mbr)
+            ebr = bytearray(512)
+            ebr[446:462] = mbr_entry(0x00, gap, logical_sectors, 0x83, ext_first)
+            ebr[510:512] = b'\x55\xaa'
+            f.seek(ext_first * SECTOR)
+            f.write(ebr)
+            primary = random.Random(1).randbytes(4096 * SECTOR)
+            logical = random.Random(2).randbytes(logical_sectors * SECTOR)
+            f.seek(2048 * SECTOR)
+            f.write(primary)
+            f.seek((ext_first + gap) * SECTOR)
+            f.write(logical)
+
+        with contextlib.redirect_stdout(sys.stderr):
+            parts = Core.read_mbr(image)[4]
+            primary_index = next(i for i, p in enumerate(parts) if p[12] is None and p[8] == 2048)
+            logical_index = next(i for i, p in enumerate(parts) if p[12] is not None)
+            targets = {primary_index: 4096, logical_index: ext_first + gap // 2}
+            steps = Core.mbr_plan(Core.read_mbr(image), targets)
+            journal = Core.SlideJournal(image, {"plan": steps, "moves": [[i, n] for i, n in sorted(targets.items())],
+                                                "sector_size": SECTOR, "logical_sector_size": SECTOR})
+            Core.PlanRunner(image, steps, SECTOR, journal=journal).run()
+            ok, message = Core.finish_journal(journal)
+            parts = Core.read_mbr(image)[4]
+
+        moved = {p[8] for p in parts}
+        checks = {
+            "table_updated": ok and {4096, ext_first + gap // 2} <= moved,
+            "primary_data": hashlib.sha256(primary).hexdigest() == hash_range(image, 4096 * SECTOR, len(primary)),
+            "logical_data": hashlib.sha256(logical).hexdigest() == hash_range(image, (ext_first + gap // 2) * SECTOR,
+                                                                              len(logical)),
+        }
+        print(f"plan of {len(steps)} steps: {message}, " + ", ".join(f"{k} {v}" for k, v in checks.items()))
+        return all(checks.values())
+    finally:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+
+def run_case(case):
+    # Runs inside the child process: one slide, timed, nothing else
+    with contextlib.redirect_stdout(sys.stderr):  # Core prints a lot, keep stdout for the result
+        import Core
+        mbr = Core.read_mbr(case["image"])
+        entry = mbr[4][0]
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        reports = []
+        worker = Core.SlideRunner(entry[8], entry[10], case["new_first"], case["image"], SECTOR,
+                                 direct_io=case["direct"], memory_limit=case["memory_limit"],
+                                 engine=case["engine"], queue_depth=case["queue_depth"],
+                                 chunk_size=case["chunk"], durability=case["durability"])
+        worker.on_report = reports.append
+
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        worker.run()
+        seconds = time.perf_counter() - start
+        after = resource.getrusage(resource.RUSAGE_SELF)
+
+    return {
+        "seconds": seconds,
+        "cpu_user": after.ru_utime - usage.ru_utime,
+        "cpu_system": after.ru_stime - usage.ru_stime,
+        "rss_before_kib": rss_before,
+        "peak_rss_kib": after.ru_maxrss,
+        "report": reports[-1] if reports else "",
+    }
+
+def bench(args):
+    workdir = args.dir or tempfile.mkdtemp(prefix="slidebench_")
+    image = os.path.join(workdir, "bench.img")
+    results = []
+    cases = [(size, disp, chunk, engine, durability) for size in args.sizes for disp in args.displacements
+             for chunk in args.chunks for engine in args.engines for durability in args.durability]
+    try:
+        for n, (size, disp, chunk, engine, durability) in enumerate(cases, 1):
+            part_bytes = size * 1024 * 1024
+            shift = abs(disp) * 1024 * 1024
+            old_start = ALIGN + (shift if disp < 0 else 0)
+            new_start = ALIGN + (shift if disp > 0 else 0)
+            disk_bytes = ALIGN + shift + part_bytes + ALIGN
+            for repeat in range(args.repeat):
+                source_hash = make_image(image, old_start, part_bytes, disk_bytes, seed=n)
+                case = {"image": image, "new_first": new_start // SECTOR, "engine": engine, "durability": durability,
+                        "chunk": chunk * 1024 * 1024, "direct": args.direct, "queue_depth": args.queue_depth,
+                        "memory_limit": max(chunk * 1024 * 1024 * (args.queue_depth + 1), args.memory_limit * 1024 * 1024)}
+                child = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)],
+                                       capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+                if child.returncode != 0:
+                    print(child.stderr, file=sys.stderr)
+                    result = {"error": child.stderr.strip().splitlines()[-1] if child.stderr.strip() else "failed"}
+                else:
+                    result = json.loads(child.stdout.strip().splitlines()[-1])
+                    result["correct"] = hash_range(image, new_start, part_bytes) == source_hash
+                    result["mib_per_s"] = size / result["seconds"] if result["seconds"] > 0 else 0
+
+                result.update(size_mib=size, displacement_mib=disp, chunk_mib=chunk, engine=engine, durability=durability,
+                              direct=args.direct, queue_depth=args.queue_depth, repeat=repeat)
+                results.append(result)
+                status = "OK" if result.get("correct") else "FAILED"
+                print(f"[{n}/{len(cases)}] {size} MiB, shift {disp:+} MiB, chunk {chunk} MiB, {engine}, {durability}: "
+                      f"{result.get('mib_per_s', 0):.1f} MiB/s, peak RSS {result.get('peak_rss_kib', 0) // 1024} MiB, "
+                      f"CPU {result.get('cpu_user', 0) + result.get('cpu_system', 0):.2f}s {status}")
+    finally:
+        if os.path.exists(image):
+            os.remove(image)
+        if not args.dir:
+            os.rmdir(workdir)
+
+    with open(args.output, 'w') as f:
+        json.dump({"python": sys.version.split()[0], "platform": platform.platform(),
+                   "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, indent=1)
+    print(f"Results written to {args.output}")
+    return all(r.get("correct") for r in results)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark partition slides on sparse image files")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 512], help="partition sizes in MiB")
+    parser.add_argument("--displacements", type=int, nargs="+", default=[-128, -1, 1, 128],
+                        help="displacements in MiB, negative slides left")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[4, 64], help="chunk sizes in MiB")
+    parser.add_argument("--engines", nargs="+", default=["pipelined"], choices=["pipelined", "kernel", "concurrent"])
+    parser.add_argument("--durability", nargs="+", default=["chunk"], choices=["chunk", "bytes", "writeback", "final"],
+                        help="when the slide syncs its writes, see Durability in Core.py")
+    parser.add_argument("--queue-depth", type=int, default=4)
+    parser.add_argument("--memory-limit", type=int, default=512, help="buffer memory ceiling in MiB")
+    parser.add_argument("--direct", action="store_true", help="ask for O_DIRECT")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--dir", help="where to put the image (default: a temporary directory)")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--mbr", type=int, metavar="ROUNDS", help="run the MBR parse/patch micro-benchmark instead")
+    parser.add_argument("--plan-check", action="store_true",
+                        help="check a move plan of a primary and a logical partition instead")
+    parser.add_argument("--case", help=argparse.SUPPRESS)  # internal, runs one case in this process
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case))))
+    elif args.plan_check:
+        sys.exit(0 if plan_check() else 1)
+    elif args.mbr:
+        result = mbr_bench(args.mbr)
+        with open(args.output, 'w') as f:
+            json.dump({"python": sys.version.split()[0], "platform": platform.platform(),
+                       "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "mbr": result}, f, indent=1)
+        sys.exit(0 if result["struct_only_entry_changed"] else 1)
+    else:
+        sys.exit(0 if bench(args) else 1)
@@ -0,0 +1,360 @@
+# Command line PartitionSlider, for servers and scripts. Only needs Core.py, PyQt6 doesn't have to be installed.
+#
+#   python CLI.py list
+#   python CLI.py mbr /dev/sdb
+#   python CLI.py slide /dev/sdb 1 2048 --engine kernel --verify
+#   python CLI.py slide /dev/sdb 1 2048 --dry-run --probe-write
+#   python CLI.py plan /dev/sdb 1=2048 2=1050624 --dry-run
+#   python CLI.py batch jobs.jsonl --verify
+#
+# Partition numbers are the ones Linux uses, 1-4 primary and 5 and up logical. Output is one JSON object per line on stdout, the debug prints go to stderr.
+import argparse
+import contextlib
+import json
+import os
+import sys
+import threading
+
+import Core
+
+EMIT_LOCK = threading.Lock()  # progress comes from the copy threads
+
+def emit(out, event, **fields):
+    with EMIT_LOCK:
+        out.write(json.dumps(dict(event=event, **fields)) + "\n")
+        out.flush()
+
+def sector_sizes(disk_path, sector_size):
+    # (sector_size, logical_sector_size) for a disk, image files have no lsblk entry so they use 512. The sector
+    # numbers count logical sectors, the physical size only goes into the chunk sizes
+    if sector_size:
+        return sector_size, sector_size
+    for disk in Core.get_disks_and_sectors():
+        if disk[0] == disk_path:
+            return disk[1], disk[3]
+    return 512, 512
+
+def runner_options(args, state):
+    # The copy_options() arguments as SlideRunner keyword arguments
+    return dict(direct_io=args.direct, logical_sector_size=state["logical_sector_size"],
+                memory_limit=args.memory_limit * 1024 * 1024, used_only=args.used_only, verify=args.verify,
+                engine=args.engine, queue_depth=args.queue_depth,
+                chunk_size=args.chunk * 1024 * 1024 if args.chunk else None, metrics_path=args.metrics,
+                durability=args.durability, sync_bytes=args.sync_mib * 1024 * 1024, trace_path=args.trace)
+
+def slide_runner(args, journal):
+    state = journal.state
+    return Core.SlideRunner(state["old_first"], state["old_last"], state["new_first"], state["disk_path"],
+                            state["sector_size"], type_byte=state.get("type_byte"), journal=journal,
+                            **runner_options(args, state))
+
+def plan_runner(args, journal):
+    state = journal.state
+    return Core.PlanRunner(state["disk_path"], state["plan"], state["sector_size"], journal=journal,
+                           **runner_options(args, state))
+
+def run_slide(out, args, journal):
+    return run_runner(out, slide_runner(args, journal), journal)
+
+def run_plan(out, args, journal):
+    return run_runner(out, plan_runner(args, journal), journal)
+
+def dry_run(out, args, journal, runner):
+    # Probes how long the copy takes, the moves were checked when the journal was made. Writes nothing, not even
+    # the journal
+    if args.probe_seconds > 0:
+        result = runner.probe(args.probe_seconds, args.probe_write)
+        seconds = result["estimate_seconds"]
+        emit(out, "probe", eta=Core.format_eta(seconds) if seconds is not None else None, **result)
+    emit(out, "done", ok=True, dry_run=True)
+    return True
+
+def run_runner(out, runner, journal):
+    def progress(snapshot):
+        eta_seconds = snapshot["eta_seconds"]
+        emit(out, "progress", eta=Core.format_eta(eta_seconds) if eta_seconds is not None else None, **snapshot)
+
+    runner.on_metrics = progress
+    runner.on_report = lambda text: emit(out, "report", text=text)
+    runner.on_verify_failed = lambda offsets: emit(out, "verify_failed", offsets=offsets)
+    runner.run()
+    return finish(out, journal)
+
+def finish(out, journal, force=False):
+    # Same rule as the GUI: the partition table only changes once the journal says every chunk is on disk
+    status, step = journal.state.get("status"), journal.state.get("step")
+    ok, message = Core.finish_journal(journal, force)
+    if not ok:
+        emit(out, "done", ok=False, status=status, step=step, message=message)
+        return False
+    emit(out, "done", ok=True, status="copied")
+    return True
+
+def cmd_list(out, args):
+    for path, phys, sectors, logical, info in Core.get_disks_and_sectors():
+        if not sectors:  # get_disks_and_sectors() reports failures as a single entry with no sectors
+            emit(out, "error", message=path)
+            return False
+        emit(out, "disk", path=path, physical_sector_size=phys, sectors=sectors, logical_sector_size=logical, **info)
+    return True
+
+def cmd_mbr(out, args):
+    rawH, signature_disk, table, signature, partitions = Core.read_mbr(args.disk, sector_sizes(args.disk, None)[1])
+    emit(out, "mbr", disk=args.disk, disk_signature=signature_disk, signature=signature)
+    for p in partitions:
+        emit(out, "partition", number=p[11] + 1, type_byte=p[3], type=p[4], first_sector=p[8], total_sectors=p[9],
+             last_sector=p[10], logical=p[12] is not None, ebr_sector=p[12], limit_sector=p[13])
+    return True
+
+def cmd_gpt(out, args):
+    emit(out, "gpt", disk=args.disk, header=Core.read_gpt(args.disk))
+    return True
+
+def slide_journal(disk, partition, new_first, sector_size=None):
+    # A new journal for moving partition (the N in /dev/sdbN) to new_first, or the reason there can't be one
+    if os.path.exists(Core.SlideJournal(disk).path):
+        return None, f"{disk} has an unfinished slide, run 'resume' first"
+    sector_size, logical_sector_size = sector_sizes(disk, sector_size)
+    mbr_info = Core.read_mbr(disk, logical_sector_size)
+    partitions = mbr_info[4]
+    index = next((i for i, p in enumerate(partitions) if p[11] == partition - 1), None)
+    if index is None:
+        return None, f"No partition {partition} on {disk}"
+    entry = partitions[index]
+    # The GUI can't drag a partition anywhere it doesn't fit, here nothing else stops it
+    problems = Core.slide_problems(mbr_info, {index: new_first}, logical_sector_size, Core.disk_size(disk))
+    if problems:
+        return None, "; ".join(problems)
+    return Core.SlideJournal(disk, {
+        "part": index, "old_first": int(entry[8]), "old_last": int(entry[10]),
+        "new_first": new_first, "sector_size": sector_size,
+        "logical_sector_size": logical_sector_size, "type_byte": entry[3],
+        "expect": [[index, int(entry[8])]]}), None
+
+def plan_journal(disk, moves, sector_size=None, max_gap=0):
+    # Same for a move plan, moves is {partition: new_first}. The steps are in the journal's "plan"
+    if os.path.exists(Core.SlideJournal(disk).path):
+        return None, f"{disk} has an unfinished slide, run 'resume' first"
+    sector_size, logical_sector_size = sector_sizes(disk, sector_size)
+    mbr_info = Core.read_mbr(disk, logical_sector_size)
+    targets = {}
+    for number, new_first in moves.items():
+        index = next((i for i, p in enumerate(mbr_info[4]) if p[11] + 1 == number), None)
+        if index is None:
+            return None, f"No partition {number} on {disk}"
+        targets[index] = new_first
+    problems = Core.slide_problems(mbr_info, targets, logical_sector_size, Core.disk_size(disk))
+    if problems:
+        return None, "; ".join(problems)
+    try:
+        steps = Core.mbr_plan(mbr_info, targets, max_gap)
+    except Core.MovePlanError as e:
+        return None, str(e)
+    return Core.SlideJournal(disk, {
+        "plan": steps, "moves": [[i, new_first] for i, new_first in sorted(targets.items())],
+        "sector_size": sector_size, "logical_sector_size": logical_sector_size,
+        "expect": [[i, int(mbr_info[4][i][8])] for i in sorted(targets)]}), None
+
+def cmd_slide(out, args):
+    journal, message = slide_journal(args.disk, args.partition, args.new_first, args.sector_size)
+    if journal is None:
+        emit(out, "done", ok=False, message=message)
+        return False
+    if args.dry_run:
+        return dry_run(out, args, journal, slide_runner(args, journal))
+    return run_slide(out, args, journal)
+
+def cmd_plan(out, args):
+    moves = {}
+    for move in args.moves:
+        number, _, new_first = move.partition("=")
+        if not number.isdigit() or not new_first.isdigit():
+            emit(out, "done", ok=False, message=f"Bad move {move!r}, expected PARTITION=NEW_FIRST_SECTOR")
+            return False
+        moves[int(number)] = int(new_first)
+    journal, message = plan_journal(args.disk, moves, args.sector_size, args.max_gap)
+    if journal is None:
+        emit(out, "done", ok=False, message=message)
+        return False
+    steps = journal.state["plan"]
+    partitions = Core.read_mbr(args.disk, journal.state["logical_sector_size"])[4]
+    for n, (first, end, new_first, members, _) in enumerate(steps, 1):
+        emit(out, "step", step=n, first_sector=first, end_sector=end, new_first=new_first,
+             partitions=[partitions[m][11] + 1 for m in members if isinstance(m, int)])
+    if args.dry_run:
+        return dry_run(out, args, journal, plan_runner(args, journal))
+    return run_plan(out, args, journal)
+
+def cmd_batch(out, args):
+    # Every line of the jobs file is one job, {"disk": "/dev/sdb", "partition": 1, "new_first": 2048} or
+    # {"disk": "/dev/sdb", "moves": {"1": 2048, "5": 1050624}}. Jobs on different disks run side by side
+    jobs = []
+    with open(args.jobs) as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            if "moves" in job:
+                journal, message = plan_journal(job["disk"], {int(k): int(v) for k, v in job["moves"].items()},
+                                                job.get("sector_size"), args.max_gap)
+            else:
+                journal, message = slide_journal(job["disk"], int(job["partition"]), int(job["new_first"]),
+                                                 job.get("sector_size"))
+            if journal is None:
+                emit(out, "done", ok=False, job=n, message=message)
+                return False
+            jobs.append((n, journal))
+
+    numbers = {}
+
+    def on_event(job, event, data):
+        n = numbers[id(job)]
+        if event == "progress":
+            eta_seconds = data["eta_seconds"]
+            emit(out, "progress", job=n, eta=Core.format_eta(eta_seconds) if eta_seconds is not None else None, **data)
+            done_bytes, total_bytes, eta_seconds = queue.progress()
+            emit(out, "total", done_bytes=done_bytes, total_bytes=total_bytes, eta_seconds=eta_seconds,
+                 percent=int(done_bytes * 100 / total_bytes) if total_bytes else 100)
+        elif event == "report":
+            emit(out, "report", job=n, text=data)
+        elif event == "verify_failed":
+            emit(out, "verify_failed", job=n, offsets=data)
+        elif data in ("done", "failed"):
+            emit(out, "done", job=n, ok=data == "done", message=job.message)
+        else:
+            emit(out, "status", job=n, status=data, disk=job.disk_path, devices=sorted(job.devices))
+
+    options = runner_options(args, {"logical_sector_size": None})
+    del options["logical_sector_size"], options["memory_limit"]
+    queue = Core.SlideQueue(on_event, memory_limit=args.memory_limit * 1024 * 1024, max_parallel=args.parallel)
+    batch = []
+    for n, journal in jobs:
+        job = Core.SlideJob(journal, **options)
+        numbers[id(job)] = n
+        batch.append(job)
+    queue.add(*batch)  # together, so the jobs that start split the memory limit
+    queue.wait()
+    return all(job.status == "done" for job in queue.jobs)
+
+def resume_plan(out, args, journal):
+    state = journal.state
+    last_step = state.get("step", 0) == len(state["plan"]) - 1
+    if state.get("status") == "verify_failed":
+        if not args.force:
+            emit(out, "done", ok=False, status="verify_failed", step=state.get("step"),
+                 message="Verification failed on the last run, use --force to go on anyway")
+            return False
+        if last_step:
+            return finish(out, journal, force=True)
+        state["status"] = "copied"  # take the step as it is and go on with the next one
+        journal.save()
+    elif state.get("status") == "copied" and last_step:
+        return finish(out, journal)
+    return run_plan(out, args, journal)
+
+def cmd_resume(out, args):
+    for journal in Core.SlideJournal.pending():
+        if journal.state["disk_path"] != args.disk:
+            continue
+        if "plan" in journal.state:
+            return resume_plan(out, args, journal)
+        if journal.resuming():
+            return run_slide(out, args, journal)
+        if journal.state.get("status") == "copied":
+            return finish(out, journal)
+        if journal.state.get("status") == "verify_failed" and args.force:
+            return finish(out, journal, force=True)
+        emit(out, "done", ok=False, status=journal.state.get("status"),
+             message="Verification failed on the last run, use --force to update the partition table anyway")
+        return False
+    emit(out, "done", ok=False, message=f"No unfinished slide for {args.disk}")
+    return False
+
+def cmd_verify(out, args):
+    manifest = Core.manifest_path(args.disk)
+    if not os.path.exists(manifest):
+        emit(out, "done", ok=False, message=f"No slide manifest for {args.disk}, slide with --verify first")
+        return False
+    mismatches = Core.verify_manifest(manifest, progress=lambda percent: emit(out, "progress", percent=percent))
+    emit(out, "done", ok=not mismatches, mismatches=mismatches)
+    return not mismatches
+
+def cmd_trace(out, args):
+    summary = Core.trace_summary(args.file, args.region_mib * 1024 * 1024, args.slow_factor)
+    emit(out, "trace", file=args.file, **summary)
+    for region in summary["slow_regions"]:
+        emit(out, "slow_region", **region)
+    return True
+
+def copy_options(parser):
+    parser.add_argument("--engine", default="pipelined", choices=sorted(Core.ENGINES))
+    parser.add_argument("--direct", action="store_true", help="ask for O_DIRECT")
+    parser.add_argument("--memory-limit", type=int, default=512, help="buffer memory ceiling in MiB")
+    parser.add_argument("--used-only", action="store_true", help="only copy blocks the file system uses")
+    parser.add_argument("--verify", action="store_true", help="hash every chunk and keep a manifest")
+    parser.add_argument("--queue-depth", type=int, help="requests in flight for the concurrent engine (default: picked from the disk)")
+    parser.add_argument("--chunk", type=int, help="fixed chunk size in MiB instead of tuning it")
+    parser.add_argument("--metrics", metavar="FILE", help="also append the progress snapshots to FILE as JSON lines")
+    parser.add_argument("--durability", default="chunk", choices=Core.DURABILITY_POLICIES,
+                        help="when writes are synced: every chunk, every --sync-mib, rolling writeback or only at the end "
+                             "(a journal still syncs before its uncommitted writes outgrow the displacement)")
+    parser.add_argument("--sync-mib", type=int, default=Core.DURABILITY_SYNC_BYTES // (1024 * 1024),
+                        help="sync interval of --durability bytes, in MiB")
+    parser.add_argument("--trace", metavar="FILE", help="append per chunk timings to FILE as JSON lines, see 'trace'")
+
+def probe_options(parser):
+    parser.add_argument("--dry-run", action="store_true",
+                        help="check the move and estimate how long it takes, nothing on the disk changes")
+    parser.add_argument("--probe-seconds", type=float, default=Core.PROBE_SECONDS,
+                        help="how long the dry run samples the disk, 0 to only check the move")
+    parser.add_argument("--probe-write", action="store_true",
+                        help="also time writes, by writing the free part of the destination with the bytes already there")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Slide partitions without the GUI")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="list disks")
+    for name in ("mbr", "gpt"):
+        sub.add_parser(name, help=f"dump the {name.upper()} of a disk").add_argument("disk")
+    slide = sub.add_parser("slide", help="move an MBR partition")
+    slide.add_argument("disk")
+    slide.add_argument("partition", type=int, help="partition number like the N in /dev/sdbN, logical partitions start at 5")
+    slide.add_argument("new_first", type=int, help="new first sector")
+    slide.add_argument("--sector-size", type=int, help="default: the disk's sector size from lsblk, 512 for image files")
+    copy_options(slide)
+    probe_options(slide)
+    plan = sub.add_parser("plan", help="move several MBR partitions, the partition table is written once at the end")
+    plan.add_argument("disk")
+    plan.add_argument("moves", nargs="+", metavar="PARTITION=NEW_FIRST", help="like 5=1050624, numbers as in 'slide'")
+    plan.add_argument("--max-gap", type=int, default=0,
+                      help="copy free space up to this many sectors to join partitions moving together into one pass")
+    plan.add_argument("--sector-size", type=int, help="default: the disk's sector size from lsblk, 512 for image files")
+    copy_options(plan)
+    probe_options(plan)
+    batch = sub.add_parser("batch", help="run slides and move plans on many disks, side by side across disks")
+    batch.add_argument("jobs", help="file with one JSON job per line, see cmd_batch() in CLI.py")
+    batch.add_argument("--parallel", type=int, help="at most this many jobs at once (default: one per disk)")
+    batch.add_argument("--max-gap", type=int, default=0, help="as for 'plan'")
+    copy_options(batch)
+    resume = sub.add_parser("resume", help="finish an interrupted slide")
+    resume.add_argument("disk")
+    resume.add_argument("--force", action="store_true", help="update the partition table even though verification failed")
+    copy_options(resume)
+    sub.add_parser("verify", help="check a finished slide against its manifest").add_argument("disk")
+    trace = sub.add_parser("trace", help="summarize a --trace file: time percentiles, where the time went, slow regions")
+    trace.add_argument("file")
+    trace.add_argument("--region-mib", type=int, default=1024, help="size of the disk regions compared, in MiB")
+    trace.add_argument("--slow-factor", type=float, default=0.5,
+                       help="a region is slow below this times the median region rate")
+    args = parser.parse_args()
+
+    out = sys.stdout
+    commands = {"list": cmd_list, "mbr": cmd_mbr, "gpt": cmd_gpt, "slide": cmd_slide, "plan": cmd_plan, "batch": cmd_batch, "resume": cmd_resume,
+                "verify": cmd_verify, "trace": cmd_trace}
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            ok = commands[args.command](out, args)
+    except (OSError, Core.PartitionTableError) as e:
+        emit(out, "error", message=str(e))
+        ok = False
+    sys.exit(0 if ok else 1)
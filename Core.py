@@ -0,0 +1,2956 @@
+# Disk, partition table and copy engine logic for PartitionSlider. Nothing in here imports Qt, so it can be
+# used by the GUI in Main.py as well as headless from CLI.py and Benchmark.py.
+import sys
+import subprocess
+import platform
+import os
+import time
+import threading
+import queue
+import mmap
+import errno
+import re
+import struct
+import json
+import hashlib
+import math
+import stat
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import bisect
+import collections
+import uuid
+import zlib
+import socket
+import ctypes
+import ctypes.util
+
+PROGRESS_PIECE = 16 * 1024 * 1024  # chunks are written in pieces of this, so progress moves within a chunk
+PROBE_SECONDS = 3.0  # how long a dry run samples the disk
+PROBE_WINDOWS = 4  # places in the source it reads, disks get slower towards the end
+
+class PartitionTableError(Exception):
+    # The partition table can't be parsed, raised by read_mbr()
+    pass
+
+class ChunkTuner:
+    # Tries a few chunk sizes during the first seconds of a copy and then sticks with the fastest one.
+    # The reader asks next_size() for every chunk, the writer calls record() after every write, so
+    # what gets measured is the real read+write throughput of the pipeline.
+
+    def __init__(self, max_size, alignment, tune_seconds=5.0, samples=3):
+        sizes = []
+        size = 4 * 1024 * 1024
+        while size < max_size:
+            sizes.append(size)
+            size *= 4
+        sizes.append(max_size)
+        self.sizes = [s - s % alignment for s in sizes if s >= alignment] or [max_size]
+        self.tune_seconds = tune_seconds
+        self.samples = samples
+        self.issued = {s: 0 for s in self.sizes}
+        self.recorded = {s: 0 for s in self.sizes}
+        self.results = {s: [0, 0.0] for s in self.sizes}  # size: [bytes, seconds]
+        self.phase = 0
+        self.chosen = None
+        self.start = None
+        self.last_done = None
+        self.lock = threading.Lock()
+
+    def tuning_bytes(self):
+        # Rough amount of data the tuning phase needs, not worth tuning below a few times this
+        return sum(self.sizes) * self.samples
+
+    def next_size(self):
+        with self.lock:
+            if self.chosen:
+                return self.chosen
+            if self.start is None:
+                self.start = time.time()
+            timed_out = time.time() - self.start > self.tune_seconds
+            while self.phase < len(self.sizes) and self.issued[self.sizes[self.phase]] >= self.samples:
+                self.phase += 1
+            if self.phase < len(self.sizes) and not timed_out:
+                size = self.sizes[self.phase]
+                self.issued[size] += 1
+                return size
+            if timed_out or all(self.recorded[s] >= self.issued[s] for s in self.sizes):
+                self.pick()
+                return self.chosen
+            return self.sizes[-1]  # all sizes issued, keep going while the last results come in
+
+    def record(self, size):
+        with self.lock:
+            now = time.time()
+            if self.chosen is None and size in self.results:
+                self.recorded[size] += 1
+                if self.last_done is not None:  # the first chunk also includes pipeline start up
+                    self.results[size][0] += size
+                    self.results[size][1] += now - self.last_done
+            self.last_done = now
+
+    def pick(self):
+        measured = [s for s in self.sizes if self.results[s][1] > 0]
+        if measured:
+            self.chosen = max(measured, key=lambda s: self.results[s][0] / self.results[s][1])
+        else:
+            self.chosen = self.sizes[-1]
+        print("chunk size chosen:", self.chosen, {s: self.results[s] for s in measured})
+
+DURABILITY_POLICIES = ("chunk", "bytes", "writeback", "final")
+DURABILITY_SYNC_BYTES = 1024 ** 3  # barrier interval of the "bytes" policy
+SYNC_FILE_RANGE_WAIT_BEFORE = 1
+SYNC_FILE_RANGE_WRITE = 2
+SYNC_FILE_RANGE_WAIT_AFTER = 4
+
+def sync_file_range_call():
+    # libc's sync_file_range(fd, offset, nbytes, flags), None where there isn't one (os doesn't wrap it)
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        func = ctypes.CDLL(None, use_errno=True).sync_file_range
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_uint]
+    func.restype = ctypes.c_int
+    return func
+
+class Durability:
+    # When the engines make their writes durable. flush() on an unbuffered file does nothing, the data sits in
+    # the page cache until the kernel feels like writing it, so without barriers a big slide piles up dirty pages
+    # and then stalls on them. The policies:
+    #   chunk      fdatasync after every chunk
+    #   bytes      fdatasync every sync_bytes
+    #   writeback  start writeback of every chunk as soon as it is written and wait for the one before it
+    #              (sync_file_range), so only about two chunks are ever dirty, one fdatasync at the end
+    #   final      one fdatasync at the end
+    # A journal can only commit a chunk after a barrier, and nothing written past its boundary may land on the
+    # source of a chunk it hasn't committed, a resume reads those again. So with a journal the engines ask
+    # reserve() before every write, which makes a barrier when the destination would reach the source of the
+    # earliest uncommitted chunk. That is measured in partition offsets, not bytes written: with gaps between
+    # the extents a few bytes can get there. The commits wait for the next barrier, one journal save covers them all.
+    # finish() is the barrier at the end of every copy, before anything touches the partition table.
+
+    def __init__(self, policy="chunk", sync_bytes=DURABILITY_SYNC_BYTES):
+        if policy not in DURABILITY_POLICIES:
+            raise ValueError(f"Unknown durability policy {policy}, one of {', '.join(DURABILITY_POLICIES)}")
+        self.policy = policy
+        self.sync_bytes = max(1, int(sync_bytes))
+        self.sync_file_range = None
+        if policy == "writeback":
+            self.sync_file_range = sync_file_range_call()
+            if self.sync_file_range is None:
+                print("sync_file_range not available here, syncing every", self.sync_bytes, "bytes instead")
+                self.policy = "bytes"
+        self.dst = 0
+        self.journal = None
+        self.room = 0
+        self.left = True
+        self.cache = None
+        self.unsynced = 0  # bytes written since the last barrier
+        self.span = None  # [start, end) on the disk of what was written since the last barrier
+        self.uncleaned = 0  # bytes of it the page cache may still hold
+        self.commit = None  # (offset, size) of the last chunk written, committed at the next barrier
+        self.pending = None  # (offset, size) of the first chunk written since the last commit
+        self.behind = None  # (position, size) of the chunk whose writeback is still running
+        self.barriers = 0
+        self.sync_seconds = 0.0
+        self.longest = 0.0
+
+    def start(self, dst, journal=None, room=0, cache=None, left=True):
+        # room: how far past the source of the earliest uncommitted chunk a write may reach, in partition
+        # offsets (the displacement), 0 to commit every chunk. cache: the engine's CacheHints, told what gets clean
+        self.dst = dst
+        self.journal = journal
+        self.room = max(0, int(room))
+        self.cache = cache
+        self.left = left
+
+    def reserve(self, fd, offset, size, first=None):
+        # Before a chunk is written: True when it can't reach the source of an uncommitted chunk, after a barrier
+        # if that's what it takes. first is the earliest chunk written or still being written that hasn't come
+        # through written() yet (the concurrent engine has those), its source counts as uncommitted too
+        if not self.journal or self.fits(offset, size, first):
+            return True
+        if self.commit:
+            self.barrier(fd)
+        return self.fits(offset, size, first)
+
+    def fits(self, offset, size, first):
+        earlier = [c for c in (self.pending, first) if c]
+        if not earlier:  # only its own source, the chunk cap or the journal's backup takes care of that
+            return True
+        if self.left:  # the destination runs below the source by the displacement
+            return offset + size - min(o for o, s in earlier) <= self.room
+        return max(o + s for o, s in earlier) - offset <= self.room
+
+    def written(self, fd, offset, size):
+        # After a chunk (offset relative to the partition, like the journal's) is written, in the order the
+        # journal commits them
+        self.unsynced += size
+        if self.journal:
+            self.commit = (offset, size)
+            self.pending = self.pending or (offset, size)
+        if self.cache:
+            position = self.dst + offset
+            self.span = [min(self.span[0], position), max(self.span[1], position + size)] if self.span else [position, position + size]
+            self.uncleaned += size
+        if self.policy == "writeback":
+            self.writeback(fd, self.dst + offset, size)
+        if (self.policy == "chunk" or (self.policy == "bytes" and self.unsynced >= self.sync_bytes)
+                or (self.journal and not self.room)):
+            self.barrier(fd)
+
+    def writeback(self, fd, position, size):
+        if self.sync_file_range(fd, position, size, SYNC_FILE_RANGE_WRITE) != 0:
+            e = ctypes.get_errno()
+            print(f"sync_file_range failed ({os.strerror(e)}), syncing every {self.sync_bytes} bytes instead")
+            self.policy = "bytes"
+            return
+        if self.behind:
+            position_behind, size_behind = self.behind
+            self.sync_file_range(fd, position_behind, size_behind, SYNC_FILE_RANGE_WAIT_BEFORE | SYNC_FILE_RANGE_WRITE |
+                                 SYNC_FILE_RANGE_WAIT_AFTER)
+            if self.cache:  # written back, so clean
+                self.cache.clean(fd, position_behind, position_behind + size_behind, size_behind)
+                self.uncleaned -= size_behind
+        self.behind = (position, size)
+
+    def barrier(self, fd):
+        started = time.perf_counter()
+        (os.fdatasync if hasattr(os, 'fdatasync') else os.fsync)(fd)
+        took = time.perf_counter() - started
+        self.barriers += 1
+        self.sync_seconds += took
+        self.longest = max(self.longest, took)
+        self.unsynced = 0
+        self.behind = None
+        if self.span:
+            self.cache.clean(fd, *self.span, self.uncleaned)
+            self.span = None
+            self.uncleaned = 0
+        if self.commit:
+            self.journal.commit(*self.commit)
+            self.commit = None
+            self.pending = None
+
+    def finish(self, fd):
+        if self.unsynced or self.commit:
+            self.barrier(fd)
+
+    def describe(self):
+        policy = {"chunk": "sync every chunk", "bytes": f"sync every {self.sync_bytes / (1024 ** 2):g} MiB",
+                  "writeback": "rolling writeback", "final": "sync at the end"}[self.policy]
+        return f"{policy}, {self.barriers} syncs, longest {self.longest * 1000:.0f} ms"
+
+class CacheHints:
+    # posix_fadvise hints for a copy through the page cache, so a long slide doesn't push everything else on the
+    # host out of it. The source is read once: the kernel is asked to read ahead the window the copy goes to next,
+    # and every chunk is dropped as soon as it is read. Moving left the walk goes forwards and the access is marked
+    # sequential, whatever readahead runs past the end of the source is dropped at the end. Moving right it goes
+    # backwards, the kernel's own readahead would only read the chunk just copied again, so it is turned off
+    # (RANDOM) and the window asked for is all that gets read ahead. Without readahead (the concurrent engine,
+    # whose reads finish out of order and could pull chunks already dropped back in) nothing is read ahead at all,
+    # the reads in flight are the readahead. The destination is dropped once it is clean, at a Durability barrier or when its writeback is
+    # done, dirty pages can't be dropped. held() is what the slide keeps in the cache by that count, peak its high mark
+
+    def __init__(self, src, source_bytes, left, readahead=True):
+        self.src = src
+        self.end = src + source_bytes
+        self.left = left
+        self.readahead = readahead
+        self.ahead = 0  # bytes asked to be read ahead
+        self.reading = 0  # bytes of reads in progress
+        self.last = 0  # size of the last chunk read
+        self.written = 0  # destination bytes written and not dropped yet
+        self.peak = 0
+        self.enabled = hasattr(os, 'posix_fadvise')
+        self.lock = threading.Lock()
+
+    def advise(self, fd, start, length, advice):
+        if not self.enabled or length <= 0:
+            return
+        try:
+            os.posix_fadvise(fd, start, length, advice)
+        except OSError as e:
+            print("posix_fadvise not usable here, no page cache hints:", e)
+            self.enabled = False
+
+    def start(self, fd):
+        # On the file descriptor the source is read through, readahead is kept per descriptor
+        advice = os.POSIX_FADV_SEQUENTIAL if self.left and self.readahead else os.POSIX_FADV_RANDOM
+        self.advise(fd, self.src, self.end - self.src, advice)
+
+    def finish(self, fd):
+        # After the last read. A read can take about its own size of readahead with it
+        if self.left and self.readahead:
+            self.advise(fd, self.end, 2 * self.last, os.POSIX_FADV_DONTNEED)
+
+    def read_started(self, size):
+        with self.lock:
+            self.reading += size
+            self.peak = max(self.peak, self.held())
+
+    def read(self, fd, position, size):
+        # After the chunk at position (on the disk) is read. The next window is as big as that chunk
+        self.advise(fd, position, size, os.POSIX_FADV_DONTNEED)
+        if not self.readahead:
+            start = end = position
+        elif self.left:
+            start, end = position + size, min(position + 2 * size, self.end)
+        else:
+            start, end = max(self.src, position - size), position
+        self.advise(fd, start, end - start, os.POSIX_FADV_WILLNEED)
+        with self.lock:
+            self.reading -= size
+            self.ahead = max(0, end - start)
+            self.last = max(self.last, size)
+            self.peak = max(self.peak, self.held())
+
+    def wrote(self, size):
+        with self.lock:
+            self.written += size
+            self.peak = max(self.peak, self.held())
+
+    def clean(self, fd, start, end, size):
+        # [start, end) on the disk is clean now, size of it was written since the last clean()
+        self.advise(fd, start, end - start, os.POSIX_FADV_DONTNEED)
+        with self.lock:
+            self.written = max(0, self.written - size)
+
+    def held(self):
+        return self.ahead + self.reading + self.written
+
+class PipelinedCopy:
+    # Double buffered copy: a reader thread fills buffers from a small preallocated pool while
+    # the calling thread writes the previous one, so the disk is reading chunk N+1 while chunk N
+    # is being written. Chunks are handed out in the same overlap safe order the old loops used:
+    # front to back when moving left, back to front when moving right. A read can never see a
+    # sector that an earlier write already touched, so the pipeline can run ahead freely.
+
+    def __init__(self, disk_path, src, dst, total_bytes, chunk_size, buffers=2, direct=False, alignment=512,
+                 memory_limit=None, autotune=False, extents=None, journal=None, verifier=None, io_size=None,
+                 durability=None, trace=None):
+        self.disk_path = disk_path
+        self.src = src  # byte offsets
+        self.dst = dst
+        self.total_bytes = total_bytes
+        # Sorted (offset, length) ranges inside the partition to copy, everything by default
+        self.extents = extents if extents is not None else [(0, total_bytes)]
+        self.copy_bytes = sum(length for _, length in self.extents)
+        self.journal = journal  # SlideJournal, commits chunks once they are on disk
+        self.durability = durability or Durability()  # when the writes get synced
+        self.trace = trace  # SlideTrace, gets the timings of every chunk
+        self.verifier = verifier  # ChunkVerifier, hashes source and destination of every chunk
+        self.alignment = max(int(alignment), 1)  # logical sector size of the device
+        self.buffers = buffers = max(2, buffers)
+        if memory_limit:  # the whole buffer pool has to fit under the ceiling
+            chunk_size = min(chunk_size, int(memory_limit) // buffers)
+        self.chunk_size = chunk_size - chunk_size % self.alignment or self.alignment
+        # Preferred I/O size of the device (optimal_io_size from sysfs), chunks stay multiples of it when they can
+        if io_size and io_size % self.alignment == 0 and io_size <= self.chunk_size:
+            self.chunk_size -= self.chunk_size % io_size
+        else:
+            io_size = self.alignment
+        self.on_bytes = None  # on_bytes(n) after every piece written, from the copy threads
+        self.tuner = None
+        if autotune:
+            tuner = ChunkTuner(self.chunk_size, io_size)
+            if self.copy_bytes >= 4 * tuner.tuning_bytes() and len(tuner.sizes) > 1:
+                self.tuner = tuner
+        # O_DIRECT skips the page cache, falls back to buffered I/O if the device or offsets don't allow it
+        self.mode = "direct" if direct and self.direct_possible() else "buffered"
+        # Page cache hints, O_DIRECT doesn't go through it. Modes set later (kernel copy) are never direct
+        self.cache = CacheHints(src, total_bytes, dst < src) if self.mode != "direct" else None
+        self.pool = None  # allocated when the copy starts
+
+    def allocate_pool(self):
+        if self.mode == "direct":
+            return [mmap.mmap(-1, self.chunk_size) for _ in range(self.buffers)]  # mmap memory is page aligned
+        return [bytearray(self.chunk_size) for _ in range(self.buffers)]
+
+    def journal_room(self):
+        # See Durability.reserve. With backup every chunk is committed before the next one is saved
+        if not self.journal or self.journal.state.get("backup"):
+            return 0
+        return abs(self.dst - self.src)
+
+    def current_chunk_size(self):
+        if self.tuner and self.tuner.chosen:
+            return self.tuner.chosen
+        return self.chunk_size
+
+    def direct_possible(self):
+        if not hasattr(os, 'O_DIRECT'):
+            return False
+        if any(v % self.alignment for v in (self.src, self.dst, self.total_bytes)):
+            return False
+        if any(offset % self.alignment or length % self.alignment for offset, length in self.extents):
+            return False
+        # Some devices/filesystems (tmpfs, some USB bridges) refuse O_DIRECT, so try one aligned read first
+        probe = mmap.mmap(-1, max(self.alignment, mmap.PAGESIZE))
+        try:
+            with self.open_disk(False, direct=True) as disk:
+                disk.seek(self.src)
+                disk.readinto(memoryview(probe)[:self.alignment])
+            return True
+        except OSError as e:
+            print("O_DIRECT not available, using buffered I/O:", e)
+            return False
+        finally:
+            probe.close()
+
+    def open_disk(self, write, direct=None):
+        if direct is None:
+            direct = self.mode == "direct"
+        if not direct:
+            return open(self.disk_path, 'r+b' if write else 'rb', buffering=0)
+        fd = os.open(self.disk_path, (os.O_RDWR if write else os.O_RDONLY) | os.O_DIRECT)
+        return open(fd, 'r+b' if write else 'rb', buffering=0)
+
+    def chunks(self):
+        # (offset, size) relative to the start of the partition, in overlap safe order.
+        # Chunk sizes may change while the tuner is running and extents may be skipped,
+        # as long as the order stays monotonic every read still happens before its sectors get overwritten.
+        left = self.dst < self.src
+        for start, length in (self.extents if left else reversed(self.extents)):
+            done = 0
+            while done < length:
+                size = self.tuner.next_size() if self.tuner else self.chunk_size
+                size = min(size, length - done)
+                if left:  # Moving left
+                    yield start + done, size
+                else:  # Moving right
+                    yield start + length - done - size, size
+                done += size
+
+    def _reader(self, free, filled, stop):
+        try:
+            with self.open_disk(False) as disk:
+                if self.cache:
+                    self.cache.start(disk.fileno())
+                for offset, size in self.chunks():
+                    buf = free.get()
+                    if buf is None or stop.is_set():
+                        return
+                    view = memoryview(buf)[:size]
+                    if self.cache:
+                        self.cache.read_started(size)
+                    started = time.perf_counter()
+                    disk.seek(self.src + offset)
+                    sought = time.perf_counter()
+                    got = 0
+                    while got < size:
+                        n = disk.readinto(view[got:])
+                        if not n:
+                            raise OSError(f"Short read at byte {self.src + offset + got}")
+                        got += n
+                    read_times = (sought - started, time.perf_counter() - sought)  # seek, read
+                    if self.cache:
+                        self.cache.read(disk.fileno(), self.src + offset, size)
+                    digest = self.verifier.hash_source(view) if self.verifier else None
+                    filled.put((offset, size, buf, digest, read_times))
+                if self.cache:
+                    self.cache.finish(disk.fileno())
+            filled.put(None)  # no more chunks
+        except Exception as e:
+            filled.put(e)
+
+    def run(self, on_chunk=None):
+        # on_chunk(offset, size) is called after each chunk has been written
+        free = queue.Queue()
+        filled = queue.Queue()
+        stop = threading.Event()
+        if self.pool is None:
+            self.pool = self.allocate_pool()
+        for buf in self.pool:
+            free.put(buf)
+
+        if self.verifier:
+            self.verifier.start(self)
+        if self.trace:
+            self.trace.start(self)
+        reader = threading.Thread(target=self._reader, args=(free, filled, stop), daemon=True)
+        reader.start()
+        try:
+            with self.open_disk(True) as disk:
+                self.durability.start(self.dst, self.journal, self.journal_room(), self.cache, self.dst < self.src)
+                while True:
+                    item = filled.get()
+                    if item is None:
+                        self.durability.finish(disk.fileno())
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    offset, size, buf, digest, read_times = item
+                    view = memoryview(buf)[:size]
+                    self.durability.reserve(disk.fileno(), offset, size)
+                    if self.journal and self.journal.state.get("backup"):
+                        self.journal.backup(offset, view)  # this chunk is about to overwrite its own source
+                    started = time.perf_counter()
+                    disk.seek(self.dst + offset)
+                    sought = time.perf_counter()
+                    done = 0
+                    while done < size:
+                        n = disk.write(view[done:done + PROGRESS_PIECE])
+                        done += n
+                        if self.on_bytes:
+                            self.on_bytes(n)
+                    if self.cache:
+                        self.cache.wrote(size)
+                    written = time.perf_counter()
+                    self.durability.written(disk.fileno(), offset, size)
+                    if self.trace:
+                        self.trace.chunk(offset, size, seek=read_times[0] + sought - started, read=read_times[1],
+                                         write=written - sought, sync=time.perf_counter() - written)
+                    if digest:
+                        digest = digest.result()  # the buffer can't be reused before its source hash is done
+                        self.verifier.check_destination(offset, size, digest)
+                    free.put(buf)  # hand the buffer back to the reader
+                    if self.tuner:
+                        self.tuner.record(size)
+                    if on_chunk:
+                        on_chunk(offset, size)
+        finally:
+            stop.set()
+            free.put(None)  # wake the reader if it is waiting for a buffer
+            reader.join()
+            if self.verifier:
+                self.verifier.finish()
+
+    def probe(self, seconds, scratch=None, streams=1):
+        # Throughput sample for a dry run, nothing on the disk changes. Reads the source in PROBE_WINDOWS places
+        # spread over what gets copied, streams windows at once like the I/Os the concurrent engine has in flight.
+        # scratch is a list of free (start, end) byte ranges, with it half the time goes to reading pieces of them
+        # and writing the same bytes back. Returns (read bytes/s, write bytes/s or None, bytes sampled)
+        piece = max(self.alignment, min(self.chunk_size, PROGRESS_PIECE))
+        windows = []
+        share = -(-self.copy_bytes // PROBE_WINDOWS)
+        for k in range(PROBE_WINDOWS):
+            position = share * k
+            for offset, length in self.extents:
+                if position < length:
+                    start = self.src + offset + position - position % self.alignment
+                    windows.append((start, min(self.src + offset + length, start + share)))
+                    break
+                position -= length
+        windows = sorted(set(windows))
+        read_seconds = seconds / 2 if scratch else seconds
+
+        def sample(windows, deadline, write):
+            buf = mmap.mmap(-1, piece) if self.mode == "direct" else bytearray(piece)
+            done = 0
+            busy = 0.0  # time in the writes, for the write sample
+            with self.open_disk(write) as disk:
+                for n, (start, end) in enumerate(windows):
+                    until = time.perf_counter() + (deadline - time.perf_counter()) / (len(windows) - n)
+                    if self.mode == "buffered" and hasattr(os, 'posix_fadvise'):  # a cached sample flatters the disk
+                        os.posix_fadvise(disk.fileno(), start, end - start, os.POSIX_FADV_DONTNEED)
+                    position = start
+                    while position < end and time.perf_counter() < until:
+                        view = memoryview(buf)[:min(piece, end - position)]
+                        disk.seek(position)
+                        got = disk.readinto(view)
+                        if not got:
+                            break
+                        if write:
+                            started = time.perf_counter()
+                            disk.seek(position)
+                            written = 0
+                            while written < got:
+                                written += disk.write(view[written:got])
+                            os.fsync(disk.fileno())
+                            busy += time.perf_counter() - started
+                        done += got
+                        position += got
+            return done, busy
+
+        start = time.perf_counter()
+        groups = [windows[i::streams] for i in range(min(streams, len(windows)))]
+        with ThreadPoolExecutor(max_workers=len(groups) or 1) as pool:
+            results = list(pool.map(lambda group: sample(group, start + read_seconds, False), groups))
+        read_bytes = sum(done for done, _ in results)
+        elapsed = time.perf_counter() - start
+        read_rate = read_bytes / elapsed if read_bytes and elapsed > 0 else None
+        write_rate = None
+        write_bytes = 0
+        if scratch:
+            write_bytes, busy = sample(scratch, time.perf_counter() + seconds - read_seconds, True)
+            write_rate = write_bytes / busy if write_bytes and busy > 0 else None
+        return read_rate, write_rate, read_bytes + write_bytes
+
+# Errors meaning the kernel can't do copy_file_range/sendfile for this device, not that the disk is failing
+KERNEL_COPY_UNSUPPORTED = {errno.EINVAL, errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+KERNEL_COPY_MIN_DISPLACEMENT = 1024 * 1024
+
+class KernelCopy(PipelinedCopy):
+    # Moves the data inside the kernel with os.copy_file_range on the device's own file descriptor, or
+    # os.sendfile when that isn't available, so nothing is copied through Python. Chunks come from the same
+    # overlap safe chunks() walk, and are capped at the displacement because the kernel refuses (or worse,
+    # mangles) a copy whose source and destination overlap within one file. If the kernel rejects both
+    # calls, whatever is left is handed to the userspace pipeline.
+
+    def __init__(self, disk_path, src, dst, total_bytes, chunk_size, **kwargs):
+        kwargs["autotune"] = False  # nothing to tune, the kernel picks its own I/O sizes
+        kwargs["direct"] = False
+        displacement = abs(dst - src)
+        super().__init__(disk_path, src, dst, total_bytes, min(chunk_size, displacement), **kwargs)
+        self.methods = [m for m in ("copy_file_range", "sendfile") if hasattr(os, m)]
+        self.mode = self.methods[0] if self.methods else "buffered"
+
+    def copy_chunk(self, fd, out_fd, offset, size):
+        done = 0
+        while done < size:
+            piece = min(size - done, PROGRESS_PIECE)
+            if self.mode == "copy_file_range":
+                n = os.copy_file_range(fd, fd, piece, self.src + offset + done, self.dst + offset + done)
+            else:
+                os.lseek(out_fd, self.dst + offset + done, os.SEEK_SET)
+                n = os.sendfile(out_fd, fd, self.src + offset + done, piece)
+            if n == 0:
+                raise OSError(f"Short kernel copy at byte {self.src + offset + done}")
+            done += n
+            if self.on_bytes:
+                self.on_bytes(n)
+
+    def run(self, on_chunk=None):
+        left = self.dst < self.src
+        rest = None
+        if self.trace:
+            self.trace.start(self)
+        with self.open_disk(True) as disk, self.open_disk(True) as out:
+            self.durability.start(self.dst, self.journal, self.journal_room(), self.cache, self.dst < self.src)
+            if self.cache:
+                self.cache.start(disk.fileno())
+            for offset, size in self.chunks():
+                while True:
+                    try:
+                        if self.mode == "buffered":
+                            raise OSError(errno.ENOSYS, "no kernel copy available")
+                        self.durability.reserve(out.fileno(), offset, size)
+                        if self.cache:
+                            self.cache.read_started(size)
+                        started = time.perf_counter()
+                        self.copy_chunk(disk.fileno(), out.fileno(), offset, size)
+                        copied = time.perf_counter() - started
+                        break
+                    except OSError as e:
+                        if e.errno not in KERNEL_COPY_UNSUPPORTED:
+                            raise
+                        print(f"{self.mode} not usable here: {e}")
+                        later = self.methods[self.methods.index(self.mode) + 1:] if self.mode in self.methods else []
+                        self.mode = later[0] if later else "buffered"
+                        if self.mode == "buffered":
+                            break
+                if self.mode == "buffered":
+                    # Redo this chunk and everything after it in userspace
+                    rest = clip_extents(self.extents, offset if left else offset + size, left)
+                    break
+                if self.cache:
+                    self.cache.read(disk.fileno(), self.src + offset, size)
+                    self.cache.wrote(size)
+                written = time.perf_counter()
+                self.durability.written(disk.fileno(), offset, size)
+                if self.trace:
+                    self.trace.chunk(offset, size, copy=copied, sync=time.perf_counter() - written)
+                if on_chunk:
+                    on_chunk(offset, size)
+            if self.cache:
+                self.cache.finish(disk.fileno())
+            self.durability.finish(disk.fileno())
+        if rest is not None:
+            self.extents = rest
+            super().run(on_chunk)
+
+class ConcurrentCopy(PipelinedCopy):
+    # Keeps several os.preadv/os.pwritev calls in flight from a worker pool, so NVMe devices see a queue
+    # depth above 1. Reads are issued in the usual overlap safe order and never wait on anything; a write
+    # only waits until every chunk whose source its destination overlaps has been read. That follows from
+    # the actual ranges, so it holds for both directions and for displacements smaller than a chunk (where a
+    # chunk's destination covers part of its own source and of its neighbour's).
+
+    def __init__(self, disk_path, src, dst, total_bytes, chunk_size, queue_depth=4, **kwargs):
+        self.queue_depth = max(1, int(queue_depth))
+        kwargs["autotune"] = False  # the plan is made up front, chunk sizes can't change under it
+        kwargs["buffers"] = self.queue_depth + 1
+        super().__init__(disk_path, src, dst, total_bytes, chunk_size, **kwargs)
+        if self.cache:
+            self.cache.readahead = False
+
+    def dependencies(self, plan):
+        # For chunk j, the last chunk (in plan order) whose source overlaps j's destination, or -1
+        left = self.dst < self.src
+        if left:
+            keys = [offset for offset, _ in plan]  # ascending
+        else:
+            keys = [-(offset + size) for offset, size in plan]  # descending ends, negated to sort ascending
+        deps = []
+        for offset, size in plan:
+            if left:
+                k = bisect.bisect_left(keys, self.dst + offset + size - self.src) - 1
+            else:
+                k = bisect.bisect_left(keys, -(self.dst + offset - self.src)) - 1
+            if k >= 0:
+                k_offset, k_size = plan[k]
+                if not (self.src + k_offset < self.dst + offset + size and self.src + k_offset + k_size > self.dst + offset):
+                    k = -1
+            deps.append(k)
+        return deps
+
+    def run(self, on_chunk=None):
+        plan = list(self.chunks())
+        deps = self.dependencies(plan)
+        if self.pool is None:
+            self.pool = self.allocate_pool()
+        free = list(self.pool)
+        buffers = {}  # chunk index: buffer
+        digests = {}  # chunk index: source hash future
+        read_done = [False] * len(plan)
+        write_done = [False] * len(plan)
+        read_mark = -1  # every chunk up to here has been read
+        write_mark = -1  # every chunk up to here has been written (and handed to the Durability)
+        waiting = []  # read, not yet written
+        times = {}  # chunk index: [read seconds, write seconds], for the trace
+        next_read = 0
+        if self.verifier:
+            self.verifier.start(self)
+        if self.trace:
+            self.trace.start(self)
+
+        def read(i, fd):
+            offset, size = plan[i]
+            view = memoryview(buffers[i])[:size]
+            if self.cache:
+                self.cache.read_started(size)
+            started = time.perf_counter()
+            got = 0
+            while got < size:
+                n = os.preadv(fd, [view[got:]], self.src + offset + got)
+                if not n:
+                    raise OSError(f"Short read at byte {self.src + offset + got}")
+                got += n
+            seconds = time.perf_counter() - started
+            if self.cache:
+                self.cache.read(fd, self.src + offset, size)
+            return seconds
+
+        def write(i, fd):
+            offset, size = plan[i]
+            view = memoryview(buffers[i])[:size]
+            started = time.perf_counter()
+            done = 0
+            while done < size:
+                n = os.pwritev(fd, [view[done:done + PROGRESS_PIECE]], self.dst + offset + done)
+                done += n
+                if self.on_bytes:
+                    self.on_bytes(n)
+            seconds = time.perf_counter() - started
+            if self.cache:
+                self.cache.wrote(size)
+            return seconds
+
+        with self.open_disk(True) as disk, ThreadPoolExecutor(max_workers=self.queue_depth) as pool:
+            fd = disk.fileno()
+            self.durability.start(self.dst, self.journal, self.journal_room(), self.cache, self.dst < self.src)
+            if self.cache:
+                self.cache.start(fd)
+            running = {}  # future: ("read" | "write", chunk index)
+            try:
+                while write_mark < len(plan) - 1:
+                    # Writes whose sources have all been read go first, they free buffers. With a journal a
+                    # write also must not land on the source of a chunk from write_mark on that isn't committed
+                    # yet, in flight or done out of order, the Durability checks that in partition offsets.
+                    for i in list(waiting):
+                        if len(running) >= self.queue_depth:
+                            break
+                        if read_mark < max(deps[i], i):
+                            continue
+                        if self.durability.reserve(fd, *plan[i], plan[write_mark + 1] if write_mark + 1 < i else None):
+                            waiting.remove(i)
+                            running[pool.submit(write, i, fd)] = ("write", i)
+                    while next_read < len(plan) and free and len(running) < self.queue_depth:
+                        buffers[next_read] = free.pop()
+                        running[pool.submit(read, next_read, fd)] = ("read", next_read)
+                        next_read += 1
+
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        kind, i = running.pop(future)
+                        times.setdefault(i, []).append(future.result())
+                        if kind == "read":
+                            read_done[i] = True
+                            while read_mark + 1 < len(plan) and read_done[read_mark + 1]:
+                                read_mark += 1
+                            if self.verifier:
+                                digests[i] = self.verifier.hash_source(memoryview(buffers[i])[:plan[i][1]])
+                            waiting.append(i)
+                            continue
+                        if i in digests:
+                            self.verifier.check_destination(*plan[i], digests.pop(i).result())
+                        free.append(buffers.pop(i))
+                        write_done[i] = True
+                        while write_mark + 1 < len(plan) and write_done[write_mark + 1]:
+                            write_mark += 1
+                            written = time.perf_counter()
+                            self.durability.written(fd, *plan[write_mark])
+                            read_seconds, write_seconds = times.pop(write_mark)
+                            if self.trace:
+                                self.trace.chunk(*plan[write_mark], read=read_seconds, write=write_seconds,
+                                                 sync=time.perf_counter() - written)
+                        if on_chunk:
+                            on_chunk(*plan[i])
+                if self.cache:
+                    self.cache.finish(fd)
+                self.durability.finish(fd)
+            finally:
+                for future in running:
+                    future.cancel()
+                if self.verifier:
+                    self.verifier.finish()
+
+ENGINES = {"pipelined": PipelinedCopy, "kernel": KernelCopy, "concurrent": ConcurrentCopy}
+
+JOURNAL_DIR = os.path.dirname(os.path.abspath(__file__))
+JOURNAL_MIN_CHUNK = 4 * 1024 * 1024
+
+def clip_extents(extents, boundary, left):
+    # What is still to copy once everything up to boundary is done (below it moving left, above it moving right)
+    result = []
+    for offset, length in extents:
+        start, end = (max(offset, boundary), offset + length) if left else (offset, min(offset + length, boundary))
+        if end > start:
+            result.append((start, end - start))
+    return result
+
+class SlideJournal:
+    # Progress record for one slide, kept next to the tool as slide_journal_<disk>.json. It holds the
+    # slide parameters and the boundary of the last chunk that is known to be on disk, and is rewritten
+    # atomically and fsync'ed at every barrier the engine's Durability makes, so a slide killed halfway can
+    # resume from that chunk. Writes past the boundary must not land on a source that gets copied again, so
+    # the chunk size is capped at the displacement (the Durability makes a barrier before a write would reach
+    # the source of an uncommitted chunk), and when the displacement is too small for that the source of each
+    # chunk is saved to slide_journal_<disk>.data before it gets overwritten.
+
+    def __init__(self, disk_path, state=None):
+        name = re.sub(r'[^A-Za-z0-9]+', '_', disk_path).strip('_')
+        self.path = os.path.join(JOURNAL_DIR, f"slide_journal_{name}.json")
+        self.data_path = os.path.join(JOURNAL_DIR, f"slide_journal_{name}.data")
+        self.state = dict(state or {})
+        self.state["disk_path"] = disk_path
+
+    @classmethod
+    def pending(cls):
+        journals = []
+        for name in sorted(os.listdir(JOURNAL_DIR)):
+            if name.startswith("slide_journal_") and name.endswith(".json"):
+                try:
+                    with open(os.path.join(JOURNAL_DIR, name)) as f:
+                        state = json.load(f)
+                    journals.append(cls(state["disk_path"], state))
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Unreadable journal {name}: {e}")
+        return journals
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        if os.name == 'posix':  # make the rename itself durable
+            fd = os.open(JOURNAL_DIR, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def resuming(self):
+        return self.state.get("status") == "copying"
+
+    def begin(self, extents, left, chunk_cap, backup):
+        self.state.update(status="copying", extents=extents, left=left, chunk_cap=chunk_cap,
+                          backup=backup, boundary=None)
+        self.state.pop("saved_chunk", None)
+        self.save()
+
+    def remaining(self, extents):
+        # Part of the extents not yet committed: below the boundary is done when moving left, above it when moving right
+        boundary = self.state.get("boundary")
+        if boundary is None:
+            return extents
+        return clip_extents(extents, boundary, self.state["left"])
+
+    def backup(self, offset, view):
+        with open(self.data_path, 'wb') as f:
+            f.write(view)
+            f.flush()
+            os.fsync(f.fileno())
+        self.state["saved_chunk"] = [offset, len(view)]
+        self.save()
+
+    def restore(self, dst):
+        # Crashed while a backed up chunk was being written: its source may be half overwritten, use the saved copy
+        saved = self.state.get("saved_chunk")
+        if not saved:
+            return
+        offset, size = saved
+        with open(self.data_path, 'rb') as f:
+            data = f.read()
+        if len(data) != size:
+            raise OSError(f"Journal data file holds {len(data)} bytes, expected {size}")
+        with open(self.state["disk_path"], 'r+b', buffering=0) as disk:
+            disk.seek(dst + offset)
+            disk.write(data)
+            os.fsync(disk.fileno())
+        print(f"Restored saved chunk at {offset} from journal")
+        self.commit(offset, size)
+
+    def commit(self, offset, size):
+        self.state["boundary"] = offset + size if self.state["left"] else offset
+        self.state.pop("saved_chunk", None)
+        self.save()
+
+    def mark_copied(self):
+        self.state["status"] = "copied"
+        self.save()
+
+    def clear(self):
+        for path in (self.path, self.data_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+def hash_range(open_disk, start, size, algorithm, piece=4 * 1024 * 1024):
+    # Read a range back and hash it, through a page aligned buffer so it also works with O_DIRECT
+    h = hashlib.new(algorithm)
+    view = memoryview(mmap.mmap(-1, piece))
+    with open_disk() as disk:
+        disk.seek(start)
+        left = size
+        while left:
+            n = disk.readinto(view[:min(piece, left)])
+            if not n:
+                raise OSError(f"Short read at byte {start + size - left}")
+            h.update(view[:n])
+            left -= n
+    return h.hexdigest()
+
+def manifest_path(disk_path):
+    name = re.sub(r'[^A-Za-z0-9]+', '_', disk_path).strip('_')
+    return os.path.join(JOURNAL_DIR, f"slide_manifest_{name}.json")
+
+class ChunkVerifier:
+    # Inline verification of a slide. Every chunk is hashed as soon as it is read, and once it is written
+    # the destination is read back and hashed again. Both run on a thread pool (hashlib drops the GIL for
+    # big buffers) so the copy doesn't wait on them. The per chunk digests are saved as a manifest that
+    # verify_manifest() can check again later without copying anything.
+
+    def __init__(self, path, params, workers=4, algorithm="sha256", resume=False):
+        self.path = path
+        self.algorithm = algorithm
+        self.manifest = dict(params, algorithm=algorithm, chunks=[])
+        if resume and os.path.exists(path):  # keep the digests of the chunks copied before the interruption
+            with open(path) as f:
+                self.manifest["chunks"] = json.load(f).get("chunks", [])
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.checks = []
+        self.mismatches = []
+        self.engine = None
+
+    def start(self, engine):
+        self.engine = engine
+
+    def hash_source(self, view):
+        return self.pool.submit(lambda: hashlib.new(self.algorithm, view).hexdigest())
+
+    def check_destination(self, offset, size, digest):
+        engine = self.engine
+
+        def check():
+            try:
+                written = hash_range(lambda: engine.open_disk(False), engine.dst + offset, size, self.algorithm)
+            except OSError as e:
+                print(f"Verify read back failed at offset {offset}: {e}")
+                written = None
+            if written != digest:
+                print(f"Verify mismatch in chunk at offset {offset} ({size} bytes)")
+                self.mismatches.append(offset)
+            return [offset, size, digest]
+
+        self.checks.append(self.pool.submit(check))
+
+    def finish(self):
+        # Wait for the outstanding checks and write the manifest
+        for check in self.checks:
+            self.manifest["chunks"].append(check.result())
+        self.checks = []
+        self.pool.shutdown()
+        self.manifest["chunks"].sort()
+        self.manifest["mismatches"] = sorted(self.mismatches)
+        with open(self.path, 'w') as f:
+            json.dump(self.manifest, f)
+
+def verify_manifest(path, workers=4, progress=None):
+    # Verify only mode: hash the destination of every chunk in a manifest and compare, returns mismatched offsets
+    with open(path) as f:
+        manifest = json.load(f)
+    disk_path = manifest["disk_path"]
+    dst = manifest["new_first"] * manifest["sector_size"]
+    algorithm = manifest["algorithm"]
+    chunks = manifest["chunks"]
+
+    def check(chunk):
+        offset, size, digest = chunk
+        return hash_range(lambda: open(disk_path, 'rb', buffering=0), dst + offset, size, algorithm) == digest
+
+    mismatches = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, (chunk, ok) in enumerate(zip(chunks, pool.map(check, chunks))):
+            if not ok:
+                print(f"Verify mismatch in chunk at offset {chunk[0]} ({chunk[1]} bytes)")
+                mismatches.append(chunk[0])
+            if progress:
+                progress(int((i + 1) / len(chunks) * 100))
+    return mismatches
+
+class SlideRunner:
+    # One slide, without any Qt. SlideJob runs it for the GUI and CLI.py's batch, the other CLI commands directly.
+    # Progress goes out through plain callbacks, any of which can be left as None:
+    #   on_progress(percent, done_bytes, total_bytes, eta_seconds)  eta_seconds is None until there is a rate
+    #   on_metrics(snapshot)  the SlideMetrics snapshot the progress comes from, rates and bytes remaining
+    #   on_report(text)  I/O mode, chunk size and the throughput summary
+    #   on_verify_failed(offsets)  chunks whose copy doesn't match the source
+    #   on_trace(record)  every SlideTrace record, per chunk timings, from the copy threads
+    # Both progress callbacks come at most every METRICS_INTERVAL seconds, from the copy threads.
+
+    def __init__(self, old_first, old_last, new_first, disk_path, sector_size, direct_io=False, logical_sector_size=None,
+                 memory_limit=512 * 1024 * 1024, autotune=True, used_only=False, type_byte=None, journal=None,
+                 verify=False, engine="pipelined", queue_depth=None, chunk_size=None, metrics_path=None, metrics=None,
+                 durability="chunk", sync_bytes=DURABILITY_SYNC_BYTES, trace_path=None):
+
+        self.old_first = int(old_first)
+        self.old_last = int(old_last)
+        self.new_first = int(new_first)
+        self.disk_path = disk_path
+        self.sector_size = int(sector_size)  # physical, for the chunk sizes
+        self.direct_io = direct_io
+        self.logical_sector_size = int(logical_sector_size or sector_size)  # what the sector numbers count
+        self.memory_limit = int(memory_limit)  # ceiling for the whole buffer pool, in bytes
+        self.autotune = autotune
+        self.used_only = used_only  # copy only what the filesystem has allocated
+        self.type_byte = type_byte  # MBR partition type, hint for the filesystem parser
+        self.journal = journal  # SlideJournal, new or loaded from an interrupted slide
+        self.verify = verify  # hash every chunk on both ends and keep a manifest
+        self.engine = engine  # "pipelined" (userspace), "kernel" (copy_file_range/sendfile) or "concurrent"
+        self.queue_depth = queue_depth  # I/Os in flight for the concurrent engine, None picks one for the disk
+        self.chunk_size = chunk_size  # fixed chunk size in bytes, turns the tuner off
+        self.metrics_path = metrics_path  # JSON lines file the metrics snapshots are appended to
+        self.metrics = metrics  # SlideMetrics shared with a PlanRunner, it reports the progress then
+        self.durability = durability  # Durability policy, "chunk", "bytes", "writeback" or "final"
+        self.sync_bytes = sync_bytes  # barrier interval of the "bytes" policy
+        self.trace_path = trace_path  # JSON lines file the per chunk SlideTrace records are appended to
+        self.on_progress = None
+        self.on_metrics = None
+        self.on_report = None
+        self.on_verify_failed = None
+        self.on_trace = None
+
+    def largest_chunk(self):
+        target_size = 256 * 1024 * 1024  # largest chunk, the memory limit and the tuner may pick less
+        if self.chunk_size:
+            target_size = int(self.chunk_size)
+            self.autotune = False
+        return self.sector_size * max(1, target_size // self.sector_size)
+
+    def disk_setup(self):
+        # What sysfs says about the disk, nothing for image files. Returns the preferred I/O size
+        info = disk_info(self.disk_path) or {}
+        if self.queue_depth is None:
+            self.queue_depth = self.auto_queue_depth(info)
+        self.queue_depth = int(self.queue_depth)
+        print("disk info:", info, "queue depth:", self.queue_depth)
+        return info.get("optimal_io_size") or None
+
+    def run(self):
+        block_size = self.logical_sector_size  # MBR LBAs are logical sectors, normally 512 bytes
+        bytes_per_round = self.largest_chunk()
+        partition_sectors = self.old_last - self.old_first
+        print("partition_sectors: ", partition_sectors)
+        if self.old_first == self.new_first:
+            print("no displacement")
+            return
+
+        start_time = time.time()
+        total_bytes = partition_sectors * block_size
+        print("total_bytes: ", total_bytes)
+        old_start = self.old_first * block_size
+        print("old_start: ", old_start)
+        new_first = self.new_first * block_size
+        print("new_first: ", new_first)
+        io_size = self.disk_setup()
+
+        extents = None
+        holes = None  # ranges an image file has no data in, punched at the destination after the copy
+        fs_name = None
+        done_before = 0
+        displacement = abs(new_first - old_start)
+        engine_class = self.pick_engine(displacement)
+        if self.journal and self.journal.resuming():
+            # The filesystem may already be half overwritten, so the extents come from the journal, not the disk
+            state = self.journal.state
+            fs_name = state.get("fs_name")
+            all_extents = [tuple(e) for e in state["extents"]]
+            bytes_per_round = state["chunk_cap"]
+            # The chunk cap was worked out for that engine and queue depth, keep them
+            engine_class = ENGINES[state.get("engine", "pipelined")]
+            self.queue_depth = state.get("queue_depth", self.queue_depth)
+            self.journal.restore(new_first)
+            if state.get("sparse"):
+                holes = hole_extents(all_extents, total_bytes)
+            extents = self.journal.remaining(all_extents)
+            done_before = sum(l for _, l in all_extents) - sum(l for _, l in extents)
+            print(f"Resuming slide from journal, {done_before} bytes already copied")
+        else:
+            fs_name, extents, holes = self.copy_extents(old_start, total_bytes)
+            if self.journal:
+                engine_class, bytes_per_round, backup = self.journal_engine(engine_class, displacement, bytes_per_round)
+                self.journal.state["fs_name"] = fs_name
+                self.journal.state["engine"] = next(k for k, v in ENGINES.items() if v is engine_class)
+                self.journal.state["queue_depth"] = self.queue_depth
+                self.journal.state["sparse"] = holes is not None
+                self.journal.begin(extents if extents is not None else [(0, total_bytes)], new_first < old_start,
+                                   bytes_per_round, backup)
+
+        verifier = None
+        if self.verify:
+            params = {"disk_path": self.disk_path, "old_first": self.old_first, "old_last": self.old_last,
+                      "new_first": self.new_first, "sector_size": self.logical_sector_size}
+            verifier = ChunkVerifier(manifest_path(self.disk_path), params, resume=done_before > 0)
+
+        extra = {"queue_depth": self.queue_depth} if engine_class is ConcurrentCopy else {}
+        durability = Durability(self.durability, self.sync_bytes)
+        trace = SlideTrace(self.trace_path, [self.on_trace] if self.on_trace else None,
+                           fields={"disk_path": self.disk_path, "resumed_bytes": done_before})
+        engine = engine_class(self.disk_path, old_start, new_first, total_bytes, bytes_per_round,
+                              direct=self.direct_io, alignment=self.logical_sector_size,
+                              memory_limit=self.memory_limit, autotune=self.autotune, extents=extents,
+                              journal=self.journal, verifier=verifier, io_size=io_size, durability=durability,
+                              trace=trace if trace else None, **extra)
+        print("io mode: ", engine.mode)
+        print("max chunk: ", engine.chunk_size, "autotune:", engine.tuner is not None)
+
+        metrics = self.metrics
+        if metrics is None:
+            metrics = SlideMetrics(done_before + engine.copy_bytes, done_before, on_update=self.emit_metrics,
+                                   path=self.metrics_path,
+                                   fields={"disk_path": self.disk_path, "durability": durability.policy})
+        else:
+            metrics.skip(done_before)
+        engine.on_bytes = metrics.add
+        metrics.cache = engine.cache
+        shown_chunk = None
+
+        def on_chunk(offset, size):
+            nonlocal shown_chunk
+            chunk = engine.current_chunk_size()
+            if chunk != shown_chunk and (engine.tuner is None or engine.tuner.chosen):
+                shown_chunk = chunk
+                self.emit_report(f"{engine.mode} I/O, chunk {chunk / (1024 ** 2):g} MiB")
+
+        cpu_start = time.process_time()
+        try:
+            engine.run(on_chunk)
+        except BaseException:
+            metrics.close()
+            trace.close()
+            raise
+        if holes:  # every read is done, so the destination holes can't take any source data with them
+            punched = punch_holes(self.disk_path, new_first, holes)
+            print(f"Punched {punched} of {sum(l for _, l in holes)} bytes of holes at the destination")
+
+        elapsed_time = time.time() - start_time
+        cpu_time = time.process_time() - cpu_start
+        speed = engine.copy_bytes / elapsed_time / (1024 ** 2) if elapsed_time > 0 else 0
+        summary = (f"{engine.mode} I/O, chunk {engine.current_chunk_size() / (1024 ** 2):g} MiB, "
+                   f"{speed:.1f} MiB/s, CPU {cpu_time:.1f}s, {durability.describe()}")
+        if holes is not None:
+            summary += f", image data {engine.copy_bytes / (1024 ** 3):.2f} of {total_bytes / (1024 ** 3):.2f} GiB"
+        elif fs_name:
+            summary += f", {fs_name} used blocks {engine.copy_bytes / (1024 ** 3):.2f} of {total_bytes / (1024 ** 3):.2f} GiB"
+        if engine.cache:
+            summary += f", page cache peak {engine.cache.peak / (1024 ** 2):.0f} MiB"
+        if verifier:
+            summary += f", verify: {len(verifier.mismatches)} mismatched chunks"
+        print(summary)
+        self.emit_report(summary)
+        if trace:
+            trace.finish(seconds=elapsed_time, cpu_seconds=cpu_time, mib_s=speed, syncs=durability.barriers)
+        if verifier and verifier.mismatches:
+            # Leave the partition table alone, the user decides what to do with a bad copy
+            if self.on_verify_failed:
+                self.on_verify_failed(verifier.mismatches)
+            if self.journal:
+                self.journal.state["status"] = "verify_failed"
+                self.journal.save()
+        elif self.journal:
+            self.journal.mark_copied()
+
+        if metrics is not self.metrics:
+            metrics.finish()
+
+    def probe(self, seconds=PROBE_SECONDS, write=False):
+        # Dry run: the engine, chunk size and extents run() would use for a journaled slide, a throughput sample of
+        # about seconds and the predicted duration, as a dict. Nothing on the disk changes. With write the part of
+        # the destination outside the source is read and the same bytes written back, so only call it with write
+        # once slide_problems() says that space is free
+        block_size = self.logical_sector_size
+        old_start = self.old_first * block_size
+        new_first = self.new_first * block_size
+        total_bytes = (self.old_last - self.old_first) * block_size
+        io_size = self.disk_setup()
+        displacement = abs(new_first - old_start)
+        fs_name, extents, holes = self.copy_extents(old_start, total_bytes)
+        engine_class, bytes_per_round, _ = self.journal_engine(self.pick_engine(displacement), displacement,
+                                                               self.largest_chunk())
+        extra = {"queue_depth": self.queue_depth} if engine_class is ConcurrentCopy else {}
+        engine = engine_class(self.disk_path, old_start, new_first, total_bytes, bytes_per_round,
+                              direct=self.direct_io, alignment=self.logical_sector_size,
+                              memory_limit=self.memory_limit, autotune=self.autotune, extents=extents,
+                              io_size=io_size, **extra)
+        scratch = None
+        if write and displacement:
+            if new_first < old_start:
+                scratch = [(new_first, min(new_first + total_bytes, old_start))]
+            else:
+                scratch = [(max(new_first, old_start + total_bytes), new_first + total_bytes)]
+            data = file_extents(self.disk_path, scratch[0][0], scratch[0][1] - scratch[0][0])
+            if data is not None:  # writing a hole back would fill it in, only rewrite what has data
+                scratch = [(scratch[0][0] + offset, scratch[0][0] + offset + length) for offset, length in data] or None
+        read_rate, write_rate, sampled = engine.probe(seconds, scratch, self.queue_depth if extra else 1)
+        mib = lambda rate: rate / (1024 ** 2) if rate else None
+        return {"disk_path": self.disk_path, "engine": next(k for k, v in ENGINES.items() if v is engine_class),
+                "mode": engine.mode, "chunk_bytes": engine.chunk_size, "queue_depth": self.queue_depth,
+                "total_bytes": total_bytes, "copy_bytes": engine.copy_bytes, "fs_name": fs_name,
+                "image": holes is not None, "read_mib_s": mib(read_rate), "write_mib_s": mib(write_rate),
+                "sampled_bytes": sampled, "durability": self.durability,
+                "estimate_seconds": estimate_seconds(engine.copy_bytes, read_rate, write_rate, self.verify)}
+
+    def copy_extents(self, old_start, total_bytes):
+        # (fs_name, extents, holes) for a new slide: what the filesystem uses with used_only, what an image file
+        # holds data in. extents is None for the whole partition, holes None unless it is an image file
+        fs_name = extents = holes = None
+        if self.used_only:
+            fs_name, extents = used_extents(self.disk_path, old_start, total_bytes, self.type_byte)
+            if extents is None:
+                print("Filesystem not recognised, copying the whole partition")
+            else:
+                print(f"{fs_name}: copying {sum(l for _, l in extents)} of {total_bytes} bytes in {len(extents)} extents")
+        data = file_extents(self.disk_path, old_start, total_bytes)
+        if data is not None:
+            print(f"Image file: {sum(l for _, l in data)} of {total_bytes} bytes hold data, in {len(data)} extents")
+            extents = data if extents is None else intersect_extents(extents, data)
+            holes = hole_extents(extents, total_bytes)
+        return fs_name, extents, holes
+
+    def journal_engine(self, engine_class, displacement, bytes_per_round):
+        # A chunk must fit in the displacement, and the concurrent engine only gets queue_depth writes in
+        # flight if queue_depth of them do. Only the pipelined engine can back up chunks for displacements
+        # too small for that. Returns (engine_class, bytes_per_round, backup)
+        in_flight = self.queue_depth if engine_class is ConcurrentCopy else 1
+        if engine_class is ConcurrentCopy and displacement // in_flight < JOURNAL_MIN_CHUNK:
+            print("Displacement too small for a journaled concurrent slide, using the pipelined engine")
+            engine_class, in_flight = PipelinedCopy, 1
+        backup = engine_class is PipelinedCopy and displacement < JOURNAL_MIN_CHUNK
+        # With backup every chunk is also written and fsynced to the .data file first, keep that small
+        cap = JOURNAL_MIN_CHUNK if backup else displacement // in_flight
+        bytes_per_round = min(bytes_per_round, cap - cap % self.sector_size)
+        return engine_class, bytes_per_round, backup
+
+    def auto_queue_depth(self, info):
+        # Spinning disks only seek more with more requests in flight, flash wants as many as it can take
+        if not info:
+            return 4
+        if info["rotational"]:
+            return 2
+        return max(2, min(info["queue_depth"] or 4, 32))
+
+    def pick_engine(self, displacement):
+        if self.engine == "kernel":
+            # The kernel path never sees the data, so it can't hash it, and tiny displacements mean tiny chunks
+            if self.verify:
+                print("Kernel copy can't verify inline, using the pipelined engine")
+            elif displacement < KERNEL_COPY_MIN_DISPLACEMENT:
+                print("Displacement too small for kernel copy, using the pipelined engine")
+            else:
+                return KernelCopy
+        elif self.engine == "concurrent":
+            if hasattr(os, 'preadv') and hasattr(os, 'pwritev'):
+                return ConcurrentCopy
+            print("preadv/pwritev not available here, using the pipelined engine")
+        return PipelinedCopy
+
+    def emit_metrics(self, snapshot):
+        if self.on_metrics:
+            self.on_metrics(snapshot)
+        if self.on_progress:
+            self.on_progress(snapshot["percent"], snapshot["done_bytes"], snapshot["total_bytes"], snapshot["eta_seconds"])
+
+    def emit_report(self, text):
+        if self.on_report:
+            self.on_report(text)
+
+METRICS_INTERVAL = 0.2  # seconds between progress updates, however long a chunk takes
+METRICS_SMOOTHING = 10.0  # seconds, time constant of the smoothed rate the ETA comes from
+
+class SlideMetrics:
+    # Live numbers of a running copy. The engines call add() for every piece they write (from several threads with
+    # the concurrent engine) and at most every METRICS_INTERVAL seconds a snapshot goes to on_update, and as one JSON
+    # line to path when there is one, so other tools can follow a slide while it runs. The ETA comes from an
+    # exponentially smoothed rate, so a fast start into the page cache or a throttled stretch moves it gradually.
+
+    def __init__(self, total_bytes, done_bytes=0, on_update=None, path=None, fields=None):
+        self.total_bytes = int(total_bytes)
+        self.done_bytes = int(done_bytes)
+        self.on_update = on_update
+        self.fields = dict(fields or {})  # added to every snapshot, like the disk
+        self.cache = None  # CacheHints of the running copy, what it holds goes into the snapshots
+        self.rate = 0.0  # bytes per second over the last interval
+        self.smoothed = None
+        self.start = self.last = time.monotonic()
+        self.last_done = self.done_bytes
+        self.lock = threading.Lock()
+        self.log = open(path, 'a') if path else None
+
+    def add(self, n):
+        with self.lock:
+            self.done_bytes += n
+            now = time.monotonic()
+            if now - self.last >= METRICS_INTERVAL:
+                self.sample(now)
+                self.publish()
+
+    def skip(self, n):
+        # Done without being copied (resumed from a journal, free space in a plan step), the rate doesn't see it
+        with self.lock:
+            self.done_bytes += n
+            self.last_done += n
+
+    def sample(self, now):
+        seconds = now - self.last
+        self.rate = (self.done_bytes - self.last_done) / seconds
+        if self.smoothed is None:
+            self.smoothed = self.rate
+        else:  # weighted by how long the sample took, so uneven intervals don't skew it
+            self.smoothed += (1 - math.exp(-seconds / METRICS_SMOOTHING)) * (self.rate - self.smoothed)
+        self.last = now
+        self.last_done = self.done_bytes
+
+    def snapshot(self):
+        remaining = max(0, self.total_bytes - self.done_bytes)
+        fields = dict(self.fields, cache_bytes=self.cache.held()) if self.cache else self.fields
+        return dict(fields, time=time.time(), elapsed_seconds=time.monotonic() - self.start,
+                    percent=int(self.done_bytes * 100 / self.total_bytes) if self.total_bytes else 100,
+                    done_bytes=self.done_bytes, total_bytes=self.total_bytes, remaining_bytes=remaining,
+                    rate_mib_s=self.rate / (1024 ** 2), smoothed_mib_s=(self.smoothed or 0) / (1024 ** 2),
+                    eta_seconds=remaining / self.smoothed if self.smoothed else (0 if not remaining else None))
+
+    def publish(self):
+        snapshot = self.snapshot()
+        if self.log:
+            self.log.write(json.dumps(snapshot) + "\n")
+            self.log.flush()
+        if self.on_update:
+            self.on_update(snapshot)
+
+    def finish(self):
+        # The last snapshot goes out whatever the interval
+        with self.lock:
+            now = time.monotonic()
+            if now > self.last and self.done_bytes > self.last_done:
+                self.sample(now)
+            self.publish()
+        self.close()
+
+    def close(self):
+        if self.log:
+            self.log.close()
+            self.log = None
+
+TRACE_HOOKS = []  # callables(record) every SlideTrace also calls, for profilers that can't get at the runner
+
+def rss_bytes():
+    # Resident memory of this process now, None where there is no /proc
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+class SlideTrace:
+    # Per chunk I/O trace of a copy, as JSON lines: a "start" record with the engine settings, one "chunk" record
+    # per chunk with its offset and size, the seconds it spent seeking, reading, writing and syncing ("copy" for
+    # the kernel engine, which does read and write in one call), the resident memory of the process and the page
+    # cache the slide holds, and an "end" record. The engines time every chunk anyway, this only writes it down:
+    # one json.dumps per chunk into a buffered file. Every record also goes to the hooks and TRACE_HOOKS, from the
+    # thread that writes the chunks. trace_summary() reads the file back. Several slides can append to one file
+
+    def __init__(self, path=None, hooks=None, fields=None):
+        self.file = open(path, 'a', buffering=1024 * 1024) if path else None
+        self.hooks = list(hooks or []) + TRACE_HOOKS
+        self.fields = dict(fields or {})  # added to the start record, like the disk
+        self.engine = None
+        self.start_time = None
+
+    def __bool__(self):
+        return bool(self.file or self.hooks)
+
+    def emit(self, record):
+        if self.file:
+            self.file.write(json.dumps(record) + "\n")
+        for hook in self.hooks:
+            hook(record)
+
+    def start(self, engine):
+        # Once per slide, the kernel engine starting again in userspace for what it couldn't copy doesn't count
+        first = self.engine is None
+        self.engine = engine
+        if not first:
+            return
+        self.start_time = time.perf_counter()
+        self.emit(dict(self.fields, event="start", time=time.time(), engine=type(engine).__name__, mode=engine.mode,
+                       src=engine.src, dst=engine.dst, copy_bytes=engine.copy_bytes, chunk_size=engine.chunk_size,
+                       buffer_bytes=engine.chunk_size * engine.buffers, durability=engine.durability.policy))
+
+    def chunk(self, offset, size, seek=0.0, read=None, write=None, sync=0.0, copy=None):
+        # Seconds for each step of the chunk at offset (relative to the partition)
+        cache = self.engine.cache
+        self.emit({"event": "chunk", "t": time.perf_counter() - self.start_time, "offset": offset, "size": size,
+                   "src": self.engine.src + offset, "dst": self.engine.dst + offset, "seek": seek, "read": read,
+                   "write": write, "sync": sync, "copy": copy, "rss": rss_bytes(),
+                   "cache": cache.held() if cache else None})
+
+    def finish(self, **fields):
+        self.emit(dict(fields, event="end", t=time.perf_counter() - self.start_time))
+        self.close()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+def percentiles(values, points=(50, 90, 99)):
+    # Nearest rank percentiles and the max of a list of numbers, None when it is empty
+    if not values:
+        return None
+    values = sorted(values)
+    result = {f"p{p}": values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))] for p in points}
+    result["max"] = values[-1]
+    return result
+
+def slow_regions(chunks, key, step, region_bytes, slow_factor):
+    # Disk regions of region_bytes where step (read/write/copy) ran below slow_factor times the median region rate,
+    # adjacent ones merged. key is "src" or "dst", where on the disk the step happened
+    regions = {}
+    for c in chunks:
+        if c.get(step):
+            r = regions.setdefault(c[key] // region_bytes, [0, 0.0])
+            r[0] += c["size"]
+            r[1] += c[step]
+    rates = {n: size / seconds for n, (size, seconds) in regions.items() if seconds > 0}
+    if len(rates) < 2:
+        return []
+    median = sorted(rates.values())[len(rates) // 2]
+    slow = []
+    for n in sorted(rates):
+        if rates[n] >= slow_factor * median:
+            continue
+        if slow and slow[-1]["end"] == n * region_bytes:
+            slow[-1]["end"] += region_bytes
+            slow[-1]["bytes"] += regions[n][0]
+            slow[-1]["seconds"] += regions[n][1]
+        else:
+            slow.append({"step": step, "start": n * region_bytes, "end": (n + 1) * region_bytes,
+                         "bytes": regions[n][0], "seconds": regions[n][1]})
+    for r in slow:
+        r["mib_s"] = r["bytes"] / r["seconds"] / (1024 ** 2)
+        r["median_mib_s"] = median / (1024 ** 2)
+    return slow
+
+def trace_summary(path, region_bytes=1024 ** 3, slow_factor=0.5):
+    # What a SlideTrace file says: per step time percentiles (ms) and rates (MiB/s), where the time went, peak
+    # memory and the slow regions of the disk, as a dict
+    chunks = []
+    slides = 0
+    wall = 0.0  # seconds from start to end, over all the slides in the file
+    last = None  # time of the last record of the current slide
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:  # a trace cut off by a crash ends in half a line
+                continue
+            if record.get("event") == "start":
+                slides += 1
+                wall += last or 0.0
+                last = None
+                continue
+            last = record.get("t", last)
+            if record.get("event") == "chunk":
+                chunks.append(record)
+    wall += last or 0.0
+    steps = ("seek", "read", "write", "sync", "copy")
+    times = {step: [c[step] for c in chunks if c.get(step) is not None] for step in steps}
+    summary = {"slides": slides, "chunks": len(chunks), "bytes": sum(c["size"] for c in chunks),
+               "ms": {step: percentiles([t * 1000 for t in v]) for step, v in times.items() if v},
+               "mib_s": {step: percentiles([c["size"] / c[step] / (1024 ** 2) for c in chunks if c.get(step)])
+                         for step in ("read", "write", "copy") if times[step]},
+               "seconds": {step: sum(v) for step, v in times.items() if v}}
+    # Reads run beside the writes in the pipelined and concurrent engines, so what the writing side doesn't account
+    # for is time spent waiting on reads, or in Python
+    busy = sum(summary["seconds"].get(step, 0) for step in ("seek", "write", "sync", "copy"))
+    summary["wall_seconds"] = wall
+    summary["other_seconds"] = max(0.0, wall - busy)
+    rss = [c["rss"] for c in chunks if c.get("rss")]
+    cache = [c["cache"] for c in chunks if c.get("cache") is not None]
+    summary["peak_rss_bytes"] = max(rss) if rss else None
+    summary["peak_cache_bytes"] = max(cache) if cache else None
+    summary["slow_regions"] = (slow_regions(chunks, "src", "read", region_bytes, slow_factor) +
+                               slow_regions(chunks, "dst", "write", region_bytes, slow_factor) +
+                               slow_regions(chunks, "dst", "copy", region_bytes, slow_factor))
+    return summary
+
+def format_eta(seconds):
+
+    days = int(seconds // (24 * 3600))
+    hours = int((seconds % (24 * 3600)) // 3600)
+    minutes = int((seconds % 3600) // 60)
+    secs = int(seconds % 60)
+    return f"{days}D, {hours}H, {minutes}M, {secs}S"
+
+def estimate_seconds(copy_bytes, read_rate, write_rate, verify=False):
+    # Predicted copy time from a probe. Source and destination are on the same disk, so the reads and writes are
+    # taken to take turns, which is on the safe side for disks that can do both at once. Without a write sample
+    # writes are taken to be as fast as reads. Rates in bytes/s
+    if not read_rate:
+        return None if copy_bytes else 0.0
+    write_rate = write_rate or read_rate
+    seconds = copy_bytes / read_rate + copy_bytes / write_rate
+    if verify:  # the verifier reads every chunk back
+        seconds += copy_bytes / read_rate
+    return seconds
+
+class MovePlanError(Exception):
+    # A target layout that can't be reached, raised by plan_moves()
+    pass
+
+MoveGroup = collections.namedtuple("MoveGroup", "first end new_first members")
+
+def overlap(a_first, a_end, b_first, b_end):
+    return a_first < b_end and b_first < a_end
+
+def plan_moves(partitions, targets, max_gap=0, names=None):
+    # partitions: (index, first, end, parent) for everything on the disk, in sectors with end exclusive. parent is
+    # the container an entry sits in (logical partitions and EBRs in their extended partition) or None.
+    # targets: {index: new_first} for the partitions that move. names: {index: what the errors call it}.
+    # Returns MoveGroups in an order where no group overwrites data that another one still has to read.
+    # Neighbours that move by the same offset become one group and are copied in one pass, with the free space
+    # between them when it is max_gap sectors or less.
+    layout = {i: (first, end) for i, first, end, _ in partitions}
+    parent = {i: p for i, _, _, p in partitions}
+    target = {i: (targets.get(i, first), targets.get(i, first) + end - first) for i, (first, end) in layout.items()}
+    nested = lambda a, b: parent[a] == b or parent[b] == a
+    name = lambda i: (names or {}).get(i, f"Partition {i}")
+    for i, new_first in targets.items():
+        if new_first < 0:
+            raise MovePlanError(f"{name(i)} can't start before sector 0")
+        if any(parent[j] == i for j in layout) and new_first != layout[i][0]:
+            raise MovePlanError(f"{name(i)} holds other partitions, move those instead")
+    spans = sorted(target, key=target.get)  # the keys mix partition indexes and "EBR n"
+    for n, a in enumerate(spans):
+        for b in spans[n + 1:]:
+            if not nested(a, b) and overlap(*target[a], *target[b]):
+                raise MovePlanError(f"{name(a)} and {name(b)} would overlap")
+
+    groups = []  # [first, end, offset, members]
+    for first, end, offset, i in sorted((*layout[i], targets[i] - layout[i][0], i) for i in targets
+                                        if targets[i] != layout[i][0]):
+        if groups:
+            g_first, g_end, g_offset, members = groups[-1]
+            in_gap = [j for j in layout if j != i and j not in members and not any(nested(j, m) for m in members + [i])
+                      and (overlap(g_end, first, *layout[j]) or overlap(g_end, first, *target[j]) or
+                           overlap(g_end + offset, first + offset, *layout[j]) or overlap(g_end + offset, first + offset, *target[j]))]
+            if g_offset == offset and 0 <= first - g_end <= max_gap and not in_gap:
+                groups[-1] = [g_first, end, offset, members + [i]]
+                continue
+        groups.append([first, end, offset, [i]])
+
+    # A group has to wait for every group whose data sits where it is going
+    waits = {n: {m for m, (first, end, _, _) in enumerate(groups)
+                 if m != n and overlap(groups[n][0] + groups[n][2], groups[n][1] + groups[n][2], first, end)}
+             for n in range(len(groups))}
+    order = []
+    while len(order) < len(groups):
+        ready = [n for n in range(len(groups)) if n not in order and not waits[n] - set(order)]
+        if not ready:
+            raise MovePlanError("The moves block each other (like two partitions trading places), "
+                                "move one of them out of the way first")
+        # Left moves from the left end, right moves from the right end, like sliding them by hand
+        order.append(min(ready, key=lambda n: (groups[n][2] > 0, groups[n][0] if groups[n][2] < 0 else -groups[n][0])))
+    return [MoveGroup(groups[n][0], groups[n][1], groups[n][0] + groups[n][2], groups[n][3]) for n in order]
+
+def mbr_plan(mbr_info, targets, max_gap=0):
+    # plan_moves() for a disk read with read_mbr(). targets is {index into mbr_info[4]: new_first}. Returns the
+    # steps a PlanRunner takes: [first, end, new_first, members, type_byte], type_byte only for single partitions
+    parts = mbr_info[4]
+    layout = []
+    names = {i: f"Partition {p[11] + 1}" for i, p in enumerate(parts)}  # the numbers Linux uses, like slide_problems()
+    for i, p in enumerate(parts):
+        container = None
+        if p[12] is not None:
+            container = next(j for j, e in enumerate(parts) if e[12] is None and int(e[3], 16) in MBR_EXTENDED
+                             and e[8] <= p[12] < e[10])
+            layout.append((f"EBR {p[12]}", p[12], p[12] + 1, container))  # the copy mustn't run over an EBR
+            names[f"EBR {p[12]}"] = f"EBR at sector {p[12]}"
+            new_first = targets.get(i, p[8])
+            if not (p[12] < new_first and new_first + p[9] <= p[13]):
+                raise MovePlanError(f"Partition {p[11] + 1} has to stay after its EBR (sector {p[12]}) "
+                                    f"and end by sector {p[13]}")
+        layout.append((i, p[8], p[10], container))
+    return [[g.first, g.end, g.new_first, g.members, parts[g.members[0]][3] if len(g.members) == 1 else None]
+            for g in plan_moves(layout, targets, max_gap, names)]
+
+def disk_size(disk_path):
+    # In bytes, for block devices and image files alike
+    fd = os.open(disk_path, os.O_RDONLY)
+    try:
+        return os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)
+
+def slide_problems(mbr_info, targets, sector_size, disk_bytes):
+    # Why the moves in targets ({index into mbr_info[4]: new_first}) can't be made, an empty list when they can.
+    # Checks the disk and MBR limits, and everything mbr_plan() checks: overlaps with the other entries and EBRs.
+    # sector_size is the logical one, what the LBAs count
+    problems = []
+    for i, new_first in targets.items():
+        p = mbr_info[4][i]
+        if new_first < 1:
+            problems.append(f"Partition {p[11] + 1} can't start at sector {new_first}, sector 0 holds the MBR")
+        elif (new_first + p[9]) * sector_size > disk_bytes:
+            problems.append(f"Partition {p[11] + 1} would end at sector {new_first + p[9]}, "
+                            f"past the end of the disk (sector {disk_bytes // sector_size})")
+        elif new_first + p[9] > 0xFFFFFFFF:
+            problems.append(f"Partition {p[11] + 1} would end past sector 2^32, beyond what an MBR can hold")
+    try:
+        mbr_plan(mbr_info, targets)
+    except MovePlanError as e:
+        problems.append(str(e))
+    return problems
+
+class PlanRunner:
+    # Runs the steps of a move plan (mbr_plan()) one after the other, each as a SlideRunner, with one journal for
+    # the whole plan. The journal has the plan and the step it is in, so an interrupted plan picks up in that step.
+    # The partition tables aren't touched here, update_mbr_many() does all of them once the journal says copied.
+    # Same callbacks as SlideRunner, with the progress and ETA over the whole plan.
+
+    def __init__(self, disk_path, steps, sector_size, journal=None, used_only=False, **options):
+        self.disk_path = disk_path
+        self.steps = steps
+        self.sector_size = int(sector_size)
+        self.logical_sector_size = int(options.get("logical_sector_size") or sector_size)
+        self.journal = journal
+        self.used_only = used_only  # only for steps with a single partition, the parser needs to know what it is
+        self.metrics_path = options.pop("metrics_path", None)
+        self.options = options  # the rest of the SlideRunner options
+        self.on_progress = None
+        self.on_metrics = None
+        self.on_report = None
+        self.on_verify_failed = None
+        self.on_trace = None
+
+    def run(self):
+        state = self.journal.state if self.journal else {}
+        step = state.get("step", 0)
+        if state.get("status") == "copied":  # that step is done, stopped before the next one began
+            step += 1
+        sizes = [(end - first) * self.logical_sector_size for first, end, _, _, _ in self.steps]
+        metrics = SlideMetrics(sum(sizes), sum(sizes[:step]), on_update=self.emit_metrics, path=self.metrics_path,
+                               fields={"disk_path": self.disk_path,
+                                       "durability": self.options.get("durability", "chunk")})
+        try:
+            self.run_steps(step, sizes, metrics)
+        finally:
+            metrics.close()
+
+    def run_steps(self, step, sizes, metrics):
+        state = self.journal.state if self.journal else {}
+        for n in range(step, len(self.steps)):
+            first, end, new_first, members, type_byte = self.steps[n]
+            print(f"Plan step {n + 1}/{len(self.steps)}: sectors {first}-{end} to {new_first}, partitions {members}")
+            if self.journal and not (state.get("step") == n and state.get("status") == "copying"):
+                state["step"] = n
+                state["status"] = "planned"  # so the runner starts this step instead of resuming one
+                self.journal.save()
+            failed = []
+            runner = SlideRunner(first, end, new_first, self.disk_path, self.sector_size, journal=self.journal,
+                                 used_only=self.used_only and type_byte is not None, type_byte=type_byte,
+                                 metrics=metrics, **self.options)
+            step_start = metrics.done_bytes
+            runner.on_report = lambda text, n=n: self.on_report and self.on_report(f"Step {n + 1}/{len(self.steps)}: {text}")
+            runner.on_verify_failed = failed.extend
+            runner.on_trace = self.on_trace
+            runner.run()
+            if failed:
+                print(f"Plan stopped at step {n + 1}, the copy didn't verify")
+                if self.on_verify_failed:
+                    self.on_verify_failed(failed)
+                return
+            metrics.skip(step_start + sizes[n] - metrics.done_bytes)  # whatever used_only left out
+        metrics.finish()
+
+    def probe(self, seconds=PROBE_SECONDS, write=False):
+        # SlideRunner.probe() for every step, the time shared between them. Only the first step gets a write
+        # sample, the destinations of later ones can still hold partitions that earlier steps move away
+        steps = []
+        for n, (first, end, new_first, members, type_byte) in enumerate(self.steps):
+            runner = SlideRunner(first, end, new_first, self.disk_path, self.sector_size,
+                                 used_only=self.used_only and type_byte is not None, type_byte=type_byte,
+                                 **self.options)
+            steps.append(runner.probe(seconds / len(self.steps), write and n == 0))
+        write_rate = steps[0]["write_mib_s"] if steps else None
+        for step in steps[1:]:
+            if write_rate and step["read_mib_s"]:
+                step["write_mib_s"] = write_rate
+                step["estimate_seconds"] = estimate_seconds(step["copy_bytes"], step["read_mib_s"] * 1024 ** 2,
+                                                            write_rate * 1024 ** 2, self.options.get("verify", False))
+        estimates = [step["estimate_seconds"] for step in steps]
+        return {"disk_path": self.disk_path, "steps": steps,
+                "total_bytes": sum(step["total_bytes"] for step in steps),
+                "copy_bytes": sum(step["copy_bytes"] for step in steps),
+                "estimate_seconds": None if None in estimates else sum(estimates)}
+
+    def emit_metrics(self, snapshot):
+        if self.on_metrics:
+            self.on_metrics(snapshot)
+        if self.on_progress:
+            self.on_progress(snapshot["percent"], snapshot["done_bytes"], snapshot["total_bytes"], snapshot["eta_seconds"])
+
+def sync_disk(disk_path):
+    fd = os.open(disk_path, os.O_RDWR)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def journal_moves(state):
+    # [(part, new_first)] a slide or move plan journal puts into the partition table
+    if "plan" in state:
+        return [tuple(move) for move in state["moves"]]
+    return [(state["part"], state["new_first"])]
+
+def finish_journal(journal, force=False):
+    # Writes the partition table once the journal says every chunk is on disk, then drops the journal.
+    # Returns (ok, message). force also takes a copy that didn't verify
+    state = journal.state
+    if state.get("status") == "verify_failed" and not force:
+        return False, "The copy didn't verify, partition table left unchanged"
+    if state.get("status") not in ("copied", "verify_failed", None):
+        return False, "Copy not complete, partition table left unchanged"
+    if "plan" in state and state["plan"] and state.get("step") != len(state["plan"]) - 1:
+        return False, "Move plan not complete, partition table left unchanged"
+    sync_disk(state["disk_path"])  # whatever the durability policy left in the cache goes out before the table
+    mbr_info = read_mbr(state["disk_path"], state["logical_sector_size"])
+    if not update_mbr_many(state["disk_path"], mbr_info, journal_moves(state), sector_size=state["logical_sector_size"]):
+        return False, "Partition table update failed"
+    try:
+        release_vacated(state)
+    except (OSError, PartitionTableError) as e:  # only space, the slide itself is done
+        print("Couldn't release the old space:", e)
+    journal.clear()
+    return True, "Partition table updated"
+
+class SlideJob:
+    # One slide or move plan for a SlideQueue, made from its journal: a new one or one left by an interrupted
+    # run. A new journal can carry "expect", [part, first sector] pairs read when the job was queued, which are
+    # checked against the disk when the job starts, so a job queued behind another one on the same disk doesn't
+    # move a partition that has moved since. options are the SlideRunner copy options
+
+    def __init__(self, journal, label="", force=False, **options):
+        self.journal = journal
+        self.disk_path = journal.state["disk_path"]
+        self.label = label
+        self.force = force  # update the partition table even when the copy didn't verify
+        self.options = options
+        self.status = "queued"
+        self.message = ""
+        self.snapshot = None  # last SlideMetrics snapshot
+        self.devices = device_keys(self.disk_path)
+        state = journal.state
+        if "plan" in state:
+            self.total_bytes = sum((end - first) * state["logical_sector_size"] for first, end, _, _, _ in state["plan"])
+        else:
+            self.total_bytes = (state["old_last"] - state["old_first"]) * state["logical_sector_size"]
+
+    def progress(self):
+        # (done_bytes, total_bytes), finished jobs count as all done
+        if self.status in ("done", "failed"):
+            total = self.snapshot["total_bytes"] if self.snapshot else self.total_bytes
+            return total, total
+        if self.snapshot:
+            return self.snapshot["done_bytes"], self.snapshot["total_bytes"]
+        return 0, self.total_bytes
+
+    def run(self, on_event):
+        state = self.journal.state
+        finished = state.get("status") in ("copied", "verify_failed") and (
+            "plan" not in state or state.get("step") == len(state["plan"]) - 1)
+        if state.get("status") is None:  # new, nothing copied yet
+            if os.path.exists(self.journal.path):  # an earlier job on this disk that didn't finish
+                raise PartitionTableError(f"{self.disk_path} has an unfinished slide, resume that one first")
+            parts = read_mbr(self.disk_path, state["logical_sector_size"])[4]
+            for part, first in state.get("expect", []):
+                if part >= len(parts):
+                    raise PartitionTableError(f"The partition table of {self.disk_path} changed since the job was queued")
+                if parts[part][8] != first:
+                    raise PartitionTableError(f"Partition {parts[part][11] + 1} moved since the job was queued "
+                                              f"(sector {first}, now {parts[part][8]})")
+        if not finished:
+            if state.get("status") == "verify_failed":  # a plan step the user takes as it is
+                state["status"] = "copied"
+                self.journal.save()
+            options = dict(self.options, logical_sector_size=state["logical_sector_size"], journal=self.journal)
+            if "plan" in state:
+                runner = PlanRunner(self.disk_path, state["plan"], state["sector_size"], **options)
+            else:
+                runner = SlideRunner(state["old_first"], state["old_last"], state["new_first"], self.disk_path,
+                                     state["sector_size"], type_byte=state.get("type_byte"), **options)
+            runner.on_metrics = lambda snapshot: self.metrics(snapshot, on_event)
+            runner.on_report = lambda text: on_event(self, "report", text)
+            runner.on_verify_failed = lambda offsets: on_event(self, "verify_failed", offsets)
+            runner.run()
+        ok, self.message = finish_journal(self.journal, self.force)
+        return ok
+
+    def metrics(self, snapshot, on_event):
+        self.snapshot = snapshot
+        on_event(self, "progress", snapshot)
+
+QUEUE_MIN_MEMORY = 16 * 1024 * 1024  # smallest buffer memory share a job starts with
+
+class SlideQueue:
+    # Runs SlideJobs, each in its own thread: jobs on different disks side by side, jobs that share a disk
+    # (partitions of one disk, images on it, LVM volumes over it) one after the other in the order they were added.
+    # on_event(job, event, data) comes from the job threads, with event one of
+    #   "status" (the job's new status)  "progress" (SlideMetrics snapshot)  "report" (text)
+    #   "verify_failed" (chunk offsets)
+    # memory_limit is the buffer memory for all running jobs together. The running jobs keep what they got, the jobs
+    # starting split what they left evenly, and when that is under QUEUE_MIN_MEMORY a job waits for one to finish.
+    # Add the jobs that are there from the start together, so the first one doesn't take all of it
+
+    def __init__(self, on_event=None, memory_limit=512 * 1024 * 1024, max_parallel=None):
+        self.jobs = []
+        self.on_event = on_event
+        self.memory_limit = memory_limit
+        self.max_parallel = max_parallel  # at most this many jobs at once, None for one per disk
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def add(self, *jobs):
+        with self.lock:
+            self.jobs.extend(jobs)
+        self.schedule()
+
+    def busy(self, disk_path):
+        # Is a job queued or running on the disk disk_path lives on
+        devices = device_keys(disk_path)
+        with self.lock:
+            return any(job.devices & devices for job in self.jobs if job.status in ("queued", "running"))
+
+    def active(self):
+        with self.lock:
+            return [job for job in self.jobs if job.status in ("queued", "running")]
+
+    def schedule(self):
+        started = []
+        with self.lock:
+            running = [job for job in self.jobs if job.status == "running"]
+            taken = set().union(*(job.devices for job in running))
+            ready = []
+            for job in self.jobs:
+                if job.status != "queued":
+                    continue
+                if not job.devices & taken and not (self.max_parallel and len(running) + len(ready) >= self.max_parallel):
+                    ready.append(job)
+                taken |= job.devices  # keeps later jobs on these disks behind this one
+            free = self.memory_limit - sum(job.options["memory_limit"] for job in running)
+            if ready:  # as many as get QUEUE_MIN_MEMORY, one anyway when nothing runs
+                ready = ready[:max(free // QUEUE_MIN_MEMORY, 0 if running else 1)]
+            for job in ready:
+                job.status = "running"
+                job.options["memory_limit"] = max(free // len(ready), QUEUE_MIN_MEMORY)
+                started.append(job)
+        for job in started:
+            self.event(job, "status", job.status)
+            thread = threading.Thread(target=self.run_job, args=(job,), daemon=True)  # the journal survives a quit
+            self.threads.append(thread)
+            thread.start()
+
+    def run_job(self, job):
+        try:
+            ok = job.run(self.event)
+        except Exception as e:  # anything, a job stuck as running would hold its disks forever
+            print(f"Job on {job.disk_path} failed: {e}")
+            ok, job.message = False, str(e)
+        with self.lock:
+            job.status = "done" if ok else "failed"
+        self.event(job, "status", job.status)
+        self.schedule()
+
+    def event(self, job, event, data):
+        if self.on_event:
+            self.on_event(job, event, data)
+
+    def progress(self):
+        # (done_bytes, total_bytes, eta_seconds) over every job. Every disk works through its own jobs, so the ETA
+        # is that of the disk that needs longest, None while a disk with work left has no rate yet
+        with self.lock:
+            jobs = list(self.jobs)
+        done = total = 0
+        disks = {}  # devices: [bytes left, rate]
+        for job in jobs:
+            job_done, job_total = job.progress()
+            done += job_done
+            total += job_total
+            if job.status in ("queued", "running"):
+                disk = disks.setdefault(job.devices, [0, None])
+                disk[0] += job_total - job_done
+                if job.status == "running" and job.snapshot:
+                    disk[1] = job.snapshot["smoothed_mib_s"] * 1024 ** 2
+        etas = [left / rate if rate else None for left, rate in disks.values()]
+        eta = None if None in etas else max(etas, default=0)
+        return done, total, eta
+
+    def wait(self):
+        while True:
+            with self.lock:
+                threads = [t for t in self.threads if t.is_alive()]
+            if not threads:
+                return
+            for thread in threads:
+                thread.join()
+
+def le(hex_str):
+    hex_str = str(hex_str)
+    if len(hex_str) % 2 != 0:
+        hex_str = "0" + hex_str
+
+    # Convert the hex string to a bytes object.
+    # bytes.fromhex() expects the string to have an even number of digits.
+    byte_data = bytes.fromhex(hex_str)
+        
+    # Convert the byte data from little-endian to an integer.
+    return int.from_bytes(byte_data, byteorder='little')
+      
+def el(n):
+    # Convert integer to hexadecimal string without '0x' prefix
+    hex_str = hex(int(n))[2:]
+        
+    # Pad the hex string to make its length even (for byte alignment)
+    padded_hex = hex_str.zfill(len(hex_str) + len(hex_str) % 2)
+        
+    # Create little-endian hex string
+    little_endian_hex = ''
+    for i in range(0, len(padded_hex), 2):
+        little_endian_hex = padded_hex[i:i+2] + little_endian_hex
+        
+    return little_endian_hex
+
+
+
+SYSFS_BLOCK = "/sys/block"
+DISK_CACHE = {"disks": None, "watch": None}  # last sysfs scan and what tells us it went stale
+DISK_LOCK = threading.Lock()  # the GUI scans from a worker thread
+
+def sysfs_value(path, default=0):
+    try:
+        with open(path) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return default
+
+def sysfs_disks():
+    # Same entries as the lsblk code below, read straight from /sys/block without forking anything.
+    # The fifth element has what the copy engine can tune with: optimal_io_size (0 when the device
+    # doesn't say), rotational, and the queue depth of the device (nr_requests when there is no hardware one)
+    disks = []
+    for name in sorted(os.listdir(SYSFS_BLOCK)):
+        device = os.path.join(SYSFS_BLOCK, name)
+        sectors = sysfs_value(os.path.join(device, "size"))  # always in 512 byte units, like lsblk SECTORS
+        if not sectors:  # unused loop devices, card readers without a card
+            continue
+        logical = sysfs_value(os.path.join(device, "queue", "logical_block_size"), 512)
+        physical = sysfs_value(os.path.join(device, "queue", "physical_block_size"), logical)
+        nr_requests = sysfs_value(os.path.join(device, "queue", "nr_requests"))
+        info = {"optimal_io_size": sysfs_value(os.path.join(device, "queue", "optimal_io_size")),
+                "rotational": bool(sysfs_value(os.path.join(device, "queue", "rotational"))),
+                "queue_depth": sysfs_value(os.path.join(device, "device", "queue_depth"), nr_requests),
+                "nr_requests": nr_requests}
+        disks.append([f"/dev/{name.replace('!', '/')}", physical, sectors, logical, info])  # cciss!c0d0 is /dev/cciss/c0d0
+    return disks
+
+def watch_block_devices():
+    # Kernel uevents over netlink, or inotify on /dev where netlink isn't allowed (some containers)
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC,
+                             15)  # NETLINK_KOBJECT_UEVENT
+        sock.bind((0, 1))  # the kernel's multicast group
+        return ("uevent", sock)
+    except (AttributeError, OSError) as e:
+        print(f"No uevent socket ({e}), watching /dev instead")
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0 or libc.inotify_add_watch(fd, b"/dev", 0x100 | 0x200) < 0:  # IN_CREATE | IN_DELETE
+            raise OSError(ctypes.get_errno(), "inotify failed")
+        return ("inotify", fd)
+    except (AttributeError, OSError) as e:
+        print(f"Can't watch /dev ({e}), disks are read again on every refresh")
+        return ("none", None)
+
+def block_devices_changed():
+    # True when block devices may have come, gone or changed size since the last call
+    if DISK_CACHE["watch"] is None:
+        DISK_CACHE["watch"] = watch_block_devices()
+        return True
+    kind, handle = DISK_CACHE["watch"]
+    changed = kind == "none"
+    while kind != "none":
+        try:
+            event = handle.recv(65536) if kind == "uevent" else os.read(handle, 65536)
+        except BlockingIOError:
+            break
+        except OSError as e:  # ENOBUFS: events were dropped, so anything might have happened
+            print(f"Device watch: {e}")
+            changed = True
+            break
+        if kind == "inotify" or b"SUBSYSTEM=block" in event:
+            changed = True
+    return changed
+
+def disk_info(disk_path):
+    # The sysfs extras for a disk from the cache, None for image files or when sysfs isn't there
+    for disk in get_disks_and_sectors():
+        if disk[0] == disk_path and disk[4]:
+            return disk[4]
+    return None
+
+def device_keys(path):
+    # The whole disks a disk, partition or image file lives on, as sysfs names ("sdb"). Two slides that share one
+    # of them fight over the same spindle or queue. Device mapper devices (LVM, dm-crypt) resolve to the disks
+    # under them. Without sysfs it is the device number, or the path itself when that can't be had either
+    try:
+        st = os.stat(path)
+    except OSError:
+        return frozenset([os.path.realpath(path)])
+    dev = st.st_rdev if stat.S_ISBLK(st.st_mode) else st.st_dev
+    if not hasattr(os, 'major'):
+        return frozenset([str(dev)])
+    name = f"{os.major(dev)}:{os.minor(dev)}"
+    block = os.path.realpath(os.path.join("/sys/dev/block", name))
+    if not os.path.isdir(block):
+        return frozenset([name])
+    keys = set()
+    pending = [block]
+    while pending:
+        block = pending.pop()
+        if os.path.exists(os.path.join(block, "partition")):
+            block = os.path.dirname(block)
+        slaves = os.path.join(block, "slaves")
+        under = os.listdir(slaves) if os.path.isdir(slaves) else []
+        if under:
+            pending.extend(os.path.realpath(os.path.join(slaves, n)) for n in under)
+        else:
+            keys.add(os.path.basename(block))
+    return frozenset(keys)
+
+def get_disks_and_sectors():
+    if os.name == 'posix' and platform.system() == 'Linux' and os.path.isdir(SYSFS_BLOCK):
+        # sysfs is cheap to read, but a refresh only reads it again when the device watch saw something
+        with DISK_LOCK:
+            if block_devices_changed() or DISK_CACHE["disks"] is None:
+                try:
+                    DISK_CACHE["disks"] = sysfs_disks()
+                except OSError as e:
+                    print(f"Reading {SYSFS_BLOCK} failed: {e}")
+                    DISK_CACHE["disks"] = None
+            if DISK_CACHE["disks"] is not None:
+                return [disk[:4] + [dict(disk[4])] for disk in DISK_CACHE["disks"]]
+
+    if os.name == 'posix' and platform.system() == 'Linux':
+        try:
+            result = subprocess.run(['lsblk', '-n', '-o', 'NAME,SECTORS,PHY-SEC,LOG-SEC', '-d'],
+                                  capture_output=True, text=True, check=True)
+            disk_list = []
+            for line in result.stdout.strip().split('\n'):
+                if line:
+                    parts = line.split()
+                    if len(parts) >= 4 and parts[1].isdigit() and parts[2].isdigit() and parts[3].isdigit():
+                        name, sectors, bytes_per_sector, logical_sector = parts[0], parts[1], parts[2], parts[3]
+                        disk_list.append([f"/dev/{name}", int(bytes_per_sector), int(sectors), int(logical_sector), {}])
+            return disk_list
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return [["Error", 0, 0, 0, {}]]
+    
+    elif os.name == 'nt':  # Windows
+        try:
+            result = subprocess.run(['wmic', 'diskdrive', 'get', 'DeviceID,BytesPerSector,TotalSectors'],
+                                  capture_output=True, text=True, check=True)
+            disk_list = []
+            lines = result.stdout.strip().split('\n')[1:]  # Skip header
+            for line in lines:
+                line = line.strip()
+                if line:  # Ignore empty lines
+                    # Split on whitespace and filter out empty strings
+                    parts = [p for p in line.split() if p]
+                    if len(parts) == 3 and parts[0].isdigit() and parts[2].isdigit():
+                        bytes_per_sector, device_id, sectors = parts[0], parts[1], parts[2]
+                        disk_list.append([device_id, int(bytes_per_sector), int(sectors), int(bytes_per_sector), {}])
+            return disk_list
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return [["Error", 0, 0, 0, {}]]
+    
+    else:
+        return [["Unsupported OS", 0, 0, 0, {}]]
+
+# Filesystem allocation maps, used to copy only the allocated parts of a partition.
+# Every parser returns a list of (offset, length) byte ranges relative to the start of the
+# partition, or None when the partition doesn't hold that filesystem.
+
+FS_METADATA_MARGIN = 1024 * 1024  # always copied at both ends of the partition (boot sectors, backup boot sectors)
+EXTENT_ROUNDING = 64 * 1024  # extents are rounded out to this, keeps them aligned for direct I/O
+EXTENT_MERGE_GAP = 1024 * 1024  # free gaps smaller than this are copied anyway, fewer and larger I/Os
+
+MBR_FS_HINTS = {
+    '83': 'ext', '43': 'ext', '44': 'ext',
+    '07': 'ntfs', '17': 'ntfs',
+    '01': 'fat', '04': 'fat', '06': 'fat', '0B': 'fat', '0C': 'fat', '0E': 'fat', '11': 'fat',
+    '14': 'fat', '16': 'fat', '1B': 'fat', '1C': 'fat', '1E': 'fat', 'EF': 'fat',
+}
+
+def bitmap_runs(bitmap, nbits):
+    # (first_bit, bit_count) runs of set bits, bits are LSB first like ext and NTFS store them.
+    # Whole 0x00/0xFF bytes are skipped in one regex match so big, mostly empty bitmaps stay fast
+    runs = []
+    run_start = None
+    for m in re.finditer(rb'\x00+|\xff+|[\x01-\xfe]', bitmap):
+        first = m.start() * 8
+        byte = bitmap[m.start()]
+        if byte == 0xFF:
+            if run_start is None:
+                run_start = first
+        elif byte == 0:
+            if run_start is not None:
+                runs.append((run_start, first - run_start))
+                run_start = None
+        else:
+            for bit in range(8):
+                if byte >> bit & 1:
+                    if run_start is None:
+                        run_start = first + bit
+                elif run_start is not None:
+                    runs.append((run_start, first + bit - run_start))
+                    run_start = None
+    if run_start is not None:
+        runs.append((run_start, len(bitmap) * 8 - run_start))
+    return [(s, min(c, nbits - s)) for s, c in runs if s < nbits]
+
+def merge_extents(extents, size, gap=EXTENT_MERGE_GAP, margin=FS_METADATA_MARGIN):
+    # Round out, clip to the partition, add the always-copied margins and merge close neighbours
+    rounded = [(0, min(margin, size)), (max(0, size - margin), size)]
+    for offset, length in extents:
+        if length <= 0:
+            continue
+        start = offset - offset % EXTENT_ROUNDING
+        end = -(-(offset + length) // EXTENT_ROUNDING) * EXTENT_ROUNDING
+        rounded.append((max(0, start), min(size, end)))
+    rounded.sort()
+    merged = []
+    for start, end in rounded:
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end - start) for start, end in merged]
+
+def ext_extents(disk, base, size):
+    disk.seek(base + 1024)
+    sb = disk.read(1024)
+    if len(sb) < 1024 or struct.unpack_from('<H', sb, 0x38)[0] != 0xEF53:
+        return None
+    blocks_count = struct.unpack_from('<I', sb, 0x04)[0]
+    first_data_block, log_block, log_cluster, blocks_per_group, clusters_per_group = struct.unpack_from('<IIIII', sb, 0x14)
+    inodes_per_group = struct.unpack_from('<I', sb, 0x28)[0]
+    rev_level = struct.unpack_from('<I', sb, 0x4C)[0]
+    inode_size = struct.unpack_from('<H', sb, 0x58)[0] if rev_level else 128
+    incompat, ro_compat = struct.unpack_from('<II', sb, 0x60)
+    reserved_gdt = struct.unpack_from('<H', sb, 0xCE)[0]
+    block_size = 1024 << log_block
+    if incompat & 0x80:  # 64bit
+        blocks_count |= struct.unpack_from('<I', sb, 0x150)[0] << 32
+        desc_size = struct.unpack_from('<H', sb, 0xFE)[0] or 32
+    else:
+        desc_size = 32
+    if incompat & 0x10:  # meta_bg moves the descriptors around, not worth handling
+        return None
+    bigalloc = ro_compat & 0x200
+    unit = (1024 << log_cluster) if bigalloc else block_size  # what one bitmap bit covers
+    units_per_group = clusters_per_group if bigalloc else blocks_per_group
+    if blocks_per_group == 0 or blocks_count * block_size > size:
+        return None
+
+    groups = -(-(blocks_count - first_data_block) // blocks_per_group)
+    gdt_offset = (first_data_block + 1) * block_size
+    disk.seek(base + gdt_offset)
+    gdt = disk.read(groups * desc_size)
+    if len(gdt) < groups * desc_size:
+        return None
+    gdt_blocks = -(-len(gdt) // block_size)
+    inode_table_blocks = -(-inodes_per_group * inode_size // block_size)
+
+    extents = [(0, gdt_offset + (gdt_blocks + reserved_gdt) * block_size)]
+    for g in range(groups):
+        d = g * desc_size
+        block_bitmap, inode_bitmap, inode_table = struct.unpack_from('<III', gdt, d)
+        flags = struct.unpack_from('<H', gdt, d + 0x12)[0]
+        if desc_size >= 64:
+            hi = struct.unpack_from('<III', gdt, d + 0x20)
+            block_bitmap |= hi[0] << 32
+            inode_bitmap |= hi[1] << 32
+            inode_table |= hi[2] << 32
+        group_start = (first_data_block + g * blocks_per_group) * block_size
+        # Group metadata is copied whatever the bitmaps say
+        extents.append((block_bitmap * block_size, block_size))
+        extents.append((inode_bitmap * block_size, block_size))
+        extents.append((inode_table * block_size, inode_table_blocks * block_size))
+        if flags & 0x2:  # BLOCK_UNINIT, only a superblock/descriptor backup can live here
+            extents.append((group_start, (1 + gdt_blocks + reserved_gdt) * block_size))
+            continue
+        disk.seek(base + block_bitmap * block_size)
+        bitmap = disk.read(-(-units_per_group // 8))
+        in_group = min(units_per_group, -(-(blocks_count - first_data_block - g * blocks_per_group) * block_size // unit))
+        for first, count in bitmap_runs(bitmap, in_group):
+            extents.append((group_start + first * unit, count * unit))
+    return extents
+
+def fat_extents(disk, base, size):
+    disk.seek(base)
+    boot = disk.read(512)
+    if len(boot) < 512 or boot[510:512] != b'\x55\xaa':
+        return None
+    bytes_per_sector, sectors_per_cluster, reserved, num_fats, root_entries, total16 = struct.unpack_from('<HBHBHH', boot, 11)
+    fat_size16 = struct.unpack_from('<H', boot, 22)[0]
+    total32, fat_size32 = struct.unpack_from('<II', boot, 32)
+    if bytes_per_sector not in (512, 1024, 2048, 4096) or sectors_per_cluster == 0 or num_fats == 0 or reserved == 0:
+        return None
+    total = total16 or total32
+    fat_size = fat_size16 or fat_size32
+    root_sectors = -(-root_entries * 32 // bytes_per_sector)
+    data_start = (reserved + num_fats * fat_size + root_sectors) * bytes_per_sector
+    clusters = (total * bytes_per_sector - data_start) // (sectors_per_cluster * bytes_per_sector)
+    if fat_size == 0 or clusters <= 0 or total * bytes_per_sector > size:
+        return None
+    cluster_size = sectors_per_cluster * bytes_per_sector
+
+    disk.seek(base + reserved * bytes_per_sector)
+    fat = disk.read(fat_size * bytes_per_sector)
+    extents = [(0, data_start)]  # boot sector, reserved sectors, all FAT copies and the FAT12/16 root directory
+    entries = clusters + 2
+    if clusters < 4085:  # FAT12, small enough to just walk it
+        used = []
+        for n in range(2, entries):
+            pair = fat[n * 3 // 2] | fat[n * 3 // 2 + 1] << 8
+            value = pair >> 4 if n & 1 else pair & 0xFFF
+            if value:
+                used.append(n)
+        for n in used:
+            extents.append((data_start + (n - 2) * cluster_size, cluster_size))
+        return extents
+
+    entry_size = 2 if clusters < 65525 else 4
+    # Free clusters are zero entries, so find runs of zero bytes and trim them to whole entries
+    free = []
+    for m in re.finditer(rb'\x00+', fat[:entries * entry_size]):
+        first = -(-m.start() // entry_size)
+        last = m.end() // entry_size
+        if last > first:
+            free.append((first, last))
+    n = 2
+    for first, last in free + [(entries, entries)]:
+        first = max(first, 2)
+        if first > n:
+            extents.append((data_start + (n - 2) * cluster_size, (first - n) * cluster_size))
+        n = max(n, last)
+    return extents
+
+def ntfs_extents(disk, base, size):
+    disk.seek(base)
+    boot = disk.read(512)
+    if len(boot) < 512 or boot[3:11] != b'NTFS    ':
+        return None
+    bytes_per_sector, spc = struct.unpack_from('<HB', boot, 11)
+    if spc > 0x80:
+        spc = 1 << (256 - spc)
+    cluster_size = bytes_per_sector * spc
+    total_sectors, mft_lcn = struct.unpack_from('<QQ', boot, 40)
+    record_clusters = struct.unpack_from('<b', boot, 64)[0]
+    record_size = 1 << -record_clusters if record_clusters < 0 else record_clusters * cluster_size
+    if cluster_size == 0 or total_sectors * bytes_per_sector > size:
+        return None
+
+    # MFT record 6 is $Bitmap, one bit per cluster
+    disk.seek(base + mft_lcn * cluster_size + 6 * record_size)
+    record = bytearray(disk.read(record_size))
+    if record[:4] != b'FILE':
+        return None
+    usa_offset, usa_count = struct.unpack_from('<HH', record, 4)
+    for i in range(1, usa_count):  # undo the update sequence fixups, they always use a 512 byte stride
+        end = i * 512
+        record[end - 2:end] = record[usa_offset + 2 * i:usa_offset + 2 * i + 2]
+
+    attr = struct.unpack_from('<H', record, 20)[0]
+    while attr + 16 <= len(record):
+        attr_type, attr_len = struct.unpack_from('<II', record, attr)
+        if attr_type == 0xFFFFFFFF or attr_len == 0:
+            return None
+        if attr_type == 0x80 and record[attr + 8]:  # non resident $DATA
+            break
+        attr += attr_len
+    else:
+        return None
+    runs_offset = struct.unpack_from('<H', record, attr + 32)[0]
+    bitmap_size = struct.unpack_from('<Q', record, attr + 48)[0]
+
+    bitmap = bytearray()
+    pos = attr + runs_offset
+    lcn = 0
+    while pos < attr + attr_len and record[pos]:
+        len_size, off_size = record[pos] & 0x0F, record[pos] >> 4
+        run_len = int.from_bytes(record[pos + 1:pos + 1 + len_size], 'little')
+        run_off = int.from_bytes(record[pos + 1 + len_size:pos + 1 + len_size + off_size], 'little', signed=True)
+        pos += 1 + len_size + off_size
+        if off_size == 0:  # sparse run, can't happen for $Bitmap
+            return None
+        lcn += run_off
+        disk.seek(base + lcn * cluster_size)
+        bitmap += disk.read(run_len * cluster_size)
+    bitmap = bytes(bitmap[:bitmap_size])
+
+    clusters = total_sectors * bytes_per_sector // cluster_size
+    extents = [(0, cluster_size)]
+    for first, count in bitmap_runs(bitmap, clusters):
+        extents.append((first * cluster_size, count * cluster_size))
+    return extents
+
+FS_PARSERS = {'ext': ext_extents, 'fat': fat_extents, 'ntfs': ntfs_extents}
+
+def used_extents(disk_path, base, size, type_byte=None):
+    # The MBR type byte decides which parser goes first, the others are still tried by signature
+    hint = MBR_FS_HINTS.get(str(type_byte or '').upper())
+    names = sorted(FS_PARSERS, key=lambda name: name != hint)
+    try:
+        with open(disk_path, 'rb') as disk:
+            for name in names:
+                try:
+                    extents = FS_PARSERS[name](disk, base, size)
+                except (struct.error, IndexError, ValueError, OverflowError) as e:
+                    print(f"{name} allocation map unreadable:", e)
+                    continue
+                if extents is not None:
+                    return name, merge_extents(extents, size)
+    except OSError as e:
+        print("Failed to read allocation map:", e)
+    return None, None
+
+# Image files: holes read as zeros, so only the data in them has to be copied. SEEK_DATA/SEEK_HOLE find it, and
+# the holes are punched at the destination instead of written, so the image stays sparse.
+
+FALLOC_PUNCH_HOLE = 0x01 | 0x02  # FALLOC_FL_KEEP_SIZE | FALLOC_FL_PUNCH_HOLE from linux/falloc.h
+FALLOCATE = {"func": None}  # libc fallocate(), looked up on first use
+
+def image_file(disk_path):
+    # Is disk_path a regular file (a disk image) rather than a block device
+    try:
+        return stat.S_ISREG(os.stat(disk_path).st_mode)
+    except OSError:
+        return False
+
+def image_disk(path):
+    # An image file as a get_disks_and_sectors() entry, with 512 byte sectors like the CLI assumes for images
+    path = os.path.abspath(path)
+    return [path, 512, os.path.getsize(path) // 512, 512, {}]
+
+def file_extents(disk_path, base, size):
+    # Data ranges of an image file in [base, base + size), relative to base, rounded and merged like the
+    # filesystem extents. None for block devices and where SEEK_DATA isn't there
+    if not hasattr(os, 'SEEK_DATA') or not image_file(disk_path):
+        return None
+    extents = []
+    fd = os.open(disk_path, os.O_RDONLY)
+    try:
+        position, end = base, base + size
+        while position < end:
+            try:
+                data = os.lseek(fd, position, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:  # nothing but holes from here to the end of the file
+                    break
+                print("SEEK_DATA failed:", e)
+                return None
+            if data >= end:
+                break
+            hole = min(os.lseek(fd, data, os.SEEK_HOLE), end)
+            extents.append((data - base, hole - data))
+            position = hole
+    finally:
+        os.close(fd)
+    return merge_extents(extents, size, gap=0, margin=0)  # a merged gap would be written as zeros, no longer a hole
+
+def intersect_extents(a, b):
+    # The ranges in both sorted extent lists
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][0] + a[i][1], b[j][0] + b[j][1])
+        if end > start:
+            result.append((start, end - start))
+        if a[i][0] + a[i][1] < b[j][0] + b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+def hole_extents(extents, size):
+    # The ranges of [0, size) that aren't in the sorted extent list
+    holes = []
+    position = 0
+    for offset, length in extents:
+        if offset > position:
+            holes.append((position, offset - position))
+        position = max(position, offset + length)
+    if position < size:
+        holes.append((position, size - position))
+    return holes
+
+def punch_hole(fd, offset, length):
+    # Deallocates a range of a file, it reads back as zeros. False where the OS or filesystem can't
+    if not sys.platform.startswith("linux"):
+        return False
+    if FALLOCATE["func"] is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        FALLOCATE["func"] = getattr(libc, "fallocate64", None) or libc.fallocate
+        FALLOCATE["func"].argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    if FALLOCATE["func"](fd, FALLOC_PUNCH_HOLE, offset, length) == 0:
+        return True
+    print(f"Can't punch a hole at {offset}: {os.strerror(ctypes.get_errno())}")
+    return False
+
+def punch_holes(disk_path, base, holes, zero_fill=True):
+    # Turns every (offset, length) in holes, relative to base, into a hole. With zero_fill what can't be
+    # punched is written with zeros instead, so it reads the same. Returns the bytes punched
+    punched = 0
+    fd = os.open(disk_path, os.O_RDWR)
+    try:
+        for offset, length in holes:
+            if punched >= 0 and punch_hole(fd, base + offset, length):
+                punched += length
+                continue
+            punched = -1  # don't try again for every hole
+            position, end = base + offset, base + offset + length
+            while zero_fill and position < end:
+                position += os.pwrite(fd, bytes(min(end - position, 4 * 1024 * 1024)), position)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return max(punched, 0)
+
+def release_vacated(state):
+    # Once the partition table points at the new places, punches what the moved partitions of an image file
+    # left behind, everything of their old ranges that no partition or EBR uses now. Returns the bytes released
+    if not image_file(state["disk_path"]):
+        return 0
+    if "plan" in state:
+        old = [(first, end) for first, end, _, _, _ in state["plan"]]
+    else:
+        old = [(state["old_first"], state["old_last"])]
+    taken = []
+    for p in read_mbr(state["disk_path"], state["logical_sector_size"])[4]:
+        if p[12] is not None:
+            taken.append((p[12], 1))
+        if not (p[12] is None and int(p[3], 16) in MBR_EXTENDED):  # the container itself is mostly free space
+            taken.append((p[8], p[9]))
+    taken.sort()
+    sector_size = state["logical_sector_size"]
+    vacated = []
+    for first, end in old:
+        vacated += [(first + offset, length) for offset, length in
+                    hole_extents([(o - first, l) for o, l in taken if o < end and o + l > first], end - first)]
+    released = punch_holes(state["disk_path"], 0, [(o * sector_size, l * sector_size) for o, l in vacated],
+                           zero_fill=False)
+    print(f"Released {released} bytes the slide left behind in {state['disk_path']}")
+    return released
+
+GPT_PARTITION_TYPES = [
+    {"GUID": "00000000-0000-0000-0000-000000000000", "Description": "Unused entry"},
+    {"GUID": "024DEE41-33E7-11D3-9D69-0008C781F39F", "Description": "MBR partition scheme"},
+    {"GUID": "C12A7328-F81F-11D2-BA4B-00A0C93EC93B", "Description": "EFI System partition"},
+    {"GUID": "21686148-6449-6E6F-744E-656564454649", "Description": "BIOS boot partition"},
+    {"GUID": "D3BFE2DE-3DAF-11DF-BA40-E3A556D89593", "Description": "Intel Fast Flash (iFFS) partition (for Intel Rapid Start technology)"},
+    {"GUID": "F4019732-066E-4E12-8273-346C5641494F", "Description": "Sony boot partition"},
+    {"GUID": "BFBFAFE7-A34F-448A-9A5B-6213EB736C22", "Description": "Lenovo boot partition"},
+    {"GUID": "E3C9E316-0B5C-4DB8-817D-F92DF00215AE", "Description": "Microsoft Reserved Partition (MSR)"},
+    {"GUID": "EBD0A0A2-B9E5-4433-87C0-68B6B72699C7", "Description": "Basic data partition"},
+    {"GUID": "5808C8AA-7E8F-42E0-85D2-E1E90434CFB3", "Description": "Logical Disk Manager (LDM) metadata partition"},
+    {"GUID": "AF9B60A0-1431-4F62-BC68-3311714A69AD", "Description": "Windows Storage Spaces partition"},
+    {"GUID": "0FC63DAF-8483-4772-8E79-3D69D8477DE4", "Description": "Linux filesystem data"},
+    {"GUID": "A19D880F-05FC-4D3B-A006-743F0F84911E", "Description": "Linux RAID partition"},
+    {"GUID": "0657FD6D-A4AB-43C4-84E5-0933C84B4F4F", "Description": "Linux swap partition"},
+    {"GUID": "E6D6D379-F507-44C2-A23C-238F2A3DF928", "Description": "Linux Logical Volume Manager (LVM) partition"},
+    {"GUID": "933AC7E1-2EB4-4F13-B844-0E14E2AEF915", "Description": "Linux /home partition"},
+    {"GUID": "3B8F8425-20E0-4F3B-907F-1A25A76F98E8", "Description": "Linux /srv (server data) partition"},
+    {"GUID": "7FFEC5C9-2D00-49B7-8941-3EA10A5586B7", "Description": "Linux plain dm-crypt partition"},
+    {"GUID": "CA7D7CCB-63ED-4C53-861C-1742536059CC", "Description": "Linux LUKS partition"},
+    {"GUID": "8DA63339-0007-60C0-C436-083AC8230908", "Description": "Linux reserved"},
+    {"GUID": "A2A0D0EB-E5B9-3344-87C0-68B6B72699C7", "Description": "FreeBSD disklabel"},
+    {"GUID": "516E7CB4-6ECF-11D6-8FF8-00022D09712B", "Description": "FreeBSD boot partition"},
+    {"GUID": "516E7CB5-6ECF-11D6-8FF8-00022D09712B", "Description": "FreeBSD data partition"},
+    {"GUID": "516E7CB6-6ECF-11D6-8FF8-00022D09712B", "Description": "FreeBSD swap partition"},
+    {"GUID": "516E7CB8-6ECF-11D6-8FF8-00022D09712B", "Description": "FreeBSD UFS partition"},
+    {"GUID": "516E7CB7-6ECF-11D6-8FF8-00022D09712B", "Description": "FreeBSD ZFS partition"},
+    {"GUID": "516E7CBA-6ECF-11D6-8FF8-00022D09712B", "Description": "FreeBSD Vinum volume manager partition"},
+    {"GUID": "48465300-0000-11AA-AA11-00306543ECAC", "Description": "Apple HFS+ partition"},
+    {"GUID": "55465300-0000-11AA-AA11-00306543ECAC", "Description": "Apple UFS partition"},
+    {"GUID": "6A898CC3-1DD2-11B2-99A6-080020736631", "Description": "Apple ZFS partition"},
+    {"GUID": "52414944-0000-11AA-AA11-00306543ECAC", "Description": "Apple RAID partition"},
+    {"GUID": "52414944-5F4F-11AA-AA11-00306543ECAC", "Description": "Apple RAID offline partition"},
+    {"GUID": "426F6F74-0000-11AA-AA11-00306543ECAC", "Description": "Apple Boot partition"},
+    {"GUID": "4C616265-6C00-11AA-AA11-00306543ECAC", "Description": "Apple Label partition"},
+    {"GUID": "5265636F-7665-11AA-AA11-00306543ECAC", "Description": "Apple TV Recovery partition"},
+    {"GUID": "53746F72-6167-11AA-AA11-00306543ECAC", "Description": "Apple Core Storage (i.e. Lion FileVault) partition"},
+    {"GUID": "6A82CB45-1DD2-11B2-99A6-080020736631", "Description": "Solaris boot partition"},
+    {"GUID": "6A85CF4D-1DD2-11B2-99A6-080020736631", "Description": "Solaris root partition"},
+    {"GUID": "6A87C46F-1DD2-11B2-99A6-080020736631", "Description": "Solaris /usr partition"},
+    {"GUID": "6A8B642B-1DD2-11B2-99A6-080020736631", "Description": "Solaris swap partition"},
+    {"GUID": "6A8D2AC7-1DD2-11B2-99A6-080020736631", "Description": "Solaris backup partition"},
+    {"GUID": "6A898CC3-1DD2-11B2-99A6-080020736631", "Description": "Solaris /var partition"},
+    {"GUID": "6A8EF2E9-1DD2-11B2-99A6-080020736631", "Description": "Solaris /home partition"},
+    {"GUID": "6A90BA39-1DD2-11B2-99A6-080020736631", "Description": "Solaris alternate sector"},
+    {"GUID": "6A9283A5-1DD2-11B2-99A6-080020736631", "Description": "Solaris reserved partition"},
+    {"GUID": "6A945A3B-1DD2-11B2-99A6-080020736631", "Description": "Solaris root pool"},
+    {"GUID": "6A9630D1-1DD2-11B2-99A6-080020736631", "Description": "Solaris boot pool"},
+    {"GUID": "49F48D32-B10E-11DC-B99B-0019D1879648", "Description": "NetBSD swap partition"},
+    {"GUID": "49F48D5A-B10E-11DC-B99B-0019D1879648", "Description": "NetBSD FFS partition"},
+    {"GUID": "49F48D82-B10E-11DC-B99B-0019D1879648", "Description": "NetBSD LFS partition"},
+    {"GUID": "49F48DAA-B10E-11DC-B99B-0019D1879648", "Description": "NetBSD RAID partition"},
+    {"GUID": "49F48DD2-B10E-11DC-B99B-0019D1879648", "Description": "NetBSD Concatenated partition"},
+    {"GUID": "2DB519C4-B10F-11DC-B99B-0019D1879648", "Description": "NetBSD encrypted partition"},
+    {"GUID": "FE3A2A5D-4F32-41A7-B725-ACCC3285A309", "Description": "VMware VMFS partition"},
+    {"GUID": "AA31E02A-400F-11DB-9590-000C2911D1B8", "Description": "VMware reserved partition"},
+    {"GUID": "9D275380-40AD-11DB-BF97-000C2911D1B8", "Description": "VMware kcore crash partition"},
+    {"GUID": "11D2F81B-FD4F-459B-9ADB-9091ED7E593F", "Description": "XenServer Linux partition"},
+    {"GUID": "5B193300-FC78-40CD-8002-E86C45580B47", "Description": "Microsoft Basic Data partition"},
+    {"GUID": "0376FF8D-D1A5-11E3-8E7D-001B21B9EADD", "Description": "Ceph OSD partition"},
+    {"GUID": "45B0969E-9B03-4F30-B4C6-5EC00CEFF106", "Description": "Ceph disk in creation"},
+    {"GUID": "4FBD7E29-9D25-41B8-AFD0-062C0CEFF05D", "Description": "Ceph journal"},
+    {"GUID": "89C57F98-2FE5-4DC0-89C1-F3AD0CEFF2BE", "Description": "Ceph crypt"},
+    {"GUID": "FB3AABF9-D6F9-46D8-9F9D-D6A4E56C5E36", "Description": "Ceph block"},
+    {"GUID": "CAFECAFE-9B03-4F30-B4C6-5EC00CEFF106", "Description": "Ceph block DB"},
+    {"GUID": "30D3B3C4-9B03-4F30-B4C6-5EC00CEFF106", "Description": "Ceph block write-ahead log"}
+]
+
+# Type GUID as it is stored on disk (mixed endian bytes) -> description, the first entry wins like in the list scan
+GPT_TYPE_NAMES = {uuid.UUID(t["GUID"]).bytes_le: t["Description"] for t in reversed(GPT_PARTITION_TYPES)}
+
+GPT_HEADER = struct.Struct('<8sIIII4Q16sQIII')  # the 92 bytes of the header that are defined
+GPT_ENTRY = struct.Struct('<16s16sQQQ72s')  # type GUID, unique GUID, first LBA, last LBA (inclusive), attributes, UTF-16 name
+GPTEntry = collections.namedtuple("GPTEntry", "index type_guid unique_guid first_lba last_lba attributes name")
+GPT_UNUSED = bytes(16)
+
+def parse_gpt_header(sector):
+    # Header fields of an LBA 1 (or backup) sector, None when the signature or the CRC32 doesn't match
+    view = memoryview(sector)
+    header = GPT_HEADER.unpack_from(view)
+    signature, revision, header_size, header_crc = header[:4]
+    if signature != b"EFI PART" or not GPT_HEADER.size <= header_size <= len(view):
+        return None
+    # The CRC covers header_size bytes with the CRC field itself taken as zero
+    crc = zlib.crc32(view[:16])
+    crc = zlib.crc32(b"\0\0\0\0", crc)
+    if zlib.crc32(view[20:header_size], crc) != header_crc:
+        return None
+    return header
+
+def parse_gpt_entries(array, entry_size):
+    # The whole entry array in one go: one struct record per entry over a memoryview, no hex strings.
+    # Entries can be bigger than 128 bytes, the extra bytes are skipped. Unused entries (zero type GUID) are left out
+    record = struct.Struct(GPT_ENTRY.format + f"{entry_size - GPT_ENTRY.size}x")
+    return [GPTEntry(index, *fields) for index, fields in enumerate(record.iter_unpack(memoryview(array)))
+            if fields[0] != GPT_UNUSED]
+
+def gpt_guid(raw):
+    return str(uuid.UUID(bytes_le=raw))
+
+def partition_scheme(disk_path):
+    # "GPT" when the MBR only holds the protective 0xEE entry that GPT disks have, "MBR" otherwise
+    with open(r'{}'.format(disk_path), 'rb') as disk:
+        sector = disk.read(512)
+    if len(sector) == 512 and any(entry.type == 0xEE for entry in parse_mbr(sector)):
+        return "GPT"
+    return "MBR"
+
+def gpt_partitions(gpt):
+    # (first, end, name) tuples like Load() builds for MBR disks, end is exclusive there too
+    return [(p[3], p[4] + 1, p[6] or p[1]) for p in sorted(gpt[15].values())]
+
+def read_gpt(disk_path, sector_size=None):
+    # Primary header at LBA 1, the backup in the last LBA if that one is damaged. Without a sector size
+    # both 512 and 4096 are tried, the header is where the signature is
+    with open(r'{}'.format(disk_path), 'rb') as disk:
+        header = None
+        for size in ([sector_size] if sector_size else [512, 4096]):
+            disk.seek(size)
+            header = parse_gpt_header(disk.read(size))
+            if header is None:
+                disk.seek(0, os.SEEK_END)
+                last_lba = disk.tell() // size - 1
+                if last_lba > 1:
+                    disk.seek(last_lba * size)
+                    header = parse_gpt_header(disk.read(size))
+                    if header is not None:
+                        print(f"Primary GPT header damaged, using the backup at LBA {last_lba}")
+            if header is not None:
+                sector_size = size
+                break
+        if header is None:
+            raise PartitionTableError("No GPT header on this disk")
+
+        (signature, revision, header_size, CRC32, reserved, current_lba, backup_lba, first_partition, last_lba, GUID,
+         partition_entry_starting_lba, partition_entry_count, partition_entry_size, partition_array_CRC32) = header
+        if partition_entry_size < GPT_ENTRY.size or partition_entry_size % 8:
+            raise PartitionTableError(f"Unexpected GPT entry size {partition_entry_size}")
+        disk.seek(partition_entry_starting_lba * sector_size)
+        array = disk.read(partition_entry_count * partition_entry_size)
+    if len(array) != partition_entry_count * partition_entry_size or zlib.crc32(array) != partition_array_CRC32:
+        raise PartitionTableError("GPT partition entry array CRC32 doesn't match, the table is damaged")
+
+    GPTs = {}
+    for entry in parse_gpt_entries(array, partition_entry_size):
+        attributes = [f"{entry.attributes:016x}", bool(entry.attributes & 1), bool(entry.attributes & 2),
+                      bool(entry.attributes & 4)]  # [raw, Required_Partition, No_Block_IO_Protocol, Legacy_BIOS_Bootable]
+        name = entry.name.decode('utf-16-le', 'replace').split('\0', 1)[0]
+        type_name = GPT_TYPE_NAMES.get(entry.type_guid) or "Unknow: " + gpt_guid(entry.type_guid)
+        GPTs[f'Partition{entry.index}'] = [entry.index, type_name, gpt_guid(entry.unique_guid), entry.first_lba,
+                                           entry.last_lba, attributes, name]
+    revision = f"{revision >> 16}.{revision & 0xFFFF}"
+    return [signature.hex(), signature.decode(), revision, header_size, f"{CRC32:08x}", f"{reserved:08x}", current_lba,
+            backup_lba, first_partition, last_lba, gpt_guid(GUID), partition_entry_starting_lba, partition_entry_count,
+            partition_entry_size, f"{partition_array_CRC32:08x}", GPTs, sector_size]
+
+MBR_ENTRY = struct.Struct('<B3sB3sII')  # status, CHS of the first sector, type, CHS of the last sector, first LBA, sectors
+MBR_TABLE = 446  # offset of the four 16 byte entries, the 55 AA signature follows at 510
+MBREntry = collections.namedtuple("MBREntry", "slot status chs_first type chs_last first_lba sectors")
+
+def parse_mbr(sector):
+    # Typed entries for all four slots, unpacked straight from the sector buffer (bytes, bytearray, mmap)
+    view = memoryview(sector)
+    if len(view) < 512:
+        raise PartitionTableError("Unexpected length, please exit program")
+    return [MBREntry(slot, *fields) for slot, fields in enumerate(MBR_ENTRY.iter_unpack(view[MBR_TABLE:MBR_TABLE + 64]))]
+
+def lba_to_chs(lba, heads=255, sectors=63):
+    # CHS bytes of an MBR entry for an LBA, with the geometry every tool since the 90s assumes. Anything past
+    # cylinder 1023 can't be expressed and gets the usual FE FF FF, the LBA fields are what counts there
+    cylinder, rest = divmod(lba, heads * sectors)
+    if cylinder > 1023:
+        return b'\xfe\xff\xff'
+    head, sector = divmod(rest, sectors)
+    return bytes((head, (sector + 1) | ((cylinder >> 2) & 0xC0), cylinder & 0xFF))
+
+def patch_mbr_entry(sector, entry, first_lba, sectors=None, chs_base=0):
+    # Rewrites one entry in the sector buffer in place: new first LBA (and size), both CHS fields, the rest is kept.
+    # EBR entries hold LBAs relative to something, chs_base makes their CHS fields absolute again
+    sectors = entry.sectors if sectors is None else sectors
+    MBR_ENTRY.pack_into(sector, MBR_TABLE + entry.slot * MBR_ENTRY.size, entry.status, lba_to_chs(chs_base + first_lba),
+                        entry.type, lba_to_chs(chs_base + first_lba + max(sectors, 1) - 1), first_lba, sectors)
+
+MBR_EXTENDED = (0x05, 0x0F, 0x85)  # CHS, LBA and Linux extended partitions
+EBR_WINDOW = 256 * 1024  # bytes read at once while walking an EBR chain
+EBR_MAX_LINKS = 4096
+
+def read_ebr_chain(disk, extended_first, extended_sectors, sector_size=512):
+    # Walks the EBRs of an extended partition. Returns (ebr_lba, entry, limit) for every logical partition:
+    # the entry is the EBR's first entry (its first LBA is relative to the EBR), limit is the LBA of the next
+    # EBR or the end of the extended partition, the logical partition has to stay below it.
+    # Every read fetches EBR_WINDOW bytes, so links that land close by (small logical partitions, tools that
+    # put the EBRs one track apart) come from memory instead of one seek each
+    windows = {}
+    reads = 0
+
+    def sector(lba):
+        nonlocal reads
+        offset = lba * sector_size
+        base = offset - offset % EBR_WINDOW
+        if base not in windows:
+            disk.seek(base)
+            windows[base] = disk.read(EBR_WINDOW)
+            reads += 1
+        return windows[base][offset - base:offset - base + 512]
+
+    extended_end = extended_first + extended_sectors
+    logicals = []
+    seen = set()
+    ebr = extended_first
+    while True:
+        if ebr in seen or len(seen) >= EBR_MAX_LINKS:
+            print(f"EBR chain loops back to sector {ebr}, stopping there")
+            break
+        seen.add(ebr)
+        raw = sector(ebr)
+        if len(raw) < 512 or raw[510:512] != b'\x55\xaa':
+            print(f"No EBR signature at sector {ebr}, stopping there")
+            break
+        data, link = parse_mbr(raw)[:2]
+        next_ebr = extended_first + link.first_lba if link.type in MBR_EXTENDED and link.first_lba else None
+        if next_ebr is not None and not extended_first < next_ebr < extended_end:
+            print(f"EBR at sector {ebr} links outside the extended partition ({next_ebr}), stopping there")
+            next_ebr = None
+        if data.type and data.sectors:
+            logicals.append((ebr, data, next_ebr if next_ebr is not None else extended_end))
+        if next_ebr is None:
+            break
+        ebr = next_ebr
+    print(f"EBR chain: {len(logicals)} logical partitions, {len(seen)} EBRs in {reads} reads")
+    return logicals
+
+def read_mbr(disk_path, sector_size=512):
+    with open(r'{}'.format(disk_path), 'rb') as disk:
+        # Read the first 512 bytes
+        rawB = disk.read(512)
+
+        entries = parse_mbr(rawB)
+        chains = []
+        for entry in entries:
+            if entry.type in MBR_EXTENDED and entry.sectors and entry.status in (0x80, 0x00):
+                chains.append(read_ebr_chain(disk, entry.first_lba, entry.sectors, sector_size))
+
+    rawH = rawB.hex()
+
+    def type_check(B):
+        partition_types = [
+        ['00', 'Empty or Unused'],
+        ['01', 'FAT12'],
+        ['02', 'XENIX root'],
+        ['03', 'XENIX usr'],
+        ['04', 'FAT16 (Small)'],
+        ['05', 'Extended Partition'],
+        ['06', 'FAT16'],
+        ['07', 'NTFS / HPFS / exFAT'],
+        ['08', 'AIX bootable'],
+        ['09', 'AIX data'],
+        ['0A', 'OS/2 Boot Manager'],
+        ['0B', 'FAT32 (CHS)'],
+        ['0C', 'FAT32 (LBA)'],
+        ['0E', 'FAT16 (LBA)'],
+        ['0F', 'Extended Partition (LBA)'],
+        ['10', 'OPUS'],
+        ['11', 'Hidden FAT12'],
+        ['12', 'Compaq diagnostcs'],
+        ['14', 'FAT16 (LBA)'],
+        ['16', 'Hidden FAT16'],
+        ['17', 'Hidden NTFS'],
+        ['1B', 'Hidden FAT32'],
+        ['1C', 'Hidden FAT32 (LBA)'],
+        ['1E', 'Hidden FAT16 (LBA)'],
+        ['24', 'NEC DOS'],
+        ['39', 'Plan 9'],
+        ['3C', 'PartitionMagic recovery'],
+        ['40', 'Venix 80286'],
+        ['41', 'Linux/MINIX'],
+        ['42', 'Linux Swap'],
+        ['43', 'Linux Ext2/Ext3 (Old format)'],
+        ['44', 'Linux Ext2/Ext3 (New format)'],
+        ['83', 'Linux ext FS'],
+        ['84', 'Linux swap / Solaris'],
+        ['8E', 'Linux LVM'],
+        ['93', 'Amoeba'],
+        ['A0', 'IBM Thinkpad hidden'],
+        ['A5', 'FreeBSD'],
+        ['A6', 'OpenBSD'],
+        ['A8', 'Mac OS X'],
+        ['A9', 'NetBSD'],
+        ['AF', 'Mac OS X HFS+'],
+        ['B7', 'BSDI'],
+        ['B8', 'Boot Manager'],
+        ['BE', 'Solaris Boot Partition'],
+        ['BF', 'Solaris / OpenIndiana'],
+        ['C0', 'NTFS Boot Partition'],
+        ['C1', 'FreeBSD boot'],
+        ['C4', 'TrueCrypt volume'],
+        ['C7', 'Windows 7 recovery'],
+        ['D1', 'OpenBSD bootstrap'],
+        ['D3', 'GParted'],
+        ['D5', 'FreeBSD UFS2'],
+        ['D6', 'Solaris (x86) partition'],
+        ['D7', 'OpenBSD partition'],
+        ['E1', 'Linux RAID'],
+        ['E2', 'Linux LVM2'],
+        ['E3', 'Linux EVMS'],
+        ['E4', 'MS-DOS 6.0'],
+        ['E5', 'OpenDOS'],
+        ['E6', 'OS/2 Boot Manager'],
+        ['E7', 'Non-OS/2 Boot Manager'],
+        ['EB', 'FAT16 (LBA) (exFAT)'],
+        ['EC', 'Windows 98 SE'],
+        ['EE', 'GPT Protective'],
+        ['EF', 'EFI System Partition'],
+        ['F0', 'Microsoft Reserved'],
+        ['F2', 'Linux Swap (used by newer Linux versions)'],
+        ['F4', 'Microsoft Windows recovery partition'],
+        ['F6', 'HPFS/NTFS'],
+        ['F7', 'HPFS/NTFS (Boot)'],
+        ['F8', 'OEM proprietary'],
+        ['F9', 'BSD']
+        ]
+        for i in range(0, len(partition_types)):
+            if B.upper() == partition_types[i][0]:  # the table is uppercase, hex() gives lowercase
+                return partition_types[i][1]
+        return "Unknow"
+
+    def partition(entry):
+        if entry == (entry.slot, 0, b'\0\0\0', 0, b'\0\0\0', 0, 0):
+            return "Empty"
+        if entry.status not in (0x80, 0x00):
+            raise PartitionTableError("UnExpected PartitionTable Headerraw, please exit program")
+        Type_B = f"{entry.type:02x}"
+        LastSector = entry.first_lba + entry.sectors
+        # The CHS bytes stay hex strings like they always were, slot is where the entry sits in the MBR
+        return [entry.chs_first[:1].hex(), entry.chs_first[1:2].hex(), entry.chs_first[2:].hex(), Type_B, type_check(Type_B),
+                entry.chs_last[:1].hex(), entry.chs_last[1:2].hex(), entry.chs_last[2:].hex(),
+                entry.first_lba, entry.sectors, LastSector, entry.slot, None, None, None]
+
+    DiskSig = rawH[880:892]
+    PartitionTable = rawH[892:1020]
+    Signature = rawH[-4:]
+    Partition_Tables = []
+    for entry in entries:
+        part = partition(entry)
+        if part != "Empty":
+            Partition_Tables.append(part)
+    # Logical partitions come after the primaries, numbered from slot 4 on (the 5 in sda5)
+    slot = 4
+    for chain in chains:
+        previous = None
+        for ebr, entry, limit in chain:
+            try:
+                part = partition(entry)
+            except PartitionTableError as e:
+                print(f"Bad logical partition entry in the EBR at sector {ebr}: {e}")
+                break
+            part[8] += ebr  # relative to the EBR on disk
+            part[10] += ebr
+            part[11:] = [slot, ebr, limit, previous]
+            Partition_Tables.append(part)
+            previous = ebr
+            slot += 1
+
+    return [rawH, DiskSig, PartitionTable, Signature, Partition_Tables] #Partition_Tables are parsed, in form of list of [Cylinder, Head, Sector, Type_B, Type, Cylinder2, Head2, Sector2, FirstSector, TotalSector, LastSector, Slot, EBR, Limit, PreviousEBR], the last three are None for primary partitions
+
+def patch_table_sector(disk, lba, sector_size, patches):
+    # Read, check and patch the table sector at lba (the MBR or an EBR) in memory, write_table_sector() writes it
+    # back. Returns the patched sector, None when it isn't what was expected. A patch is (slot, expected first LBAs,
+    # expected sizes, first_lba, sectors, chs_base). Expected sizes None takes any size, sectors can be
+    # {old size: new size}, a size not in it is kept
+    sector = mmap.mmap(-1, sector_size)  # page aligned, like the O_DIRECT buffers
+    disk.seek(lba * sector_size)
+    if disk.readinto(sector) != sector_size:
+        print(f"Short read of the partition table at sector {lba}")
+        return None
+    entries = parse_mbr(sector)
+    for slot, expect_first, expect_sectors, first_lba, sectors, chs_base in patches:
+        entry = entries[slot]
+        if entry.first_lba not in expect_first or (expect_sectors is not None and entry.sectors not in expect_sectors):
+            # Someone else changed the table since it was read, don't write over it
+            print(f"Entry {slot} at sector {lba} changed on disk ({entry.first_lba}, {entry.sectors}), not updating it")
+            return None
+    for slot, expect_first, expect_sectors, first_lba, sectors, chs_base in patches:
+        if isinstance(sectors, dict):
+            sectors = sectors.get(entries[slot].sectors)
+        patch_mbr_entry(sector, entries[slot], first_lba, sectors, chs_base)
+        offset = MBR_TABLE + slot * MBR_ENTRY.size
+        print(f"entry {slot} at sector {lba} old:", MBR_ENTRY.pack(*entries[slot][1:]).hex(),
+              "new:", sector[offset:offset + MBR_ENTRY.size].hex())
+    return sector
+
+def write_table_sector(disk, lba, sector_size, sector):
+    disk.seek(lba * sector_size)
+    if disk.write(sector) != sector_size:
+        print(f"Short write of the partition table at sector {lba}")
+        return False
+    os.fsync(disk.fileno())
+    return True
+
+def table_patches(mbr_info, part_number, New_First):
+    # What moving one partition changes in the tables, as (sector, patch) pairs for patch_table_sector().
+    # A primary partition is one entry in the MBR. A logical partition's entry is in its EBR, relative to the EBR.
+    # The link to it in the EBR before can run to the end of the partition, then that size changes as well. Other
+    # partitioners make it cover the whole slot up to the next EBR, that one stays as it is
+    part = mbr_info[4][part_number]
+    slot, old_first, sectors, ebr, limit, previous = part[11], part[8], part[9], part[12], part[13], part[14]
+    if ebr is None:
+        return [(0, (slot, (old_first, New_First), (sectors,), New_First, None, 0))]
+    if not (ebr < New_First and New_First + sectors <= limit):
+        raise MovePlanError(f"Logical partition has to stay between its EBR at sector {ebr} and sector {limit}")
+    patches = [(ebr, (0, (old_first - ebr, New_First - ebr), (sectors,), New_First - ebr, None, ebr))]
+    if previous is not None:  # the first logical partition is covered by the extended partition entry
+        extended = next(p[8] for p in mbr_info[4] if p[12] is None and int(p[3], 16) in MBR_EXTENDED and p[8] <= ebr < p[10])
+        patches.append((previous, (1, (ebr - extended,), None, ebr - extended,
+                                   {old_first + sectors - ebr: New_First + sectors - ebr}, extended)))
+    return patches
+
+def update_mbr_many(path, mbr_info, moves, sector_size=512):
+    # Moves every (part_number, New_First) in moves, part_number being an index into what read_mbr() returned
+    # before the slide. Every table sector is read and checked before the first one is written, so a table that
+    # changed under the slide is left as it is. Then each is written once, the EBRs first and the MBR last
+    sector_size = max(512, int(sector_size))
+    sectors = {}
+    try:
+        for part_number, New_First in moves:
+            for lba, patch in table_patches(mbr_info, part_number, int(New_First)):
+                sectors.setdefault(lba, []).append(patch)
+    except MovePlanError as e:
+        print(f"{e}, not updating it")
+        return False
+    print(f"Opening disk with path in update_mbr: {path}")
+    try:
+        disk = open(r'{}'.format(path), 'r+b', buffering=0)
+        try:
+            patched = {}
+            for lba in sorted(sectors, key=lambda lba: lba == 0):
+                patched[lba] = patch_table_sector(disk, lba, sector_size, sectors[lba])
+                if patched[lba] is None:
+                    return False  # nothing written yet
+            for lba, sector in patched.items():
+                if not write_table_sector(disk, lba, sector_size, sector):
+                    return False
+        finally:
+            disk.close()  # Explicitly close the file
+            print(f"Closed disk in update_mbr: {path}")
+    except OSError as e:
+        print(f"Failed to open or write to disk in update_mbr: {e}")
+        return False
+    return True
+
+def update_mbr(path, mbr_info, part_number, New_First, sector_size=512):
+    # Moves one partition by patching just its 16 byte entry (and its EBR link for a logical one), CHS included
+    return update_mbr_many(path, mbr_info, [(part_number, New_First)], sector_size)
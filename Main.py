@@ -1,176 +1,178 @@
-from PyQt6 import QtWidgets, uic
-from PyQt6.uic import loadUi
-from PyQt6.QtWidgets import *
-from PyQt6.QtGui import *
-from PyQt6.QtCore import *
+import time
+STARTUP = {"start": time.perf_counter()}  # startup milestones, see MainWindow.startup_report()
+# Only the Qt classes that are used, PyQt6.uic is only imported when 1.ui has to be compiled again
+from PyQt6.QtWidgets import QApplication, QFileDialog, QMainWindow, QMessageBox, QWidget
+from PyQt6.QtGui import QColor, QFont, QFontMetrics, QGuiApplication, QIcon, QPainter, QPen, QPixmap
+from PyQt6.QtCore import QObject, QRectF, QThread, QTimer, Qt, pyqtSignal
+from Core import (DURABILITY_POLICIES, MBR_EXTENDED, MovePlanError, PartitionTableError, PlanRunner, SlideJob,
+                  SlideJournal, SlideQueue, SlideRunner, disk_size, format_eta, get_disks_and_sectors, gpt_partitions,
+                  image_disk, manifest_path, mbr_plan, partition_scheme, read_gpt, read_mbr, slide_problems,
+                  verify_manifest)
 import sys
-import subprocess
-import platform
 import os
-import time
+import re
+import json
+import hashlib
+import bisect
+import importlib.util
+STARTUP["imports"] = time.perf_counter()
+
+UI_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__uicache__")
+
+def load_ui(ui_path, window):
+    # Same result as uic.loadUi(ui_path, window), but through a compiled copy of the .ui in __uicache__, so the
+    # XML isn't parsed on every start. The first line of the copy is the hash of the .ui it was compiled from,
+    # when that doesn't match anymore it gets compiled again. Returns how the UI was loaded, for the timing report
+    with open(ui_path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    name = "ui_" + re.sub(r'[^A-Za-z0-9]+', '_', os.path.basename(ui_path))
+    cache = os.path.join(UI_CACHE_DIR, name + ".py")
+    try:
+        with open(cache) as f:
+            how = "cached" if f.readline().strip() == "# " + digest else None
+    except OSError:
+        how = None
+
+    if how is None:
+        from PyQt6 import uic
+        try:
+            os.makedirs(UI_CACHE_DIR, exist_ok=True)
+            with open(cache + ".tmp", 'w') as f:
+                f.write("# " + digest + "\n")
+                uic.compileUi(ui_path, f)
+            os.replace(cache + ".tmp", cache)
+            compiled = importlib.util.cache_from_source(cache)
+            if os.path.exists(compiled):  # the .pyc check is mtime and size only, don't trust it after a rebuild
+                os.remove(compiled)
+            how = "compiled"
+        except OSError as e:  # read only media, parse the .ui every time then
+            print(f"Can't write UI cache {cache}: {e}")
+            uic.loadUi(ui_path, window)
+            return "loadUi"
+
+    spec = importlib.util.spec_from_file_location(name, cache)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    ui = next(getattr(module, n) for n in dir(module) if n.startswith("Ui_"))()
+    ui.setupUi(window)
+    for attr, widget in vars(ui).items():  # loadUi puts the widgets on the window itself
+        setattr(window, attr, widget)
+    return how
+
+class DiskScanWorker(QObject):
+    # get_disks_and_sectors() runs lsblk/wmic, which can take seconds on slow media, so it runs off the GUI thread
+    finished = pyqtSignal(list)
 
-class SlideWorker(QObject):
+    def run(self):
+        self.finished.emit(get_disks_and_sectors())
 
-    progress = pyqtSignal(int)  # Signal to update progress bar
-    eta = pyqtSignal(str)      # Signal to update ETA
-    finished = pyqtSignal()    # Signal when operation is complete
+class JobEvents(QObject):
+    # SlideQueue calls back from the job threads, this carries the events over to the GUI thread
+    event = pyqtSignal(object, str, object)  # job, event, data, see SlideQueue in Core.py
 
-    def __init__(self, old_first, old_last, new_first, disk_path, sector_size):
+class VerifyWorker(QObject):
 
-        super().__init__()
+    progress = pyqtSignal(int)
+    finished = pyqtSignal(list)  # offsets of mismatched chunks
 
-        self.old_first = int(old_first)
-        self.old_last = int(old_last)
-        self.new_first = int(new_first)
-        self.disk_path = disk_path
-        self.sector_size = int(sector_size)
+    def __init__(self, manifest):
+        super().__init__()
+        self.manifest = manifest
 
     def run(self):
-        target_size = 1024 * 1024 * 1024  # 1 GiB in bytes
-        block_size = self.sector_size  # Normally 512 bytes
-        bytes_per_round = block_size * (target_size // block_size)  # 1 GiB in bytes
-        print("bytes_per_round", bytes_per_round)
-        partition_sectors = self.old_last - self.old_first
-        print("partition_sectors: ", partition_sectors)
-        if self.old_first == self.new_first:
-            self.finished.emit()
-            print("no displacement")
-            return
-
-        start_time = time.time()
-        total_bytes = partition_sectors * block_size
-        print("total_bytes: ", total_bytes)
-        old_start = self.old_first * block_size
-        print("old_start: ", old_start)
-        new_first = self.new_first * block_size
-        print("new_first: ", new_first)
-
-        with open(self.disk_path, 'r+b') as disk:
-
-            if self.old_first > self.new_first:  # Moving left
-                for i in range(0, total_bytes, bytes_per_round):
-                    chunk_end = min(bytes_per_round + i, total_bytes)
-                    disk.seek(old_start + i)
-                    data = disk.read(chunk_end - i)
-                    disk.seek(new_first + i)
-                    disk.write(data)
-                    disk.flush()
-
-                    # Progress update
-                    progress = int((chunk_end / total_bytes) * 100)
-                    self.progress.emit(progress)
-
-                    # ETA calculation
-                    elapsed_time = time.time() - start_time
-                    bytes_written = chunk_end
-                    if bytes_written > 0:
-                        speed = bytes_written / elapsed_time  # bytes per second
-                        remaining_bytes = total_bytes - bytes_written
-                        eta_seconds = remaining_bytes / speed if speed > 0 else 0
-                        self.emit_eta(eta_seconds)
-
-            elif self.old_first < self.new_first:  # Moving right
-                for i in range(total_bytes, 0, -bytes_per_round):
-                    chunk_start = max(0, i - bytes_per_round)
-                    disk.seek(old_start + chunk_start)
-                    data = disk.read(i - chunk_start)
-                    disk.seek(new_first + chunk_start)
-                    disk.write(data)
-                    disk.flush()
-
-                    # Progress update
-                    progress = int(((total_bytes - chunk_start) / total_bytes) * 100)
-                    self.progress.emit(progress)
-
-                    # ETA calculation
-                    elapsed_time = time.time() - start_time
-                    bytes_written = total_bytes - chunk_start
-                    if bytes_written > 0:
-                        speed = bytes_written / elapsed_time  # bytes per second
-                        remaining_bytes = total_bytes - bytes_written
-                        eta_seconds = remaining_bytes / speed if speed > 0 else 0
-                        self.emit_eta(eta_seconds)
-
-        disk.close()
-        self.progress.emit(100)
-        self.emit_eta(0)
-        self.finished.emit()
-
-    def emit_eta(self, seconds):
-
-        days = int(seconds // (24 * 3600))
-        hours = int((seconds % (24 * 3600)) // 3600)
-        minutes = int((seconds % 3600) // 60)
-        secs = int(seconds % 60)
-        eta_str = f"{days}D, {hours}H, {minutes}M, {secs}S"
-        self.eta.emit(eta_str)
-
-def le(hex_str):
-    hex_str = str(hex_str)
-    if len(hex_str) % 2 != 0:
-        hex_str = "0" + hex_str
-
-    # Convert the hex string to a bytes object.
-    # bytes.fromhex() expects the string to have an even number of digits.
-    byte_data = bytes.fromhex(hex_str)
-        
-    # Convert the byte data from little-endian to an integer.
-    return int.from_bytes(byte_data, byteorder='little')
-      
-def el(n):
-    # Convert integer to hexadecimal string without '0x' prefix
-    hex_str = hex(int(n))[2:]
-        
-    # Pad the hex string to make its length even (for byte alignment)
-    padded_hex = hex_str.zfill(len(hex_str) + len(hex_str) % 2)
-        
-    # Create little-endian hex string
-    little_endian_hex = ''
-    for i in range(0, len(padded_hex), 2):
-        little_endian_hex = padded_hex[i:i+2] + little_endian_hex
-        
-    return little_endian_hex
+        try:
+            mismatches = verify_manifest(self.manifest, progress=self.progress.emit)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Verify failed: {e}")
+            mismatches = [-1]
+        self.finished.emit(mismatches)
 
+class ProbeWorker(QObject):
+    # Dry run of a SlideRunner or PlanRunner, reads the disk for a few seconds
+    finished = pyqtSignal(dict)
 
+    def __init__(self, runner):
+        super().__init__()
+        self.runner = runner
 
-def get_disks_and_sectors():
-    if os.name == 'posix' and platform.system() == 'Linux':
-        try:
-            result = subprocess.run(['lsblk', '-n', '-o', 'NAME,SECTORS,PHY-SEC', '-d'],
-                                  capture_output=True, text=True, check=True)
-            disk_list = []
-            for line in result.stdout.strip().split('\n'):
-                if line:
-                    parts = line.split()
-                    if len(parts) >= 3 and parts[1].isdigit() and parts[2].isdigit():
-                        name, sectors, bytes_per_sector = parts[0], parts[1], parts[2]
-                        disk_list.append([f"/dev/{name}", int(bytes_per_sector), int(sectors)])
-            return disk_list
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            return [["Error", 0, 0]]
-    
-    elif os.name == 'nt':  # Windows
+    def run(self):
         try:
-            result = subprocess.run(['wmic', 'diskdrive', 'get', 'DeviceID,BytesPerSector,TotalSectors'],
-                                  capture_output=True, text=True, check=True)
-            disk_list = []
-            lines = result.stdout.strip().split('\n')[1:]  # Skip header
-            for line in lines:
-                line = line.strip()
-                if line:  # Ignore empty lines
-                    # Split on whitespace and filter out empty strings
-                    parts = [p for p in line.split() if p]
-                    if len(parts) == 3 and parts[0].isdigit() and parts[2].isdigit():
-                        bytes_per_sector, device_id, sectors = parts[0], parts[1], parts[2]
-                        disk_list.append([device_id, int(bytes_per_sector), int(sectors)])
-            return disk_list
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            return [["Error", 0, 0]]
-    
-    else:
-        return [["Unsupported OS", 0, 0]]
+            result = self.runner.probe()
+        except OSError as e:
+            print(f"Probe failed: {e}")
+            result = {"error": str(e)}
+        self.finished.emit(result)
+
+BLOCK_COLORS = [QColor("#FFA500"), QColor("#6495ED"), QColor("#32CD32")]  # first partition, odd, even
+LABEL_MIN_WIDTH = 24  # blocks narrower than this (in pixels) get no label, 128 GPT entries get narrow fast
+
+def text_color(color):
+    luminance = (0.299 * color.red() + 0.587 * color.green() + 0.114 * color.blue()) / 255
+    return QColor(255, 255, 255) if luminance < 0.5 else QColor(0, 0, 0)
+
+class PartitionIndex:
+    # The partitions of the bar sorted by start, so a mouse event finds what it hits with a bisect instead of
+    # looking at every partition. move() keeps it sorted when a single partition moves.
+
+    def __init__(self, partitions):
+        self.entries = sorted((start, end, i) for i, (start, end, _) in enumerate(partitions))
+        self.starts = [start for start, _, _ in self.entries]
+
+    def move(self, i, old_start, start, end):
+        k = bisect.bisect_left(self.starts, old_start)
+        while self.entries[k][2] != i:  # partitions starting at the same sector
+            k += 1
+        del self.entries[k], self.starts[k]
+        k = bisect.bisect_left(self.entries, (start, end, i))
+        self.entries.insert(k, (start, end, i))
+        self.starts.insert(k, start)
+
+    def between(self, first, last):
+        # Partitions starting in [first, last] and the one before, which may reach into it
+        lo = max(0, bisect.bisect_left(self.starts, first) - 1)
+        return [i for _, _, i in self.entries[lo:bisect.bisect_right(self.starts, last)]]
+
+    def gaps(self, exclude, size, disk_start, disk_end):
+        return GapIndex(exclude, [(start, end) for start, end, i in self.entries if i != exclude], size, disk_start, disk_end)
+
+class GapIndex:
+    # Everything but the partition being dragged, and the free gaps it fits in. Built once when a partition gets
+    # selected, after that every lookup while dragging it is a bisect.
+
+    def __init__(self, exclude, others, size, disk_start, disk_end):
+        self.exclude = exclude  # the dragged partition
+        self.starts = [start for start, _ in others]
+        self.ends = [end for _, end in others]
+        edges = [disk_start] + [e for start, end in others for e in (start, end)] + [disk_end]
+        self.fits = [(edges[k], edges[k + 1]) for k in range(0, len(edges), 2) if edges[k + 1] - edges[k] >= size]
+        self.fit_starts = [start for start, _ in self.fits]
+        self.fit_ends = [end for _, end in self.fits]
+
+    def last_overlap(self, start, end):
+        # The rightmost partition in [start, end), what a block moving left runs into
+        k = bisect.bisect_left(self.starts, end) - 1
+        return k if k >= 0 and self.ends[k] > start else None
+
+    def first_overlap(self, start, end):
+        # The leftmost partition in [start, end), what a block moving right runs into
+        k = bisect.bisect_right(self.ends, start)
+        return k if k < len(self.starts) and self.starts[k] < end else None
+
+    def fit_before(self, sector):
+        # Nearest gap the block fits in that ends by sector, or None
+        k = bisect.bisect_right(self.fit_ends, sector) - 1
+        return self.fits[k] if k >= 0 else None
+
+    def fit_after(self, sector):
+        # Nearest gap the block fits in that starts at sector or later, or None
+        k = bisect.bisect_left(self.fit_starts, sector)
+        return self.fits[k] if k < len(self.fits) else None
 
 class PartitionWidget(QWidget):
+    # Everything but the selected partition is drawn into a pixmap that is only redrawn when the layout, the
+    # selection or the size changes. paintEvent copies that and draws the selected partition on top, and while
+    # dragging only the rectangles it left and moved into are repainted.
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.partitions = []  # (start, end, name)
@@ -180,93 +182,147 @@ class PartitionWidget(QWidget):
         self.drag_start_x = 0
         self.drag_start_pos = None
         self.last_moved_index = -1  # Track the last moved partition
+        self.keep_moves = False  # Plan moves: moving another partition doesn't put the last one back
         self.is_dragging = False  # Flag to track dragging state
         self.main_window = parent
         while self.main_window and not isinstance(self.main_window, MainWindow):
             self.main_window = self.main_window.parent()
         self.setMouseTracking(True)
+        self.label_font = QFont(self.font())
+        self.label_font.setPointSize(8)
+        self.label_metrics = QFontMetrics(self.label_font)
+        self.cache = None  # QPixmap of the static partitions
+        self.cache_key = None
+        self.index = PartitionIndex([])
+        self.gap_index = None  # GapIndex for the selected partition, built when it is needed
+
+    def set_position(self, i, start, end):
+        # Every partition move goes through here, so the index stays in step
+        old_start, _, name = self.partitions[i]
+        self.partitions[i] = (start, end, name)
+        self.index.move(i, old_start, start, end)
+        if self.gap_index is not None and i != self.gap_index.exclude:
+            self.gap_index = None
+
+    def reset_moves(self):
+        self.partitions = self.original_partitions.copy()
+        self.index = PartitionIndex(self.partitions)
+        self.gap_index = None
+        self.last_moved_index = -1
+        self.update()
+
+    def gaps(self):
+        if self.gap_index is None or self.gap_index.exclude != self.selected_index:
+            start, end, _ = self.partitions[self.selected_index]
+            self.gap_index = self.index.gaps(self.selected_index, end - start, *self.disk_range)
+        return self.gap_index
 
     def set_data(self, partitions, disk_range):
         self.partitions = partitions.copy()
         self.original_partitions = partitions.copy()
         self.disk_range = disk_range
+        self.index = PartitionIndex(self.partitions)
+        self.gap_index = None
         self.selected_index = -1
         self.last_moved_index = -1
         self.update()
 
-    def paintEvent(self, event):
-        painter = QPainter(self)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+    def sector_at(self, x):
+        padding = 2
+        disk_start, disk_end = self.disk_range
+        return disk_start + (x - padding) / (self.width() - 2 * padding) * (disk_end - disk_start)
 
+    def block_rect(self, start, end):
         padding = 2
         avail_width = self.width() - 2 * padding
-        avail_height = self.height() - 2 * padding
         disk_start, disk_end = self.disk_range
         disk_size = disk_end - disk_start
-
+        x = padding + ((start - disk_start) / disk_size) * avail_width
+        width = ((end - start) / disk_size) * avail_width
+        if width < 5:
+            width = 5
+        return QRectF(x, padding, width, self.height() - 2 * padding)
+
+    def draw_block(self, painter, i, rect):
+        color = BLOCK_COLORS[0 if i == 0 else 1 if i % 2 else 2]
+        if i == self.selected_index:
+            painter.setBrush(QColor(0, 0, 0, 100))
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.drawRoundedRect(rect.adjusted(2, 2, 2, 4), 3, 3)  # shadow
+            color = color.darker(120)
+
+        painter.setBrush(color)
+        painter.setPen(QPen(QColor("#000000"), 2, Qt.PenStyle.SolidLine))
+        painter.drawRoundedRect(rect, 3, 3)
+
+        if rect.width() < LABEL_MIN_WIDTH:
+            return
+        orig_start, orig_end, _ = self.original_partitions[i]
+        sectors = orig_end - orig_start
+        gib = (sectors * self.main_window.logical_sector_size) / (1024 ** 3)
+        text_rect = rect.adjusted(5, 2, -5, -2)
+        width = int(text_rect.width())
+        lines = [self.label_metrics.elidedText(line, Qt.TextElideMode.ElideRight, width)
+                 for line in (self.partitions[i][2], f"{sectors} sectors", f"{gib:.2f} GiB")]
+        painter.setPen(text_color(color))
+        painter.setFont(self.label_font)
+        painter.drawText(text_rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop, "\n".join(lines))
+
+    def static_pixmap(self):
+        # Redrawn only when something other than the position of the selected partition changed
+        key = (self.width(), self.height(), self.devicePixelRatioF(), tuple(self.disk_range), self.selected_index,
+               self.main_window.logical_sector_size, tuple(p for i, p in enumerate(self.partitions) if i != self.selected_index),
+               tuple(self.original_partitions))
+        if self.cache is not None and key == self.cache_key:
+            return self.cache
+        ratio = self.devicePixelRatioF()
+        self.cache = QPixmap(int(self.width() * ratio), int(self.height() * ratio))
+        self.cache.setDevicePixelRatio(ratio)
+        self.cache.fill(Qt.GlobalColor.transparent)
+        self.cache_key = key
+
+        painter = QPainter(self.cache)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        padding = 2
         painter.setBrush(QColor("#d0d0d0"))
         painter.setPen(Qt.PenStyle.NoPen)
-        painter.drawRect(QRectF(padding, padding, avail_width, avail_height))
-
-        for i, (start, end, name) in enumerate(self.partitions):
-            x = padding + ((start - disk_start) / disk_size) * avail_width
-            width = ((end - start) / disk_size) * avail_width
-            if width < 5:
-                width = 5
-
-            rect = QRectF(x, padding, width, avail_height)
-            color = QColor("#FFA500" if i == 0 else "#6495ED" if i % 2 else "#32CD32")
-
-            if i == self.selected_index:
-                shadow_color = QColor(0, 0, 0, 100)
-                painter.setBrush(shadow_color)
-                painter.setPen(Qt.PenStyle.NoPen)
-                shadow_rect = QRectF(x + 2, padding + 2, width, avail_height + 2)
-                painter.drawRoundedRect(shadow_rect, 3, 3)
-                color = color.darker(120)
-            
-            painter.setBrush(color)
-            painter.setPen(QPen(QColor("#000000"), 2, Qt.PenStyle.SolidLine))
-            painter.drawRoundedRect(rect, 3, 3)
-
-            luminance = (0.299 * color.red() + 0.587 * color.green() + 0.114 * color.blue()) / 255
-            text_color = QColor(255, 255, 255) if luminance < 0.5 else QColor(0, 0, 0)
-            painter.setPen(text_color)
-            font = painter.font()
-            font.setPointSize(8)
-            painter.setFont(font)
-            orig_start, orig_end, _ = self.original_partitions[i]
-            sectors = orig_end - orig_start
-            gib = (sectors * self.main_window.sector_size) / (1024 ** 3)
-            text_rect = rect.adjusted(5, 2, -5, -2)
-            painter.drawText(text_rect, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop, 
-                             f"{name}\n{sectors} sectors\n{gib:.2f} GiB")
+        painter.drawRect(QRectF(padding, padding, self.width() - 2 * padding, self.height() - 2 * padding))
+        for i, (start, end, _) in enumerate(self.partitions):
+            if i != self.selected_index:
+                self.draw_block(painter, i, self.block_rect(start, end))
+        painter.end()
+        return self.cache
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.drawPixmap(0, 0, self.static_pixmap())
+        if 0 <= self.selected_index < len(self.partitions):
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+            start, end, _ = self.partitions[self.selected_index]
+            self.draw_block(painter, self.selected_index, self.block_rect(start, end))
+
+    def update_block(self, old_rect, new_rect):
+        # Repaint where the selected partition was and where it is now, the pen and the shadow reach past the rect
+        self.update(old_rect.united(new_rect).toAlignedRect().adjusted(-3, -3, 5, 5))
 
     def mousePressEvent(self, event):
         pos = event.pos().toPointF()
-        padding = 2
-        avail_width = self.width() - 2 * padding
-        disk_start, disk_end = self.disk_range
-        disk_size = disk_end - disk_start
 
         previous_selection = self.selected_index
-        for i, (start, end, _) in enumerate(self.partitions):
-            x = padding + ((start - disk_start) / disk_size) * avail_width
-            width = ((end - start) / disk_size) * avail_width
-            if width < 5:
-                width = 5
-            rect = QRectF(x, padding, width, self.height() - 2 * padding)
-            if rect.contains(pos):
-                if self.last_moved_index != -1 and self.last_moved_index != i:
-                    self.partitions[self.last_moved_index] = self.original_partitions[self.last_moved_index]
-                    self.last_moved_index = -1
-                self.selected_index = i
-                self.drag_start_x = pos.x()
-                self.drag_start_pos = (start, end)
-                self.is_dragging = True
-                if self.main_window and previous_selection != self.selected_index:
-                    self.main_window.selection()
-                break
+        # Blocks are at least 5 pixels wide, so one starting up to 5 pixels left of the mouse can still be hit
+        first, last = self.sector_at(pos.x() - 6), self.sector_at(pos.x() + 1)
+        i = min((i for i in self.index.between(first, last) if self.block_rect(*self.partitions[i][:2]).contains(pos)),
+                default=None)
+        if i is not None:
+            if not self.keep_moves and self.last_moved_index != -1 and self.last_moved_index != i:
+                self.set_position(self.last_moved_index, *self.original_partitions[self.last_moved_index][:2])
+                self.last_moved_index = -1
+            self.selected_index = i
+            self.drag_start_x = pos.x()
+            self.drag_start_pos = self.partitions[i][:2]
+            self.is_dragging = True
+            if self.main_window and previous_selection != self.selected_index:
+                self.main_window.selection()
         else:
             if self.selected_index != -1 and self.main_window:
                 self.main_window.nonselection()
@@ -296,50 +352,40 @@ class PartitionWidget(QWidget):
         new_start = max(disk_start, min(new_start, disk_end - size))
         new_end = new_start + size
 
+        # Stop at the first partition in the way, or jump past it into the next gap the block fits in
+        # once the mouse is past that partition's far edge
         mouse_disk_pos = disk_start + (pos.x() - padding) / avail_width * disk_size
-        for i, (other_start, other_end, _) in enumerate(self.partitions):
-            if i == self.selected_index:
-                continue
-            if delta_units < 0 and new_start < other_end and new_end > other_start:
-                new_start = other_end
-                new_end = new_start + size
-                if mouse_disk_pos < other_start:
-                    available_start = disk_start
-                    for j, (check_start, check_end, _) in enumerate(self.partitions):
-                        if j != self.selected_index and j != i and check_end <= other_start:
-                            available_start = max(available_start, check_end)
-                    if other_start - available_start >= size:
-                        new_end = other_start
-                        new_start = new_end - size
-                    else:
-                        new_start = other_end
-                        new_end = new_start + size
-            elif delta_units > 0 and new_end > other_start and new_start < other_end:
-                new_end = other_start
-                new_start = new_end - size
-                if mouse_disk_pos > other_end:
-                    available_end = disk_end
-                    for j, (check_start, check_end, _) in enumerate(self.partitions):
-                        if j != self.selected_index and j != i and check_start >= other_end:
-                            available_end = min(available_end, check_start)
-                    if available_end - other_end >= size:
-                        new_start = other_end
-                        new_end = new_start + size
-                    else:
-                        new_end = other_start
-                        new_start = new_end - size
+        gaps = self.gaps()
+        if delta_units < 0:
+            k = gaps.last_overlap(new_start, new_end)
+            if k is not None:
+                new_start = gaps.ends[k]
+                if mouse_disk_pos < gaps.starts[k]:
+                    gap = gaps.fit_before(gaps.starts[k])
+                    if gap:
+                        new_start = gap[1] - size
+        elif delta_units > 0:
+            k = gaps.first_overlap(new_start, new_end)
+            if k is not None:
+                new_start = gaps.starts[k] - size
+                if mouse_disk_pos > gaps.ends[k]:
+                    gap = gaps.fit_after(gaps.ends[k])
+                    if gap:
+                        new_start = gap[0]
+        new_end = new_start + size
 
         new_start = round(max(disk_start, min(new_start, disk_end - size)))
         new_end = new_start + size
 
-        self.partitions[self.selected_index] = (new_start, new_end, self.partitions[self.selected_index][2])
+        old_rect = self.block_rect(*self.partitions[self.selected_index][:2])
+        self.set_position(self.selected_index, new_start, new_end)
         self.drag_start_x = pos.x()
         self.drag_start_pos = (new_start, new_end)
 
         if self.main_window:
             self.main_window.drag()
 
-        self.update()
+        self.update_block(old_rect, self.block_rect(new_start, new_end))
 
     def mouseReleaseEvent(self, event):
         if self.is_dragging and self.selected_index != -1:
@@ -353,7 +399,7 @@ class PartitionWidget(QWidget):
 
         disk_start, disk_end = self.disk_range
         orig_start, orig_end, name = self.original_partitions[self.selected_index]
-        curr_start, curr_end, _ = self.partitions[self.selected_index]
+        curr_start = self.partitions[self.selected_index][0]
         size = orig_end - orig_start
 
         try:
@@ -375,25 +421,22 @@ class PartitionWidget(QWidget):
         new_start = max(disk_start, min(new_start, disk_end - size))
         new_end = new_start + size
 
-        for i, (other_start, other_end, _) in enumerate(self.partitions):
-            if i == self.selected_index:
-                continue
-            if new_start < other_end and new_end > other_start:
-                if offset is not None and offset < 0:
-                    new_start = other_end
-                    new_end = new_start + size
-                elif offset is not None and offset > 0:
-                    new_end = other_start
-                    new_start = new_end - size
-                else:
-                    new_start = curr_start
-                    new_end = curr_end
-                break
+        gaps = self.gaps()
+        if offset is not None and offset < 0:
+            k = gaps.last_overlap(new_start, new_end)
+            if k is not None:
+                new_start = gaps.ends[k]
+        elif offset is not None and offset > 0:
+            k = gaps.first_overlap(new_start, new_end)
+            if k is not None:
+                new_start = gaps.starts[k] - size
+        elif gaps.first_overlap(new_start, new_end) is not None:
+            new_start = curr_start
 
         new_start = max(disk_start, min(new_start, disk_end - size))
         new_end = new_start + size
 
-        self.partitions[self.selected_index] = (new_start, new_end, name)
+        self.set_position(self.selected_index, new_start, new_end)
         self.last_moved_index = self.selected_index
         self.update()
 
@@ -402,8 +445,8 @@ class PartitionWidget(QWidget):
         previous_selection = self.selected_index
         for i, (_, _, name) in enumerate(self.partitions):
             if name == partition_name:
-                if self.last_moved_index != -1 and self.last_moved_index != i:
-                    self.partitions[self.last_moved_index] = self.original_partitions[self.last_moved_index]
+                if not self.keep_moves and self.last_moved_index != -1 and self.last_moved_index != i:
+                    self.set_position(self.last_moved_index, *self.original_partitions[self.last_moved_index][:2])
                     self.last_moved_index = -1
                 self.selected_index = i
                 if self.main_window and previous_selection != self.selected_index:
@@ -420,7 +463,9 @@ class MainWindow(QMainWindow):
     def __init__(self):
         super(MainWindow, self).__init__()
         self.ui_path = "1.ui"
-        loadUi(self.ui_path, self)
+        STARTUP["ui_start"] = time.perf_counter()
+        STARTUP["ui_mode"] = load_ui(self.ui_path, self)
+        STARTUP["ui"] = time.perf_counter()
 
         self.partition_display = PartitionWidget(self.widget)
         self.partition_display.setGeometry(0, 0, 800, 100)
@@ -429,14 +474,20 @@ class MainWindow(QMainWindow):
         self.progressBar.setMinimum(0)
         self.progressBar.setMaximum(100)
 
-        self.paths = get_disks_and_sectors()
-        for i in range(0, len(self.paths)):
-            self.d_select.addItem(self.paths[i][0])
+        self.paths = []  # filled in by scan_disks() after the first paint
+        self.images = []  # image files opened as disks, listed after the real ones
+        self.disks_loaded = False
+        self.scan_thread = None
+        self.scan_worker = None
 
         self.pushButton_2.setIcon(QIcon("refresh.png"))
         self.pushButton_2.clicked.connect(self.refresh)
+        self.open_image.clicked.connect(self.add_image)
         
         self.start_button.clicked.connect(self.pre)
+        self.verify_button.clicked.connect(self.verify_only)
+        self.probe_button.clicked.connect(self.estimate)
+        self.plan_moves.toggled.connect(self.plan_toggled)
         
         self.p_select.currentTextChanged.connect(self.handle_partition_selection)
         self.new_start_sec.returnPressed.connect(self.update_from_lineedits)
@@ -444,6 +495,9 @@ class MainWindow(QMainWindow):
         self.offset_line.returnPressed.connect(self.update_from_lineedits)
 
         self.current_info = None
+        self.sector_size = 512  # set for real when a disk is loaded, physical, only for the chunk sizes
+        self.logical_sector_size = 512  # what the LBAs count, for every byte offset and size
+        self.part_index = []  # p_select index -> index into the parsed table, extended partitions aren't listed
         self.part_selected = None
         self.current_new_first = None
         self.current_path = None
@@ -460,22 +514,148 @@ class MainWindow(QMainWindow):
             lambda: self.Load(self.m_select.currentText(), self.d_select.currentText())
         )
 
-        self.thread = None
+        self.thread = None  # verify only, slides run in self.jobs
         self.worker = None
+        self.job_events = JobEvents()
+        self.job_events.event.connect(self.job_event)
+        self.jobs = SlideQueue(on_event=self.job_events.event.emit)
+
+        QTimer.singleShot(0, self.check_journals)  # once the window is up
+        STARTUP["window"] = time.perf_counter()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if "first_paint" not in STARTUP:
+            STARTUP["first_paint"] = time.perf_counter()
+            QTimer.singleShot(0, self.scan_disks)  # the window is on screen, now look for disks
+
+    def scan_disks(self):
+        if self.scan_thread is not None:
+            return
+        self.pushButton_2.setEnabled(False)
+        self.scan_thread = QThread()
+        self.scan_worker = DiskScanWorker()
+        self.scan_worker.moveToThread(self.scan_thread)
+        self.scan_worker.finished.connect(self.disks_scanned)
+        self.scan_thread.started.connect(self.scan_worker.run)
+        self.scan_thread.start()
+
+    def disks_scanned(self, paths):
+        self.scan_thread.quit()
+        self.scan_thread.wait()
+        self.scan_thread = None
+        self.scan_worker = None
+        self.pushButton_2.setEnabled(True)
+
+        self.paths = paths + self.images
+        current = self.d_select.currentText()
+        self.d_select.blockSignals(True)  # clear() would load "" otherwise
+        self.d_select.clear()
+        for i in range(len(self.paths)):
+            self.d_select.addItem(self.paths[i][0])
+        self.d_select.blockSignals(False)
+        if self.disks_loaded and self.d_select.count():  # the first fill doesn't load a disk, a refresh does
+            self.d_select.setCurrentIndex(max(self.d_select.findText(current), 0))
+            self.Load(self.m_select.currentText(), self.d_select.currentText())
+        if not self.disks_loaded:
+            self.disks_loaded = True
+            STARTUP["disks"] = time.perf_counter()
+            self.startup_report()
+
+    def startup_report(self):
+        # Time to first window, all in ms since Main.py started. With --startup-timing it's printed as JSON
+        # on stdout and the program quits, so it can be tracked from scripts (QT_QPA_PLATFORM=offscreen works)
+        start = STARTUP["start"]
+        report = {"imports_ms": (STARTUP["imports"] - start) * 1000,
+                  "ui_ms": (STARTUP["ui"] - STARTUP["ui_start"]) * 1000, "ui_mode": STARTUP["ui_mode"],
+                  "window_ms": (STARTUP["window"] - start) * 1000,
+                  "first_paint_ms": (STARTUP["first_paint"] - start) * 1000,
+                  "disks_ms": (STARTUP["disks"] - start) * 1000}
+        print(f"Startup: imports {report['imports_ms']:.0f} ms, UI {report['ui_ms']:.0f} ms ({report['ui_mode']}), "
+              f"window {report['window_ms']:.0f} ms, first paint {report['first_paint_ms']:.0f} ms, "
+              f"disks {report['disks_ms']:.0f} ms")
+        if "--startup-timing" in sys.argv:
+            sys.stdout.write(json.dumps(report) + "\n")
+            QApplication.instance().quit()
+
+    def check_journals(self):
+        # A journal left behind means a slide was interrupted, offer to finish it. Every one that's accepted
+        # goes into the queue, so interrupted slides on different disks resume side by side
+        for journal in SlideJournal.pending():
+            state = journal.state
+            if "plan" in state:
+                self.check_plan_journal(journal)
+                continue
+            if state.get("status") == "copied":
+                text = (f"A slide on {state['disk_path']} finished copying but the partition table was not updated.\n"
+                        "Update the partition table now?")
+            elif state.get("status") == "verify_failed":
+                text = (f"A slide on {state['disk_path']} finished copying but verification found mismatched chunks, "
+                        "so the partition table was not updated.\nUpdate the partition table anyway?")
+            elif state.get("status") == "copying":
+                text = (f"A slide on {state['disk_path']} was interrupted (partition {state['part'] + 1}, "
+                        f"sector {state['old_first']} to {state['new_first']}).\nResume it now?")
+            else:  # never got past the start, nothing on disk was touched
+                journal.clear()
+                continue
+            answer = QMessageBox.question(self, "Interrupted Slide", text)
+            if answer != QMessageBox.StandardButton.Yes:
+                continue
+            self.enqueue(journal, f"{state['disk_path']}: resume partition {state['part'] + 1} to sector {state['new_first']}",
+                         force=state["status"] == "verify_failed")
+
+    def check_plan_journal(self, journal):
+        # Same as check_journals() for a move plan
+        state = journal.state
+        steps = len(state["plan"])
+        last_step = state.get("step", 0) == steps - 1
+        if state.get("status") == "copied" and last_step:
+            text = (f"A move plan on {state['disk_path']} finished copying but the partition table was not updated.\n"
+                    "Update the partition table now?")
+        elif state.get("status") == "verify_failed":
+            text = (f"Verification found mismatched chunks in step {state['step'] + 1} of {steps} of a move plan on "
+                    f"{state['disk_path']}, so the plan stopped there.\n"
+                    + ("Update the partition table anyway?" if last_step else "Carry on with the remaining steps anyway?"))
+        else:  # planned, copying or copied with steps left
+            step = state.get("step", 0) + (state.get("status") == "copied")
+            text = (f"A move plan on {state['disk_path']} was interrupted (step {step + 1} of {steps}).\n"
+                    "Resume it now?")
+        answer = QMessageBox.question(self, "Interrupted Move Plan", text)
+        if answer != QMessageBox.StandardButton.Yes:
+            return
+        # SlideJob carries on after a step that didn't verify, force is for the partition table after the last one
+        self.enqueue(journal, f"{state['disk_path']}: resume move plan of {len(state['moves'])} partitions",
+                     force=state["status"] == "verify_failed")
 
     def pre(self):
-        if (self.paths[self.d_select.currentIndex()][0] != "" and 
+        if (self.d_select.currentIndex() >= 0 and
+            self.paths[self.d_select.currentIndex()][0] != "" and 
             self.p_select.currentIndex() != "" and 
             self.start_sec.text() != "" and 
             self.option == "MBR"): #a whole if statement lol, dont get it wrong
+            if self.plan_moves.isChecked():
+                self.plan_slide(self.paths[self.d_select.currentIndex()][0])
+                return
             self.Start(self.option, self.paths[self.d_select.currentIndex()][0], 
-                       self.p_select.currentIndex(), self.new_start_sec.text()) #current partition selected is c2, it's defined in ui file, new starting sector
+                       self.part_index[self.p_select.currentIndex()], self.new_start_sec.text()) #current partition selected is c2, it's defined in ui file, new starting sector
+        elif getattr(self, "option", None) == "GPT":
+            QMessageBox.information(self, "GPT", "GPT disks can be viewed, sliding GPT partitions isn't supported yet")
 
     def refresh(self):
-        self.paths = get_disks_and_sectors()
-        self.d_select.clear()
-        for i in range(len(self.paths)):
-            self.d_select.addItem(self.paths[i][0])
+        self.scan_disks()
+
+    def add_image(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Open Disk Image", "", "Disk images (*.img *.raw *.bin);;All files (*)")
+        if not path:
+            return
+        disk = image_disk(path)
+        if any(d[0] == disk[0] for d in self.paths):
+            self.d_select.setCurrentText(disk[0])
+            return
+        self.images.append(disk)
+        self.paths.append(disk)
+        self.d_select.addItem(disk[0])
+        self.d_select.setCurrentIndex(self.d_select.count() - 1)  # loads it
 
     def selection(self):
         self.selected = list(self.partitions[next((i for i, t in enumerate(self.partitions) if self.partition_display.partitions[self.partition_display.selected_index][2] in t), None)])
@@ -485,11 +665,11 @@ class MainWindow(QMainWindow):
         self.p_select.setCurrentText(self.partition_display.partitions[self.partition_display.selected_index][2])
 
         self.start_sec.setText(str(self.selected[0]))
-        self.start_gb.setText(f"{((self.selected[0] * self.sector_size) / (1024 ** 3)):.2f} Gib")
+        self.start_gb.setText(f"{((self.selected[0] * self.logical_sector_size) / (1024 ** 3)):.2f} Gib")
         self.end_sec.setText(str(self.selected[1]))
-        self.end_gb.setText(f"{((self.selected[1] * self.sector_size) / (1024 ** 3)):.2f} Gib")
+        self.end_gb.setText(f"{((self.selected[1] * self.logical_sector_size) / (1024 ** 3)):.2f} Gib")
         self.total_sec.setText(str(self.selected[1]-self.selected[0]))
-        self.total_gb.setText(f"{(((self.selected[1]-self.selected[0]) * self.sector_size) / (1024 ** 3)):.2f} Gib")
+        self.total_gb.setText(f"{(((self.selected[1]-self.selected[0]) * self.logical_sector_size) / (1024 ** 3)):.2f} Gib")
         self.drag()
         #self.progressBar.setMinimum(int(self.total_sec.text()))
 
@@ -501,13 +681,13 @@ class MainWindow(QMainWindow):
             self.offset = self.selected[0]-start
             self.offset_line.setText(f"-{self.offset}")
             self.offset_sec.setText(f"-{self.offset}")
-            self.offset_gb.setText(f"-{((self.offset * self.sector_size) / (1024 ** 3)):.2f}")
+            self.offset_gb.setText(f"-{((self.offset * self.logical_sector_size) / (1024 ** 3)):.2f}")
 
         elif start > self.selected[0]:
             self.offset = start-self.selected[0]
             self.offset_line.setText(f"+{self.offset}")
             self.offset_sec.setText(f"+{self.offset}")
-            self.offset_gb.setText(f"+{((self.offset * self.sector_size) / (1024 ** 3)):.2f}")
+            self.offset_gb.setText(f"+{((self.offset * self.logical_sector_size) / (1024 ** 3)):.2f}")
 
     def update_from_lineedits(self):
         sender = self.sender()
@@ -519,6 +699,11 @@ class MainWindow(QMainWindow):
             self.partition_display.update_position(offset=self.offset_line.text())
         self.drag()
 
+    def plan_toggled(self, checked):
+        self.partition_display.keep_moves = checked
+        if not checked:  # back to one partition at a time, forget the other moves
+            self.partition_display.reset_moves()
+
     def handle_partition_selection(self, partition_name):
         self.partition_display.select_partition(partition_name)
 
@@ -531,419 +716,270 @@ class MainWindow(QMainWindow):
             method = self.id(path)
         if method == "MBR":
             self.option = "MBR"
-            with open(r'{}'.format(path), 'rb') as disk:
-                disk.seek(0)
-                disk.read(512)
-            self.MBR_DATA = self.MBR(self.d_select.currentText()) #[rawH,DiskSig,PartitionTable,Signature,Partition_Tables][Cylinder, Head, Sector, Type_B, Type, Cylinder2, Head2, Sector2, FirstSector, TotalSector, LastSector]
+            self.sector_size = self.paths[self.d_select.currentIndex()][1]
+            self.logical_sector_size = self.paths[self.d_select.currentIndex()][3]  # the LBAs count logical sectors
+            self.MBR_DATA = self.MBR(self.d_select.currentText()) #[rawH,DiskSig,PartitionTable,Signature,Partition_Tables][Cylinder, Head, Sector, Type_B, Type, Cylinder2, Head2, Sector2, FirstSector, TotalSector, LastSector, Slot, EBR, Limit, PreviousEBR]
 
             self.partitions = []
-
+            self.part_index = []
+            has_logical = any(p[12] is not None for p in self.MBR_DATA[4])
             for i in range(0, len(self.MBR_DATA[4])):
-                self.partitions.append((self.MBR_DATA[4][i][8], self.MBR_DATA[4][i][10], self.MBR_DATA[4][i][4]))
+                part = self.MBR_DATA[4][i]
+                if has_logical and part[12] is None and int(part[3], 16) in MBR_EXTENDED:
+                    continue  # the logical partitions inside are shown instead of the container
+                name = part[4] if part[12] is None else f"{part[4]} ({part[11] + 1})"  # logical partitions by number
+                self.partitions.append((part[8], part[10], name))
+                self.part_index.append(i)
 
-            disk_range = [1, (self.paths[self.d_select.currentIndex()][2])+1]
+            # paths has 512 byte sectors
+            disk_range = [1, self.paths[self.d_select.currentIndex()][2] * 512 // self.logical_sector_size + 1]
 
-            self.sector_size = self.paths[self.d_select.currentIndex()][1]
             self.partition_display.set_data(self.partitions, disk_range)
             for i in range(0, len(self.partitions)):
                 self.p_select.addItem(self.partitions[i][2])            
+        elif method == "GPT":
+            self.option = "GPT"
+            self.sector_size = self.paths[self.d_select.currentIndex()][1]
+            self.logical_sector_size = self.paths[self.d_select.currentIndex()][3]
+            self.GPT_DATA = self.GPT(path)
+            if self.GPT_DATA is None:
+                return
+            self.partitions = gpt_partitions(self.GPT_DATA)
+            self.part_index = list(range(len(self.partitions)))
+            # paths has 512 byte sectors, GPT LBAs are in logical sectors
+            disk_range = [1, self.paths[self.d_select.currentIndex()][2] * 512 // self.GPT_DATA[16] + 1]
+            self.partition_display.set_data(self.partitions, disk_range)
+            for i in range(0, len(self.partitions)):
+                self.p_select.addItem(self.partitions[i][2])
         else:
             QMessageBox.critical(self, 'Error', "Unsupported partition scheme!")
 
     def id(self, path):
-        # Simplified identification (implement actual detection)
-        return "MBR"
-
-    def GPT(self, disk_path):
-        with open(r'{}'.format(disk_path), 'rb') as disk:
-            disk.seek(512)
-            raw = disk.read(512).hex()
-
-        def bytes_le_to_guid(hex_str):
-            # Convert hex string to bytes
-            b = bytes.fromhex(hex_str)
-
-            # Extract fields and swap endianness where needed
-            part1 = b[:4][::-1].hex()  # Little-endian (4 bytes)
-            part2 = b[4:6][::-1].hex()  # Little-endian (2 bytes)
-            part3 = b[6:8][::-1].hex()  # Little-endian (2 bytes)
-            part4 = b[8:10].hex()       # Big-endian (2 bytes)
-            part5 = b[10:].hex()        # Big-endian (6 bytes)
-
-            # Format as standard GUID
-            return f"{part1}-{part2}-{part3}-{part4}-{part5}"
-
-        def find_partition_type(guid):
-            partition_types = [
-                {"GUID": "00000000-0000-0000-0000-000000000000", "Description": "Unused entry"},
-                {"GUID": "024DEE41-33E7-11D3-9D69-0008C781F39F", "Description": "MBR partition scheme"},
-                {"GUID": "C12A7328-F81F-11D2-BA4B-00A0C93EC93B", "Description": "EFI System partition"},
-                {"GUID": "21686148-6449-6E6F-744E-656564454649", "Description": "BIOS boot partition"},
-                {"GUID": "D3BFE2DE-3DAF-11DF-BA40-E3A556D89593", "Description": "Intel Fast Flash (iFFS) partition (for Intel Rapid Start technology)"},
-                {"GUID": "F4019732-066E-4E12-8273-346C5641494F", "Description": "Sony boot partition"},
-                {"GUID": "BFBFAFE7-A34F-448A-9A5B-6213EB736C22", "Description": "Lenovo boot partition"},
-                {"GUID": "E3C9E316-0B5C-4DB8-817D-F92DF00215AE", "Description": "Microsoft Reserved Partition (MSR)"},
-                {"GUID": "EBD0A0A2-B9E5-4433-87C0-68B6B72699C7", "Description": "Basic data partition"},
-                {"GUID": "5808C8AA-7E8F-42E0-85D2-E1E90434CFB3", "Description": "Logical Disk Manager (LDM) metadata partition"},
-                {"GUID": "AF9B60A0-1431-4F62-BC68-3311714A69AD", "Description": "Windows Storage Spaces partition"},
-                {"GUID": "0FC63DAF-8483-4772-8E79-3D69D8477DE4", "Description": "Linux filesystem data"},
-                {"GUID": "A19D880F-05FC-4D3B-A006-743F0F84911E", "Description": "Linux RAID partition"},
-                {"GUID": "0657FD6D-A4AB-43C4-84E5-0933C84B4F4F", "Description": "Linux swap partition"},
-                {"GUID": "E6D6D379-F507-44C2-A23C-238F2A3DF928", "Description": "Linux Logical Volume Manager (LVM) partition"},
-                {"GUID": "933AC7E1-2EB4-4F13-B844-0E14E2AEF915", "Description": "Linux /home partition"},
-                {"GUID": "3B8F8425-20E0-4F3B-907F-1A25A76F98E8", "Description": "Linux /srv (server data) partition"},
-                {"GUID": "7FFEC5C9-2D00-49B7-8941-3EA10A5586B7", "Description": "Linux plain dm-crypt partition"},
-                {"GUID": "CA7D7CCB-63ED-4C53-861C-1742536059CC", "Description": "Linux LUKS partition"},
-                {"GUID": "8DA63339-0007-60C0-C436-083AC8230908", "Description": "Linux reserved"},
-                {"GUID": "A2A0D0EB-E5B9-3344-87C0-68B6B72699C7", "Description": "FreeBSD disklabel"},
-                {"GUID": "516E7CB4-6ECF-11D6-8FF8-00022D09712B", "Description": "FreeBSD boot partition"},
-                {"GUID": "516E7CB5-6ECF-11D6-8FF8-00022D09712B", "Description": "FreeBSD data partition"},
-                {"GUID": "516E7CB6-6ECF-11D6-8FF8-00022D09712B", "Description": "FreeBSD swap partition"},
-                {"GUID": "516E7CB8-6ECF-11D6-8FF8-00022D09712B", "Description": "FreeBSD UFS partition"},
-                {"GUID": "516E7CB7-6ECF-11D6-8FF8-00022D09712B", "Description": "FreeBSD ZFS partition"},
-                {"GUID": "516E7CBA-6ECF-11D6-8FF8-00022D09712B", "Description": "FreeBSD Vinum volume manager partition"},
-                {"GUID": "48465300-0000-11AA-AA11-00306543ECAC", "Description": "Apple HFS+ partition"},
-                {"GUID": "55465300-0000-11AA-AA11-00306543ECAC", "Description": "Apple UFS partition"},
-                {"GUID": "6A898CC3-1DD2-11B2-99A6-080020736631", "Description": "Apple ZFS partition"},
-                {"GUID": "52414944-0000-11AA-AA11-00306543ECAC", "Description": "Apple RAID partition"},
-                {"GUID": "52414944-5F4F-11AA-AA11-00306543ECAC", "Description": "Apple RAID offline partition"},
-                {"GUID": "426F6F74-0000-11AA-AA11-00306543ECAC", "Description": "Apple Boot partition"},
-                {"GUID": "4C616265-6C00-11AA-AA11-00306543ECAC", "Description": "Apple Label partition"},
-                {"GUID": "5265636F-7665-11AA-AA11-00306543ECAC", "Description": "Apple TV Recovery partition"},
-                {"GUID": "53746F72-6167-11AA-AA11-00306543ECAC", "Description": "Apple Core Storage (i.e. Lion FileVault) partition"},
-                {"GUID": "6A82CB45-1DD2-11B2-99A6-080020736631", "Description": "Solaris boot partition"},
-                {"GUID": "6A85CF4D-1DD2-11B2-99A6-080020736631", "Description": "Solaris root partition"},
-                {"GUID": "6A87C46F-1DD2-11B2-99A6-080020736631", "Description": "Solaris /usr partition"},
-                {"GUID": "6A8B642B-1DD2-11B2-99A6-080020736631", "Description": "Solaris swap partition"},
-                {"GUID": "6A8D2AC7-1DD2-11B2-99A6-080020736631", "Description": "Solaris backup partition"},
-                {"GUID": "6A898CC3-1DD2-11B2-99A6-080020736631", "Description": "Solaris /var partition"},
-                {"GUID": "6A8EF2E9-1DD2-11B2-99A6-080020736631", "Description": "Solaris /home partition"},
-                {"GUID": "6A90BA39-1DD2-11B2-99A6-080020736631", "Description": "Solaris alternate sector"},
-                {"GUID": "6A9283A5-1DD2-11B2-99A6-080020736631", "Description": "Solaris reserved partition"},
-                {"GUID": "6A945A3B-1DD2-11B2-99A6-080020736631", "Description": "Solaris root pool"},
-                {"GUID": "6A9630D1-1DD2-11B2-99A6-080020736631", "Description": "Solaris boot pool"},
-                {"GUID": "49F48D32-B10E-11DC-B99B-0019D1879648", "Description": "NetBSD swap partition"},
-                {"GUID": "49F48D5A-B10E-11DC-B99B-0019D1879648", "Description": "NetBSD FFS partition"},
-                {"GUID": "49F48D82-B10E-11DC-B99B-0019D1879648", "Description": "NetBSD LFS partition"},
-                {"GUID": "49F48DAA-B10E-11DC-B99B-0019D1879648", "Description": "NetBSD RAID partition"},
-                {"GUID": "49F48DD2-B10E-11DC-B99B-0019D1879648", "Description": "NetBSD Concatenated partition"},
-                {"GUID": "2DB519C4-B10F-11DC-B99B-0019D1879648", "Description": "NetBSD encrypted partition"},
-                {"GUID": "FE3A2A5D-4F32-41A7-B725-ACCC3285A309", "Description": "VMware VMFS partition"},
-                {"GUID": "AA31E02A-400F-11DB-9590-000C2911D1B8", "Description": "VMware reserved partition"},
-                {"GUID": "9D275380-40AD-11DB-BF97-000C2911D1B8", "Description": "VMware kcore crash partition"},
-                {"GUID": "11D2F81B-FD4F-459B-9ADB-9091ED7E593F", "Description": "XenServer Linux partition"},
-                {"GUID": "5B193300-FC78-40CD-8002-E86C45580B47", "Description": "Microsoft Basic Data partition"},
-                {"GUID": "0376FF8D-D1A5-11E3-8E7D-001B21B9EADD", "Description": "Ceph OSD partition"},
-                {"GUID": "45B0969E-9B03-4F30-B4C6-5EC00CEFF106", "Description": "Ceph disk in creation"},
-                {"GUID": "4FBD7E29-9D25-41B8-AFD0-062C0CEFF05D", "Description": "Ceph journal"},
-                {"GUID": "89C57F98-2FE5-4DC0-89C1-F3AD0CEFF2BE", "Description": "Ceph crypt"},
-                {"GUID": "FB3AABF9-D6F9-46D8-9F9D-D6A4E56C5E36", "Description": "Ceph block"},
-                {"GUID": "CAFECAFE-9B03-4F30-B4C6-5EC00CEFF106", "Description": "Ceph block DB"},
-                {"GUID": "30D3B3C4-9B03-4F30-B4C6-5EC00CEFF106", "Description": "Ceph block write-ahead log"}
-            ]
-            for partition in partition_types:
-                if partition["GUID"].lower() == guid.lower():  # Case-insensitive comparison
-                    return partition["Description"]
-            return "Unknow: " + guid
-
-
-        signature = raw[:16]
-        signature_ascii = bytearray.fromhex(signature).decode()
-        revision = raw[16:24]
-        version = str(revision[5:6]) + "." + str(revision[6:8])
-        header_size = le(raw[24:32])
-        CRC32 = raw[32:40]
-        reserved = raw[40:48]
-        current_lba = le(raw[48:64])
-        backup_lba = le(raw[64:80])
-        first_partition = le(raw[80:96])
-        last_lba = le(raw[96:112])
-        GUID = raw[112:144]
-        partition_entry_starting_lba = le(raw[144:160])
-        partition_entry_count = le(raw[160:168])
-        partition_entry_size = le(raw[168:176])
-        partition_array_CRC32 = raw[176:184]
-
-        with open(r'{}'.format(disk_path), 'rb') as disk:
-            disk.seek(partition_entry_starting_lba * 512)
-            raw2 = disk.read(partition_entry_count * partition_entry_size).hex()
-
-
-        def partition_groups(hex_string, partition_entry_size, partition_entry_count):
-
-            expected_length = partition_entry_size * partition_entry_count
-            if len(hex_string) != expected_length:
-                raise ValueError(f"The hex string must be of length {expected_length} (partition_entry_size * partition_entry_count).")
-
-            groups = [hex_string[i:i+partition_entry_count] for i in range(0, len(hex_string), partition_entry_size)]
-
-            empty_count = sum(1 for group in groups if all(c == '0' for c in group))
-
-            non_empty_groups = [group for group in groups if not all(c == '0' for c in group)]
-            
-            return empty_count, non_empty_groups
-
-
-        empty_count, non_empty_groups = partition_groups(raw2, partition_entry_size * 2, partition_entry_count)
-
-        #Partition Parse(PP)
-        def PP(data):
-            PartitionTypeGUID = find_partition_type(bytes_le_to_guid(data[:32]))
-            UniquePartitionGUID = data[32:64]
-            StartingLBA = le(data[64:80])
-            EndingLBA = le(data[80:96])
-            Attributes = data[96:112]
-            binary_attri = bin(int(Attributes, 16))[2:].zfill(len(Attributes) * 4)
-            if binary_attri[:1] != "0":
-                Required_Partition = True
-            else:
-                Required_Partition = False
-            if binary_attri[1:2] != "0":
-                No_Block_IO_Protocol = True
-            else:
-                No_Block_IO_Protocol = False
-            if binary_attri[2:3] != "0":
-                Legacy_BIOS_Bootable = True
-            else:
-                Legacy_BIOS_Bootable = False
-            PartitionName = data[112:256]
-            
-            return PartitionTypeGUID, UniquePartitionGUID, StartingLBA, EndingLBA, Attributes, PartitionName, Required_Partition, No_Block_IO_Protocol, Legacy_BIOS_Bootable
-            
-        GPTs = {}
-        for i in range(0, partition_entry_count - empty_count):
-            PartitionTypeGUID, UniquePartitionGUID, StartingLBA, EndingLBA, Attributes, PartitionName, Required_Partition, No_Block_IO_Protocol, Legacy_BIOS_Bootable = PP(non_empty_groups[i])
-            GPTs[f'Partition{i}'] = [i, PartitionTypeGUID, UniquePartitionGUID, StartingLBA, EndingLBA, [Attributes, Required_Partition, No_Block_IO_Protocol, Legacy_BIOS_Bootable], bytearray.fromhex(PartitionName).decode()]
-        return [signature, signature_ascii, revision, header_size, CRC32, reserved, current_lba, backup_lba, first_partition, last_lba, GUID, partition_entry_starting_lba, partition_entry_count, partition_entry_size, partition_array_CRC32, GPTs]
-
-    def MBR(self, disk_path):
-        with open(r'{}'.format(disk_path), 'rb') as disk:
-            # Read the first 512 bytes
-            rawB = disk.read(512)
-
-        rawH = rawB.hex()
-
-        def type_check(B):
-            partition_types = [
-            ['00', 'Empty or Unused'],
-            ['01', 'FAT12'],
-            ['02', 'XENIX root'],
-            ['03', 'XENIX usr'],
-            ['04', 'FAT16 (Small)'],
-            ['05', 'Extended Partition'],
-            ['06', 'FAT16'],
-            ['07', 'NTFS / HPFS / exFAT'],
-            ['08', 'AIX bootable'],
-            ['09', 'AIX data'],
-            ['0A', 'OS/2 Boot Manager'],
-            ['0B', 'FAT32 (CHS)'],
-            ['0C', 'FAT32 (LBA)'],
-            ['0E', 'FAT16 (LBA)'],
-            ['0F', 'Extended Partition (LBA)'],
-            ['10', 'OPUS'],
-            ['11', 'Hidden FAT12'],
-            ['12', 'Compaq diagnostcs'],
-            ['14', 'FAT16 (LBA)'],
-            ['16', 'Hidden FAT16'],
-            ['17', 'Hidden NTFS'],
-            ['1B', 'Hidden FAT32'],
-            ['1C', 'Hidden FAT32 (LBA)'],
-            ['1E', 'Hidden FAT16 (LBA)'],
-            ['24', 'NEC DOS'],
-            ['39', 'Plan 9'],
-            ['3C', 'PartitionMagic recovery'],
-            ['40', 'Venix 80286'],
-            ['41', 'Linux/MINIX'],
-            ['42', 'Linux Swap'],
-            ['43', 'Linux Ext2/Ext3 (Old format)'],
-            ['44', 'Linux Ext2/Ext3 (New format)'],
-            ['83', 'Linux ext FS'],
-            ['84', 'Linux swap / Solaris'],
-            ['8E', 'Linux LVM'],
-            ['93', 'Amoeba'],
-            ['A0', 'IBM Thinkpad hidden'],
-            ['A5', 'FreeBSD'],
-            ['A6', 'OpenBSD'],
-            ['A8', 'Mac OS X'],
-            ['A9', 'NetBSD'],
-            ['AF', 'Mac OS X HFS+'],
-            ['B7', 'BSDI'],
-            ['B8', 'Boot Manager'],
-            ['BE', 'Solaris Boot Partition'],
-            ['BF', 'Solaris / OpenIndiana'],
-            ['C0', 'NTFS Boot Partition'],
-            ['C1', 'FreeBSD boot'],
-            ['C4', 'TrueCrypt volume'],
-            ['C7', 'Windows 7 recovery'],
-            ['D1', 'OpenBSD bootstrap'],
-            ['D3', 'GParted'],
-            ['D5', 'FreeBSD UFS2'],
-            ['D6', 'Solaris (x86) partition'],
-            ['D7', 'OpenBSD partition'],
-            ['E1', 'Linux RAID'],
-            ['E2', 'Linux LVM2'],
-            ['E3', 'Linux EVMS'],
-            ['E4', 'MS-DOS 6.0'],
-            ['E5', 'OpenDOS'],
-            ['E6', 'OS/2 Boot Manager'],
-            ['E7', 'Non-OS/2 Boot Manager'],
-            ['EB', 'FAT16 (LBA) (exFAT)'],
-            ['EC', 'Windows 98 SE'],
-            ['EE', 'GPT Protective'],
-            ['EF', 'EFI System Partition'],
-            ['F0', 'Microsoft Reserved'],
-            ['F2', 'Linux Swap (used by newer Linux versions)'],
-            ['F4', 'Microsoft Windows recovery partition'],
-            ['F6', 'HPFS/NTFS'],
-            ['F7', 'HPFS/NTFS (Boot)'],
-            ['F8', 'OEM proprietary'],
-            ['F9', 'BSD']
-            ]
-            for i in range(0, len(partition_types)):
-                if B == partition_types[i][0]:
-                    return partition_types[i][1]
-            return "Unknow"
-
-
-        def partition(raw):
-            if raw == "00000000000000000000000000000000":
-                return "Empty"
-            elif len(raw) != 32:
-                QMessageBox.critical(self,'MBR Error', "Unexpected length, please exit program")
-                exit()
-
-            if int(raw[:2]) == 80:
-                bootable = "not bootable"
-            elif int(raw[:2]) == 00:
-                bootable = "not bootable"
-            else:
-                QMessageBox.critical(self,'MBR Error', "UnExpected PartitionTable Headerraw, please exit program")
-                exit()
-            Cylinder = raw[2:4]
-            Head = raw[4:6]
-            Sector = raw[6:8]
-            Type_B = raw[8:10]
-            Type = type_check(Type_B)
-            Cylinder2 = raw[10:12]
-            Head2 = raw[12:14]
-            Sector2 = raw[14:16]
-            FirstSector = le(raw[16:24])
-            TotalSector = le(raw[24:32])
-            LastSector = FirstSector + TotalSector
-            return [Cylinder, Head, Sector, Type_B, Type, Cylinder2, Head2, Sector2, FirstSector, TotalSector, LastSector]
-
-        boot_code = rawH[:880]
-        DiskSig = rawH[880:892]
-        PartitionTable = rawH[892:1020]
-        PartitionTable_B = rawH[3568:4080]
-        Signature = rawH[-4:]
-        p1 = PartitionTable[:32]
-        p2 = PartitionTable[32:64]
-        p3 = PartitionTable[64:96]
-        p4 = PartitionTable[-32:]
-
-        
-        part1 = partition(p1)
-        part2 = partition(p2)
-        part3 = partition(p3)
-        part4 = partition(p4)
-        Partition_Tables = []
-
-        if part1 != "Empty":
-            Partition_Tables.append(part1)
-        if part2 != "Empty":
-            Partition_Tables.append(part2)
-        if part3 != "Empty":
-            Partition_Tables.append(part3)
-        if part4 != "Empty":
-            Partition_Tables.append(part4)
+        try:
+            return partition_scheme(path)
+        except (OSError, PartitionTableError) as e:
+            print(f"Can't tell the partition scheme of {path}: {e}")
+            return "MBR"
+
+    def slide(self, old_first, old_last, new_first, disk_path, type_byte=None):
+        # Queued, it starts right away unless another slide is still busy with the same disk
+        journal = SlideJournal(disk_path, {
+            "part": self.part_selected, "old_first": int(old_first), "old_last": int(old_last),
+            "new_first": int(new_first), "sector_size": self.sector_size,
+            "logical_sector_size": self.logical_sector_size, "type_byte": type_byte,
+            "expect": [[self.part_selected, int(old_first)]]})
+        self.enqueue(journal, f"{disk_path}: partition {self.current_info[4][self.part_selected][11] + 1} "
+                              f"from sector {old_first} to {new_first}")
+
+    def plan_slide(self, path):
+        # Moves every partition that was dragged somewhere else, in an order that doesn't overwrite anything
+        # still to be read, neighbours moving by the same offset in one pass, and the table written once at the end
+        self.current_info = self.MBR(path)
+        display = self.partition_display
+        targets = {self.part_index[i]: int(start) for i, (start, _, _) in enumerate(display.partitions)
+                   if start != display.original_partitions[i][0]}
+        if not targets:
+            QMessageBox.information(self, "Move Plan", "No partition was moved.")
+            return
+        try:
+            steps = mbr_plan(self.current_info, targets)
+        except MovePlanError as e:
+            QMessageBox.warning(self, "Move Plan", str(e))
+            return
+        names = lambda members: ", ".join(self.current_info[4][m][4] for m in members)
+        text = "\n".join(f"{n}. {names(members)}: sector {first} to {new_first}"
+                         for n, (first, _, new_first, members, _) in enumerate(steps, 1))
+        answer = QMessageBox.question(self, "Move Plan", f"{len(targets)} partitions in {len(steps)} steps:\n{text}\n\nStart?")
+        if answer != QMessageBox.StandardButton.Yes:
+            return
 
-        return [rawH, DiskSig, PartitionTable, Signature, Partition_Tables] #Partition_Tables are parsed, in form of list of [Cylinder, Head, Sector, Type_B, Type, Cylinder2, Head2, Sector2, FirstSector, TotalSector, LastSector]
+        journal = SlideJournal(path, {
+            "plan": steps, "moves": [[i, new_first] for i, new_first in sorted(targets.items())],
+            "sector_size": self.sector_size, "logical_sector_size": self.logical_sector_size,
+            "expect": [[i, int(self.current_info[4][i][8])] for i in sorted(targets)]})
+        self.current_path = path
+        self.enqueue(journal, f"{path}: move plan of {len(targets)} partitions in {len(steps)} steps")
+
+    def copy_options(self):
+        # The copy settings from the window, as SlideRunner arguments. The memory limit is for all the running
+        # slides together, the queue splits it
+        return dict(direct_io=self.direct_io.isChecked(), used_only=self.used_only.isChecked(),
+                    verify=self.verify_copy.isChecked(), engine=self.engine_select.currentText().split()[0].lower(),
+                    queue_depth=self.queue_depth.value() or None,  # 0 is Auto
+                    durability=DURABILITY_POLICIES[self.durability_select.currentIndex()])  # same order as the combo
+
+    def enqueue(self, journal, label, force=False):
+        self.jobs.memory_limit = self.mem_limit.value() * 1024 * 1024
+        job = SlideJob(journal, label=label, force=force, **self.copy_options())
+        self.job_list.addItem(f"{label} - queued")
+        self.jobs.add(job)
+        self.update_total()
+
+    def job_event(self, job, event, data):
+        # From the job threads through JobEvents, so this runs in the GUI thread
+        row = self.jobs.jobs.index(job)
+        if event == "progress":
+            self.job_list.item(row).setText(f"{job.label} - {data['percent']}%, {data['smoothed_mib_s']:.1f} MiB/s")
+            self.update_total()
+        elif event == "report":
+            self.status_label.setText(data)
+        elif event == "verify_failed":
+            self.show_mismatches(data)
+        else:
+            self.job_list.item(row).setText(f"{job.label} - {data}" + (f": {job.message}" if job.message else ""))
+            self.update_total()
+            if data == "failed":
+                QMessageBox.warning(self, "Slide", f"{job.label}\n{job.message}")
+            elif data == "done":
+                print(f"{job.label}: {job.message}")
+
+    def update_total(self):
+        # The progress bar and ETA are for every job in the queue together
+        done_bytes, total_bytes, eta_seconds = self.jobs.progress()
+        running = [job for job in self.jobs.active() if job.status == "running"]
+        self.progressBar.setValue(int(done_bytes * 100 / total_bytes) if total_bytes else 0)
+        rate = sum(job.snapshot["smoothed_mib_s"] for job in running if job.snapshot)
+        self.progressBar.setFormat(f"%p%  {len(running)} running, {rate:.1f} MiB/s, "
+                                   f"{(total_bytes - done_bytes) / (1024 ** 3):.2f} GiB left" if running else "%p%")
+        if eta_seconds is not None:
+            self.ETA.setText(format_eta(eta_seconds))
+
+    def verify_only(self):
+        # Check a finished slide against its manifest without copying anything
+        if self.thread is not None and self.thread.isRunning():
+            QMessageBox.warning(self, "Operation in Progress", "A verify is already running.")
+            return
+        if self.jobs.busy(self.d_select.currentText()):
+            QMessageBox.warning(self, "Operation in Progress", "A slide on this disk is still queued or running.")
+            return
+        manifest = manifest_path(self.d_select.currentText())
+        if not os.path.exists(manifest):
+            QMessageBox.information(self, "Verify", "No slide manifest for this disk, enable 'Verify copy' when sliding.")
+            return
 
+        self.progressBar.setFormat("%p%")
+        self.thread = QThread()
+        self.worker = VerifyWorker(manifest)
+        self.worker.moveToThread(self.thread)
+        self.worker.progress.connect(self.update_progress)
+        self.worker.finished.connect(self.verify_finished)
+        self.thread.started.connect(self.worker.run)
+        self.verify_button.setEnabled(False)
+        self.thread.start()
 
+    def verify_finished(self, mismatches):
+        self.verify_button.setEnabled(True)
+        self.thread.quit()
+        self.thread.wait()
+        self.thread = None
+        self.worker = None
+        if mismatches:
+            self.show_mismatches(mismatches)
+        else:
+            QMessageBox.information(self, "Verify", "All chunks match the manifest.")
 
-    def slide(self, old_first, old_last, new_first, disk_path):
+    def estimate(self):
+        # Checks the move shown and probes the disk, the predicted duration goes in the ETA field
         if self.thread is not None and self.thread.isRunning():
-            QMessageBox.warning(self, "Operation in Progress", "A slide operation is already running.")
+            QMessageBox.warning(self, "Operation in Progress", "A verify or estimate is already running.")
+            return
+        if getattr(self, "option", None) != "MBR" or self.p_select.currentIndex() < 0:
+            return
+        path = self.d_select.currentText()
+        mbr_info = self.MBR(path)
+        display = self.partition_display
+        if self.plan_moves.isChecked():
+            targets = {self.part_index[i]: int(start) for i, (start, _, _) in enumerate(display.partitions)
+                       if start != display.original_partitions[i][0]}
+        else:
+            targets = {self.part_index[self.p_select.currentIndex()]: int(self.new_start_sec.text() or 0)}
+        targets = {i: new_first for i, new_first in targets.items() if new_first != mbr_info[4][i][8]}
+        if not targets:
+            QMessageBox.information(self, "Estimate", "No partition was moved.")
+            return
+        problems = slide_problems(mbr_info, targets, self.logical_sector_size, disk_size(path))
+        if problems:
+            QMessageBox.warning(self, "Estimate", "\n".join(problems))
             return
 
+        options = dict(self.copy_options(), logical_sector_size=self.logical_sector_size,
+                       memory_limit=self.mem_limit.value() * 1024 * 1024)
+        if len(targets) > 1:
+            runner = PlanRunner(path, mbr_plan(mbr_info, targets), self.sector_size, **options)
+        else:
+            (i, new_first), = targets.items()
+            part = mbr_info[4][i]
+            runner = SlideRunner(part[8], part[10], new_first, path, self.sector_size, type_byte=part[3], **options)
+        self.status_label.setText("Estimating...")
         self.thread = QThread()
-        self.worker = SlideWorker(old_first, old_last, new_first, disk_path, self.sector_size)
+        self.worker = ProbeWorker(runner)
         self.worker.moveToThread(self.thread)
-        self.worker.progress.connect(self.update_progress)  # Assuming these signals exist
-        self.worker.eta.connect(self.update_eta)
-        self.worker.finished.connect(self.slide_finished)  # Connect to completion handler
+        self.worker.finished.connect(self.estimate_finished)
         self.thread.started.connect(self.worker.run)
-        self.start_button.setEnabled(False)  # Disable UI during operation
+        self.probe_button.setEnabled(False)
         self.thread.start()
 
-    def update_progress(self, value):
-        self.progressBar.setValue(value)
-
-    def update_eta(self, eta_str):
-        self.ETA.setText(eta_str)
-
-    def slide_finished(self):
-        # First, update the MBR
-        self.update_mbr()
-        # Then, clean up and update UI
-        self.start_button.setEnabled(True)
+    def estimate_finished(self, result):
+        self.probe_button.setEnabled(True)
         self.thread.quit()
         self.thread.wait()
         self.thread = None
         self.worker = None
-        print("Slide operation and MBR update completed")
-
-    def update_mbr(self): #since it's using replace menthod, there is a chance for identical bytes getting replaced by partition table, but the chance is very very small and I'm lazy, so fix won't be introduced in the pre release, I will do it later
-        
-        if self.current_info is None or self.part_selected is None or self.current_new_first is None or self.current_path is None:
-            print("Error: Missing information for MBR update")
+        if "error" in result:
+            self.status_label.setText(f"Estimate failed: {result['error']}")
             return
-
-        New_First = self.current_new_first
-        path = self.current_path
-        print(f"Opening disk with path in update_mbr: {path}")
-        try:
-            disk = open(r'{}'.format(path), 'r+b', buffering=0)
-            try:
-                ptable = self.get_mbr_partition(self.current_info[2], self.part_selected) #get the specific raw partition table we want
-                ptable_new = ptable.replace(ptable[16:24], (el(New_First)).ljust(8, "0"))
-                
-                print("ptable_new:", ptable_new)
-                print("old mbr", self.current_info[0])
-
-                mbr_new = self.current_info[0].replace(ptable, ptable_new)
-                disk.seek(0)
-                print("mbr_new:", mbr_new)
-                disk.write(bytes.fromhex(mbr_new))
-
-                disk.flush()
-            finally:
-                disk.close()  # Explicitly close the file
-                print(f"Closed disk in update_mbr: {path}")
-        except OSError as e:
-            print(f"Failed to open or write to disk in update_mbr: {e}")
+        seconds = result["estimate_seconds"]
+        if seconds is None:
+            self.status_label.setText("Estimate: nothing could be read from the disk")
             return
+        self.ETA.setText("~ " + format_eta(seconds))
+        first = result["steps"][0] if "steps" in result else result
+        reads = [s["read_mib_s"] for s in result.get("steps", [result]) if s["read_mib_s"]]
+        text = (f"Estimate: {result['copy_bytes'] / (1024 ** 3):.2f} GiB to copy"
+                + (f" in {len(result['steps'])} steps" if "steps" in result else "")
+                + f", {first['engine']} engine, {first['mode']} I/O, chunk {first['chunk_bytes'] / (1024 ** 2):g} MiB")
+        if reads:
+            text += f", reads {min(reads):.0f} MiB/s"
+        self.status_label.setText(text)
+
+    def show_mismatches(self, mismatches):
+        offsets = ", ".join(str(o) for o in mismatches[:10]) + (" ..." if len(mismatches) > 10 else "")
+        QMessageBox.critical(self, "Verify", f"{len(mismatches)} chunks don't match (byte offsets in partition: {offsets})")
 
+    def update_progress(self, value):
+        self.progressBar.setValue(value)
 
+    def closeEvent(self, event):
+        if self.jobs.active():
+            answer = QMessageBox.question(self, "Slides Running", "Slides are still queued or running. Quit anyway?\n"
+                                          "Running slides can be resumed from their journals on the next start.")
+            if answer != QMessageBox.StandardButton.Yes:
+                event.ignore()
+                return
+        super().closeEvent(event)
 
-    def get_mbr_partition(self, PartitionTable, part_number):
-        if len(PartitionTable) != 128:
-            print("partitionTable length incorrect, not equal to 128")
-        part_size = 32
-
+    def GPT(self, disk_path):
+        try:
+            return read_gpt(disk_path, self.logical_sector_size or None)
+        except PartitionTableError as e:
+            QMessageBox.critical(self,'GPT Error', str(e))
+            return None
 
-        start = part_number * part_size
-        print("start:", start)
-        end = start + part_size
-        print("end:", end)
-        print("PartitionTable[start:end]:", PartitionTable[start:end])
-            # Return the desired part
-        return PartitionTable[start:end]
+    def MBR(self, disk_path):
+        try:
+            return read_mbr(disk_path, self.logical_sector_size)
+        except PartitionTableError as e:
+            QMessageBox.critical(self,'MBR Error', str(e))
+            exit()
 
     def Start(self, c1, path, c2, New_First):
         if c1 == "MBR":
             self.current_info = self.MBR(path)  # Assuming this retrieves MBR info
+            part = self.current_info[4][c2]
+            if part[12] is not None and not (part[12] < int(New_First) and int(New_First) + part[9] <= part[13]):
+                QMessageBox.warning(self, "Logical Partition", f"A logical partition has to stay after its EBR (sector "
+                                    f"{part[12]}) and end by sector {part[13]}.")
+                return
             # Store the variables for later use
 
             self.part_selected = c2
@@ -951,7 +987,8 @@ class MainWindow(QMainWindow):
             print("New_First", New_First)
             self.current_path = path
             # Start the slide operation
-            self.slide(self.current_info[4][c2][8], self.current_info[4][c2][10], New_First, path)
+            self.slide(self.current_info[4][c2][8], self.current_info[4][c2][10], New_First, path,
+                       type_byte=self.current_info[4][c2][3])
             # Do NOT update MBR here
         elif c1 == "GPT":
 
@@ -962,6 +999,7 @@ if __name__ == '__main__':
     app = QApplication(sys.argv)
     app.setStyle("Windows")
     mainwindow = MainWindow()
-    mainwindow.setFixedSize(800, 400)
+    mainwindow.setFixedSize(800, 480)
     mainwindow.show()
     sys.exit(app.exec())
+